@@ -10,6 +10,15 @@ class Settings(BaseSettings):
     supabase_url: str = os.getenv("SUPABASE_URL", "")
     supabase_key: str = os.getenv("SUPABASE_KEY", "")
     supabase_service_role_key: str = os.getenv("SUPABASE_SERVICE_ROLE_KEY", "")
+    supabase_max_concurrency: int = int(os.getenv("SUPABASE_MAX_CONCURRENCY", "16"))
+    supabase_timeout_seconds: float = float(os.getenv("SUPABASE_TIMEOUT_SECONDS", "30"))
+    supabase_upload_timeout_seconds: float = float(os.getenv("SUPABASE_UPLOAD_TIMEOUT_SECONDS", "300"))
+    
+    # Authentication Configuration
+    supabase_jwt_secret: str = os.getenv("SUPABASE_JWT_SECRET", "")
+    jwt_audience: str = os.getenv("JWT_AUDIENCE", "authenticated")
+    auth_cache_ttl_seconds: float = float(os.getenv("AUTH_CACHE_TTL_SECONDS", "300"))
+    auth_cache_max_entries: int = int(os.getenv("AUTH_CACHE_MAX_ENTRIES", "10000"))
     
     # OpenAI Configuration
     openai_api_key: str = os.getenv("OPENAI_API_KEY", "")
@@ -21,12 +30,72 @@ class Settings(BaseSettings):
     # File Upload Configuration
     max_file_size_mb: int = int(os.getenv("MAX_FILE_SIZE_MB", "50"))
     allowed_file_types: List[str] = os.getenv("ALLOWED_FILE_TYPES", "pdf,txt,md,docx").split(",")
+    upload_spool_dir: str = os.getenv("UPLOAD_SPOOL_DIR", "data/uploads")
+    upload_chunk_size_kb: int = int(os.getenv("UPLOAD_CHUNK_SIZE_KB", "1024"))
     
     # Vector Embeddings Configuration
     embedding_model: str = os.getenv("EMBEDDING_MODEL", "text-embedding-ada-002")
     embedding_dimensions: int = int(os.getenv("EMBEDDING_DIMENSIONS", "1536"))
+    embedding_max_tokens: int = int(os.getenv("EMBEDDING_MAX_TOKENS", "8191"))
     chunk_size: int = int(os.getenv("CHUNK_SIZE", "1000"))
     chunk_overlap: int = int(os.getenv("CHUNK_OVERLAP", "200"))
+    embedding_batch_max_tokens: int = int(os.getenv("EMBEDDING_BATCH_MAX_TOKENS", "100000"))
+    embedding_batch_max_items: int = int(os.getenv("EMBEDDING_BATCH_MAX_ITEMS", "512"))
+    embedding_concurrency: int = int(os.getenv("EMBEDDING_CONCURRENCY", "4"))
+    chunk_insert_batch_size: int = int(os.getenv("CHUNK_INSERT_BATCH_SIZE", "200"))
+    embedding_cache_path: str = os.getenv("EMBEDDING_CACHE_PATH", "data/embedding_cache.db")
+    embedding_cache_memory_entries: int = int(os.getenv("EMBEDDING_CACHE_MEMORY_ENTRIES", "10000"))
+    
+    # Retrieval Configuration
+    retrieval_backend: str = os.getenv("RETRIEVAL_BACKEND", "dense")  # "dense" (pgvector HNSW) or "ann" (local IVF index)
+    ann_index_dir: str = os.getenv("ANN_INDEX_DIR", "data/ann")
+    ann_train_threshold: int = int(os.getenv("ANN_TRAIN_THRESHOLD", "5000"))
+    ann_nprobe: int = int(os.getenv("ANN_NPROBE", "8"))
+    retrieval_top_k: int = int(os.getenv("RETRIEVAL_TOP_K", "40"))
+    hnsw_ef_search: int = int(os.getenv("HNSW_EF_SEARCH", "40"))
+    hnsw_exact_scan_rows: int = int(os.getenv("HNSW_EXACT_SCAN_ROWS", "10000"))
+    hnsw_max_scan_tuples: int = int(os.getenv("HNSW_MAX_SCAN_TUPLES", "20000"))
+    
+    # Search Configuration
+    search_index_path: str = os.getenv("SEARCH_INDEX_PATH", "data/search_index.db")
+    search_candidates: int = int(os.getenv("SEARCH_CANDIDATES", "50"))
+    search_rrf_k: int = int(os.getenv("SEARCH_RRF_K", "60"))
+    
+    # Context Packing Configuration
+    context_mmr_lambda: float = float(os.getenv("CONTEXT_MMR_LAMBDA", "0.7"))
+    preview_context_tokens: int = int(os.getenv("PREVIEW_CONTEXT_TOKENS", "2500"))
+    generation_context_tokens: int = int(os.getenv("GENERATION_CONTEXT_TOKENS", "3500"))
+    refinement_context_tokens: int = int(os.getenv("REFINEMENT_CONTEXT_TOKENS", "1500"))
+    context_compression_ratio: float = float(os.getenv("CONTEXT_COMPRESSION_RATIO", "0.6"))  # 1.0 disables
+    compression_duplicate_threshold: float = float(os.getenv("COMPRESSION_DUPLICATE_THRESHOLD", "0.8"))
+    
+    # LLM Response Cache Configuration
+    response_cache_ttl_seconds: float = float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "3600"))
+    response_cache_max_entries: int = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "500"))
+    
+    # Template Cache Configuration
+    template_cache_ttl_seconds: float = float(os.getenv("TEMPLATE_CACHE_TTL_SECONDS", "300"))
+    template_versions_path: str = os.getenv("TEMPLATE_VERSIONS_PATH", "data/template_versions.db")
+    template_usage_flush_seconds: float = float(os.getenv("TEMPLATE_USAGE_FLUSH_SECONDS", "5"))
+    
+    # Sectioned Generation Configuration
+    section_concurrency: int = int(os.getenv("SECTION_CONCURRENCY", "4"))
+    section_retrieval_top_k: int = int(os.getenv("SECTION_RETRIEVAL_TOP_K", "15"))
+    section_context_tokens: int = int(os.getenv("SECTION_CONTEXT_TOKENS", "2000"))
+    section_max_tokens: int = int(os.getenv("SECTION_MAX_TOKENS", "1500"))
+    
+    # Version History Configuration
+    version_snapshot_interval: int = int(os.getenv("VERSION_SNAPSHOT_INTERVAL", "10"))
+    
+    # Document Extraction Configuration
+    extraction_workers: int = int(os.getenv("EXTRACTION_WORKERS", str(os.cpu_count() or 2)))
+    extraction_timeout_seconds: float = float(os.getenv("EXTRACTION_TIMEOUT_SECONDS", "120"))
+    
+    # Background Ingestion Configuration
+    ingestion_queue_path: str = os.getenv("INGESTION_QUEUE_PATH", "data/ingestion_queue.db")
+    ingestion_concurrency: int = int(os.getenv("INGESTION_CONCURRENCY", "2"))
+    ingestion_max_attempts: int = int(os.getenv("INGESTION_MAX_ATTEMPTS", "3"))
+    ingestion_lease_seconds: float = float(os.getenv("INGESTION_LEASE_SECONDS", "600"))
     
     class Config:
         env_file = ".env"
@@ -7,6 +7,14 @@ import os
 
 from app.config import settings
 from app.routers import documents, content, templates, auth
+from app.services.extraction_executor import extraction_executor
+from app.services.supabase_client import supabase_client
+from app.services.upload_spool import UploadSizeLimitMiddleware, upload_spooler
+from app.services.ingestion_queue import ingestion_queue
+from app.services.embedding_cache import embedding_cache
+from app.services.context_compressor import context_compressor
+from app.services.response_cache import response_cache
+from app.services.usage_counter import usage_counter
 
 # Initialize FastAPI app
 app = FastAPI(
@@ -24,19 +32,43 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Reject oversized uploads while the body is still streaming in
+# (with headroom for multipart framing and the other form fields)
+app.add_middleware(
+    UploadSizeLimitMiddleware,
+    max_bytes=upload_spooler.max_bytes + 64 * 1024
+)
+
 # Include routers
 app.include_router(auth.router, prefix="/api/auth", tags=["authentication"])
 app.include_router(documents.router, prefix="/api/documents", tags=["documents"])
 app.include_router(content.router, prefix="/api/content", tags=["content"])
 app.include_router(templates.router, prefix="/api/templates", tags=["templates"])
 
+@app.on_event("startup")
+async def startup_event():
+    await ingestion_queue.start()
+    await usage_counter.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await ingestion_queue.stop()
+    await usage_counter.stop()
+    extraction_executor.shutdown()
+    supabase_client.shutdown()
+
 @app.get("/")
 async def root():
     return {"message": "Crater API is running"}
 
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy"}
+    return {
+        "status": "healthy",
+        "embedding_cache": embedding_cache.stats(),
+        "context_compression": context_compressor.stats(),
+        "response_cache": response_cache.stats()
+    }
 
 if __name__ == "__main__":
     uvicorn.run(
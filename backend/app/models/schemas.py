@@ -36,6 +36,7 @@ class Document(DocumentBase):
     user_id: str
     file_path: str
     extracted_text: Optional[str] = None
+    content_hash: Optional[str] = None
     status: DocumentStatus
     created_at: datetime
     updated_at: datetime
@@ -43,6 +44,30 @@ class Document(DocumentBase):
     class Config:
         from_attributes = True
 
+class DocumentSummary(DocumentBase):
+    """List item: everything but the extracted text, unless requested via `fields`"""
+    id: str
+    user_id: str
+    file_path: str
+    content_hash: Optional[str] = None
+    status: DocumentStatus
+    created_at: datetime
+    updated_at: datetime
+    extracted_text: Optional[str] = None
+
+class DocumentPage(BaseModel):
+    items: List[DocumentSummary]
+    next_cursor: Optional[str] = None
+
+class DocumentProcessingStatus(BaseModel):
+    document_id: str
+    status: DocumentStatus
+    stage: Optional[str] = None
+    progress: float = 0.0
+    attempts: int = 0
+    error: Optional[str] = None
+    detail: Dict[str, Any] = {}
+
 class DocumentChunk(BaseModel):
     id: str
     document_id: str
@@ -108,6 +133,25 @@ class GeneratedDoc(GeneratedDocBase):
     class Config:
         from_attributes = True
 
+class GeneratedDocSummary(BaseModel):
+    """List item: everything but the content and ToC, unless requested via `fields`"""
+    id: str
+    user_id: str
+    title: str
+    template_id: Optional[str] = None
+    source_doc_ids: List[str] = []
+    metadata: Dict[str, Any] = {}
+    version: int = 1
+    status: str = "draft"
+    created_at: datetime
+    updated_at: datetime
+    content: Optional[str] = None
+    toc: Optional[Dict[str, Any]] = None
+
+class GeneratedDocPage(BaseModel):
+    items: List[GeneratedDocSummary]
+    next_cursor: Optional[str] = None
+
 class DocVersion(BaseModel):
     id: str
     generated_doc_id: str
@@ -122,6 +166,7 @@ class ContentGenerationRequest(BaseModel):
     custom_prompt: Optional[str] = None
     output_format: Optional[str] = None
     parameters: Dict[str, Any] = {}
+    toc: Optional[Dict[str, Any]] = None
 
 class ContentGenerationResponse(BaseModel):
     toc: Dict[str, Any]
@@ -2,6 +2,7 @@ from fastapi import APIRouter, HTTPException, Depends
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from app.models.schemas import User
 from app.services.supabase_client import supabase_client
+from app.services.token_verifier import token_verifier
 from typing import Optional
 import logging
 
@@ -13,18 +14,13 @@ security = HTTPBearer()
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> User:
     """Get current authenticated user"""
     try:
-        # Verify token with Supabase
-        response = supabase_client.get_client().auth.get_user(credentials.credentials)
+        # Verified locally when possible, otherwise with Supabase
+        user = await token_verifier.verify(credentials.credentials)
         
-        if not response.user:
+        if user is None:
             raise HTTPException(status_code=401, detail="Invalid authentication credentials")
         
-        return User(
-            id=response.user.id,
-            email=response.user.email,
-            name=response.user.user_metadata.get("name"),
-            created_at=response.user.created_at
-        )
+        return user
     except Exception as e:
         logger.error(f"Authentication error: {e}")
         raise HTTPException(status_code=401, detail="Invalid authentication credentials")
@@ -38,7 +34,7 @@ async def get_current_user_info(current_user: User = Depends(get_current_user)):
 async def logout():
     """Logout user"""
     try:
-        supabase_client.get_client().auth.sign_out()
+        await supabase_client.run(supabase_client.get_client().auth.sign_out)
         return {"message": "Successfully logged out"}
     except Exception as e:
         logger.error(f"Logout error: {e}")
@@ -1,12 +1,23 @@
-from fastapi import APIRouter, HTTPException, Depends, BackgroundTasks
-from typing import List, Optional
+from fastapi import APIRouter, HTTPException, Depends, BackgroundTasks, Query, Response
+from fastapi.responses import StreamingResponse
+from typing import AsyncIterator, Dict, List, Optional, Tuple
 from app.models.schemas import (
     GeneratedDoc, GeneratedDocCreate, GeneratedDocUpdate,
-    ContentGenerationRequest, ContentGenerationResponse
+    ContentGenerationRequest, ContentGenerationResponse,
+    GeneratedDocSummary, GeneratedDocPage, DocVersion
 )
 from app.services.supabase_client import supabase_client
 from app.services.content_generator import content_generator
+from app.services.pdf_processor import pdf_processor
+from app.services.context_compressor import context_compressor
+from app.services.document_sections import split_sections, section_text
+from app.services.version_store import version_store
+from app.services.response_cache import response_cache
+from app.services.pagination import MAX_PAGE_SIZE, decode_cursor, keyset_page, select_columns, split_page
 from app.routers.auth import get_current_user, User
+from app.config import settings
+import asyncio
+import json
 import logging
 import uuid
 
@@ -14,31 +25,250 @@ logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+DEFAULT_RETRIEVAL_QUERY = "Key topics, facts, arguments and findings of the source material"
+
+async def _get_source_documents(request: ContentGenerationRequest, current_user: User) -> Dict[str, dict]:
+    """The user's source documents for a request, keyed by id"""
+    response = await supabase_client.execute(supabase_client.get_client().table("documents").select("id, title, updated_at, content_hash").in_("id", request.source_doc_ids).eq("user_id", current_user.id))
+    
+    if not response.data:
+        raise HTTPException(status_code=404, detail="Source documents not found")
+    
+    return {doc["id"]: doc for doc in response.data}
+
+def _request_cache_key(kind: str, request: ContentGenerationRequest, documents: Dict[str, dict]) -> str:
+    """Response cache key for a whole request, built before any retrieval runs.
+
+    It covers everything that shapes the answer: the request itself, the
+    retrieval and packing settings, and the version of every source
+    document, so a hit skips query embedding, the chunk search, compression
+    and packing as well as the model call.
+    """
+    params = {
+        "kind": kind,
+        "template_id": request.template_id,
+        "custom_prompt": request.custom_prompt,
+        "output_format": request.output_format,
+        "toc": request.toc,
+        "retrieval_top_k": settings.retrieval_top_k,
+        "section_retrieval_top_k": settings.section_retrieval_top_k,
+        "context_compression_ratio": settings.context_compression_ratio,
+        "context_mmr_lambda": settings.context_mmr_lambda,
+        "preview_context_tokens": settings.preview_context_tokens,
+        "generation_context_tokens": settings.generation_context_tokens,
+        "section_context_tokens": settings.section_context_tokens
+    }
+    sources = {doc_id: f"{doc['updated_at']}:{doc['content_hash']}" for doc_id, doc in documents.items()}
+    return response_cache.make_key("gpt-4", params, "", sources)
+
+async def _retrieve_chunks(
+    query: str,
+    documents: Dict[str, dict],
+    current_user: User,
+    top_k: int
+) -> Tuple[List[dict], Optional[dict]]:
+    """Candidate chunks of the documents for a query, ranked server-side by pgvector,
+    and the compression report (None with compression off).
+    Embeddings come back too so the context assembler can diversify them."""
+    chunks = await content_generator.search_source_chunks(
+        query,
+        current_user.id,
+        list(documents),
+        top_k,
+        include_embeddings=True
+    )
+    
+    if not chunks:
+        # Documents ingested before chunking existed only have extracted_text
+        response = await supabase_client.execute(supabase_client.get_client().table("documents").select("id, title, extracted_text").in_("id", list(documents)).eq("user_id", current_user.id))
+        chunks = [
+            {**chunk, "chunk_index": chunk["index"], "document_id": doc["id"]}
+            for doc in response.data
+            if doc["extracted_text"]
+            for chunk in pdf_processor.chunk_text(doc["extracted_text"])
+        ]
+    
+    if not chunks:
+        raise HTTPException(status_code=400, detail="No text content found in source documents")
+    
+    for chunk in chunks:
+        chunk["title"] = documents[chunk["document_id"]]["title"]
+    
+    if settings.context_compression_ratio < 1:
+        chunks, report = await asyncio.to_thread(context_compressor.compress, chunks)
+        logger.info(f"Compressed source context for user {current_user.id}: {report}")
+        return chunks, report
+    return chunks, None
+
+def _compression_headers(reports: List[Optional[dict]]) -> Dict[str, str]:
+    """The X-Context-Compression header: tokens saved by compression across a request's retrievals"""
+    reports = [report for report in reports if report]
+    if not reports:
+        return {}
+    original = sum(report["original_tokens"] for report in reports)
+    compressed = sum(report["compressed_tokens"] for report in reports)
+    return {"X-Context-Compression": (
+        f"original_tokens={original}, compressed_tokens={compressed}, tokens_saved={original - compressed}, "
+        f"sentences_dropped={sum(report['sentences_dropped'] for report in reports)}"
+    )}
+
+async def _get_source_chunks(
+    request: ContentGenerationRequest,
+    current_user: User,
+    documents: Dict[str, dict]
+) -> Tuple[List[dict], Optional[dict]]:
+    """Candidate source chunks for a whole-document generation request, and their compression report"""
+    return await _retrieve_chunks(
+        request.custom_prompt or DEFAULT_RETRIEVAL_QUERY, documents, current_user, settings.retrieval_top_k
+    )
+
+async def _get_section_chunks(
+    current_user: User,
+    documents: Dict[str, dict],
+    sections: List[Dict[str, str]]
+) -> Tuple[List[List[dict]], List[Optional[dict]]]:
+    """Candidate chunks for each ToC section, retrieved with the section as the query,
+    and the compression report of each"""
+    queries = [f"{section['title']}: {section['description']}".rstrip(": ") for section in sections]
+    # One embeddings request for every section; the searches then hit the embedding cache
+    await content_generator.generate_embeddings(queries)
+    results = await asyncio.gather(*(
+        _retrieve_chunks(query, documents, current_user, settings.section_retrieval_top_k)
+        for query in queries
+    ))
+    return [chunks for chunks, _ in results], [report for _, report in results]
+
+async def _get_refinement_chunks(doc: dict, refinement_prompt: str, current_user: User) -> Tuple[List[dict], Optional[dict]]:
+    """Source chunks of a generated document relevant to a refinement request.
+
+    Refinement works without them: a document whose sources were deleted,
+    or never had text, is refined from its own content alone.
+    """
+    if not doc.get("source_doc_ids"):
+        return [], None
+    response = await supabase_client.execute(supabase_client.get_client().table("documents").select("id, title, updated_at, content_hash").in_("id", doc["source_doc_ids"]).eq("user_id", current_user.id))
+    if not response.data:
+        return [], None
+    try:
+        return await _retrieve_chunks(
+            refinement_prompt, {source["id"]: source for source in response.data}, current_user, settings.section_retrieval_top_k
+        )
+    except HTTPException:
+        return [], None
+
+async def _save_generated_doc(request: ContentGenerationRequest, current_user: User, content: str) -> GeneratedDoc:
+    """Create the generated document record for a finished generation"""
+    doc_id = str(uuid.uuid4())
+    generated_doc_data = {
+        "id": doc_id,
+        "user_id": current_user.id,
+        "title": f"Generated Content {doc_id[:8]}",
+        "content": content,
+        "template_id": request.template_id,
+        "source_doc_ids": request.source_doc_ids,
+        "toc": request.toc,
+        "metadata": request.parameters,
+        "version": 1,
+        "status": "draft"
+    }
+    
+    response = await supabase_client.execute(supabase_client.get_client().table("generated_docs").insert(generated_doc_data))
+    try:
+        await version_store.record(doc_id, 1, content, current_user.id)
+    except Exception:
+        # A document without its first version couldn't be restored later; don't keep it
+        await supabase_client.execute(supabase_client.get_client().table("generated_docs").delete().eq("id", doc_id).eq("user_id", current_user.id))
+        raise
+    
+    return GeneratedDoc(**response.data[0])
+
+async def _save_new_version(doc: dict, update_data: dict, user_id: str) -> GeneratedDoc:
+    """Save a content change as the next version of a generated document.
+
+    The update only applies while the row is still at the version it was
+    read at, so of two concurrent writers the second gets a 409 instead of
+    overwriting the first. If the version history can't record the change,
+    the row is put back and the error is raised.
+    """
+    version = doc["version"] + 1
+    response = await supabase_client.execute(
+        supabase_client.get_client().table("generated_docs").update({**update_data, "version": version}).eq("id", doc["id"]).eq("user_id", user_id).eq("version", doc["version"])
+    )
+    if not response.data:
+        raise HTTPException(status_code=409, detail="Generated document was changed by another request; reload it and try again")
+    
+    try:
+        await version_store.record(doc["id"], version, update_data["content"], user_id, (doc["version"], doc["content"]))
+    except Exception:
+        restore = {key: doc[key] for key in update_data}
+        restore["version"] = doc["version"]
+        await supabase_client.execute(
+            supabase_client.get_client().table("generated_docs").update(restore).eq("id", doc["id"]).eq("user_id", user_id).eq("version", version)
+        )
+        raise
+    
+    return GeneratedDoc(**response.data[0])
+
+def _sse(event: str, data: str) -> str:
+    return f"event: {event}\ndata: {data}\n\n"
+
+def _sse_response(events: AsyncIterator[str], headers: Optional[Dict[str, str]] = None) -> StreamingResponse:
+    # Tell proxies not to buffer, or tokens arrive in one burst at the end
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no", **(headers or {})}
+    )
+
+async def _stream_events(prompt: str, save, error_detail: str) -> AsyncIterator[str]:
+    """Forward model tokens as SSE events and save the full text once the model finishes.
+
+    When the client disconnects, Starlette cancels this generator; the
+    cancellation closes the upstream model stream and nothing is saved.
+    """
+    parts = []
+    try:
+        async for delta in content_generator.stream_completion(prompt):
+            parts.append(delta)
+            yield _sse("token", json.dumps({"text": delta}))
+        saved = await save("".join(parts))
+        yield _sse("done", saved.json())
+    except asyncio.CancelledError:
+        logger.info(f"Client disconnected after {len(parts)} streamed tokens; generation cancelled")
+        raise
+    except HTTPException as e:
+        yield _sse("error", json.dumps({"detail": e.detail, "status": e.status_code}))
+    except Exception as e:
+        logger.error(f"Error streaming content: {e}")
+        yield _sse("error", json.dumps({"detail": error_detail}))
+
+async def _stream_cached(content: str, save, error_detail: str) -> AsyncIterator[str]:
+    """Replay a cached answer as a single token event, then save it like a streamed one"""
+    try:
+        yield _sse("token", json.dumps({"text": content}))
+        saved = await save(content)
+        yield _sse("done", saved.json())
+    except Exception as e:
+        logger.error(f"Error streaming cached content: {e}")
+        yield _sse("error", json.dumps({"detail": error_detail}))
+
 @router.post("/generate/preview", response_model=ContentGenerationResponse)
 async def generate_content_preview(
     request: ContentGenerationRequest,
+    response: Response,
     current_user: User = Depends(get_current_user)
 ):
-    """Generate content preview (ToC, style, example snippet)"""
+    """Generate content preview (ToC, style, example snippet).
+    The X-Context-Compression header reports the tokens compression saved."""
     try:
-        # Get source documents
-        response = supabase_client.get_client().table("documents").select("*").in_("id", request.source_doc_ids).eq("user_id", current_user.id).execute()
+        documents = await _get_source_documents(request, current_user)
+        cache_key = _request_cache_key("preview", request, documents)
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            return ContentGenerationResponse(**cached)
         
-        if not response.data:
-            raise HTTPException(status_code=404, detail="Source documents not found")
-        
-        # Get document chunks (simplified - in production, retrieve from vector DB)
-        chunks = []
-        for doc in response.data:
-            if doc["extracted_text"]:
-                chunks.append({
-                    "text": doc["extracted_text"],
-                    "document_id": doc["id"],
-                    "title": doc["title"]
-                })
-        
-        if not chunks:
-            raise HTTPException(status_code=400, detail="No text content found in source documents")
+        chunks, report = await _get_source_chunks(request, current_user, documents)
+        response.headers.update(_compression_headers([report]))
         
         # Generate preview
         preview = await content_generator.generate_content_preview(
@@ -47,9 +277,12 @@ async def generate_content_preview(
             request.custom_prompt,
             request.output_format
         )
+        response_cache.put(cache_key, preview, documents)
         
         return ContentGenerationResponse(**preview)
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error generating content preview: {e}")
         raise HTTPException(status_code=500, detail="Failed to generate content preview")
@@ -58,68 +291,117 @@ async def generate_content_preview(
 async def generate_content(
     request: ContentGenerationRequest,
     background_tasks: BackgroundTasks,
+    response: Response,
     current_user: User = Depends(get_current_user)
 ):
-    """Generate full content"""
+    """Generate full content.
+
+    With a ToC in the request, each section is generated from its own
+    retrieved context, concurrently, and the sections are stitched in order.
+    The X-Context-Compression header reports the tokens compression saved.
+    """
     try:
-        # Get source documents
-        response = supabase_client.get_client().table("documents").select("*").in_("id", request.source_doc_ids).eq("user_id", current_user.id).execute()
-        
-        if not response.data:
-            raise HTTPException(status_code=404, detail="Source documents not found")
-        
-        # Get document chunks
-        chunks = []
-        for doc in response.data:
-            if doc["extracted_text"]:
-                chunks.append({
-                    "text": doc["extracted_text"],
-                    "document_id": doc["id"],
-                    "title": doc["title"]
-                })
-        
-        if not chunks:
-            raise HTTPException(status_code=400, detail="No text content found in source documents")
-        
-        # Generate content
-        content = await content_generator.generate_full_content(
-            chunks,
-            request.template_id,  # Would need to fetch template prompt
-            request.custom_prompt
-        )
-        
-        # Create generated document record
-        doc_id = str(uuid.uuid4())
-        generated_doc_data = {
-            "id": doc_id,
-            "user_id": current_user.id,
-            "title": f"Generated Content {doc_id[:8]}",
-            "content": content,
-            "template_id": request.template_id,
-            "source_doc_ids": request.source_doc_ids,
-            "metadata": request.parameters,
-            "version": 1,
-            "status": "draft"
-        }
-        
-        # Save to database
-        response = supabase_client.get_client().table("generated_docs").insert(generated_doc_data).execute()
-        
-        return GeneratedDoc(**response.data[0])
-        
+        sections = content_generator.toc_sections(request.toc)
+        documents = await _get_source_documents(request, current_user)
+        cache_key = _request_cache_key("generate", request, documents)
+        content = response_cache.get(cache_key)
+        
+        if content is not None:
+            pass
+        elif sections:
+            section_chunks, reports = await _get_section_chunks(current_user, documents, sections)
+            response.headers.update(_compression_headers(reports))
+            content = await content_generator.generate_sectioned_content(
+                sections,
+                section_chunks,
+                request.template_id,  # Would need to fetch template prompt
+                request.custom_prompt
+            )
+            response_cache.put(cache_key, content, documents)
+        else:
+            chunks, report = await _get_source_chunks(request, current_user, documents)
+            response.headers.update(_compression_headers([report]))
+            
+            # Generate content
+            content = await content_generator.generate_full_content(
+                chunks,
+                request.template_id,  # Would need to fetch template prompt
+                request.custom_prompt
+            )
+            response_cache.put(cache_key, content, documents)
+        
+        return await _save_generated_doc(request, current_user, content)
+        
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error generating content: {e}")
         raise HTTPException(status_code=500, detail="Failed to generate content")
 
-@router.get("/", response_model=List[GeneratedDoc])
+@router.post("/generate/stream")
+async def stream_generated_content(
+    request: ContentGenerationRequest,
+    current_user: User = Depends(get_current_user)
+):
+    """Generate full content, streaming tokens as server-sent events.
+
+    Emits "token" events as the model writes, then a "done" event with the
+    saved document. The document is only saved if the stream completes.
+    """
+    try:
+        documents = await _get_source_documents(request, current_user)
+        # Same key as POST /generate without a ToC, so either endpoint reuses the other's answer
+        cache_key = _request_cache_key("generate", request.copy(update={"toc": None}), documents)
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            return _sse_response(_stream_cached(
+                cached,
+                lambda content: _save_generated_doc(request, current_user, content),
+                "Failed to generate content"
+            ))
+        
+        chunks, report = await _get_source_chunks(request, current_user, documents)
+        prompt = content_generator.build_generation_prompt(chunks, request.template_id, request.custom_prompt)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error preparing content stream: {e}")
+        raise HTTPException(status_code=500, detail="Failed to generate content")
+    
+    async def save(content: str) -> GeneratedDoc:
+        response_cache.put(cache_key, content, documents)
+        return await _save_generated_doc(request, current_user, content)
+    
+    return _sse_response(_stream_events(prompt, save, "Failed to generate content"), _compression_headers([report]))
+
+GENERATED_DOC_SUMMARY_COLUMNS = [
+    "id", "user_id", "title", "template_id", "source_doc_ids", "metadata",
+    "version", "status", "created_at", "updated_at"
+]
+GENERATED_DOC_BODY_COLUMNS = ["content", "toc"]
+
+@router.get("/", response_model=GeneratedDocPage, response_model_exclude_unset=True)
 async def get_generated_documents(
+    fields: Optional[str] = Query(None, description="Comma-separated body fields to include: content, toc"),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    limit: int = Query(50, ge=1, le=MAX_PAGE_SIZE),
     current_user: User = Depends(get_current_user)
 ):
-    """Get user's generated documents"""
+    """Get a page of the user's generated documents, newest first"""
     try:
-        response = supabase_client.get_client().table("generated_docs").select("*").eq("user_id", current_user.id).order("created_at", desc=True).execute()
-        return [GeneratedDoc(**doc) for doc in response.data]
-        
+        try:
+            columns = select_columns(GENERATED_DOC_SUMMARY_COLUMNS, GENERATED_DOC_BODY_COLUMNS, fields)
+            decode_cursor(cursor) if cursor else None
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        
+        query = supabase_client.get_client().table("generated_docs").select(columns).eq("user_id", current_user.id)
+        response = await supabase_client.execute(keyset_page(query, cursor, limit))
+        rows, next_cursor = split_page(response.data, limit)
+        return GeneratedDocPage(items=[GeneratedDocSummary(**doc) for doc in rows], next_cursor=next_cursor)
+        
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error fetching generated documents: {e}")
         raise HTTPException(status_code=500, detail="Failed to fetch generated documents")
@@ -131,7 +413,7 @@ async def get_generated_document(
 ):
     """Get a specific generated document"""
     try:
-        response = supabase_client.get_client().table("generated_docs").select("*").eq("id", doc_id).eq("user_id", current_user.id).execute()
+        response = await supabase_client.execute(supabase_client.get_client().table("generated_docs").select("*").eq("id", doc_id).eq("user_id", current_user.id))
         
         if not response.data:
             raise HTTPException(status_code=404, detail="Generated document not found")
@@ -151,56 +433,177 @@ async def update_generated_document(
     """Update generated document"""
     try:
         # Check if document exists and belongs to user
-        existing = supabase_client.get_client().table("generated_docs").select("*").eq("id", doc_id).eq("user_id", current_user.id).execute()
+        existing = await supabase_client.execute(supabase_client.get_client().table("generated_docs").select("*").eq("id", doc_id).eq("user_id", current_user.id))
         
         if not existing.data:
             raise HTTPException(status_code=404, detail="Generated document not found")
         
-        # Update document
+        # Update document; a content edit is a new version
+        doc = existing.data[0]
         update_data = doc_update.dict(exclude_unset=True)
-        response = supabase_client.get_client().table("generated_docs").update(update_data).eq("id", doc_id).eq("user_id", current_user.id).execute()
+        if update_data.get("content") is not None and update_data["content"] != doc["content"]:
+            return await _save_new_version(doc, update_data, current_user.id)
         
+        response = await supabase_client.execute(supabase_client.get_client().table("generated_docs").update(update_data).eq("id", doc_id).eq("user_id", current_user.id))
         return GeneratedDoc(**response.data[0])
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error updating generated document: {e}")
         raise HTTPException(status_code=500, detail="Failed to update generated document")
 
+@router.get("/{doc_id}/sections")
+async def get_generated_document_sections(
+    doc_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    """List the addressable sections of a generated document, for targeted refinement"""
+    try:
+        response = await supabase_client.execute(supabase_client.get_client().table("generated_docs").select("content").eq("id", doc_id).eq("user_id", current_user.id))
+        
+        if not response.data:
+            raise HTTPException(status_code=404, detail="Generated document not found")
+        
+        content = response.data[0]["content"]
+        return {
+            "sections": [
+                {
+                    "index": section["index"],
+                    "level": section["level"],
+                    "title": section["title"],
+                    "tokens": content_generator.count_tokens(section_text(content, section))
+                }
+                for section in split_sections(content)
+            ]
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error fetching document sections: {e}")
+        raise HTTPException(status_code=500, detail="Failed to fetch document sections")
+
 @router.post("/{doc_id}/refine")
 async def refine_content(
     doc_id: str,
     refinement_prompt: str,
+    response: Response,
+    sections: Optional[List[int]] = Query(None, description="Indexes from GET /{doc_id}/sections; only these are rewritten"),
     current_user: User = Depends(get_current_user)
 ):
-    """Refine existing content"""
+    """Refine existing content, either whole or only the given sections, with
+    the parts of its source documents relevant to the request as context.
+    The X-Context-Compression header reports the tokens compression saved."""
     try:
         # Get existing document
-        response = supabase_client.get_client().table("generated_docs").select("*").eq("id", doc_id).eq("user_id", current_user.id).execute()
+        doc_response = await supabase_client.execute(supabase_client.get_client().table("generated_docs").select("*").eq("id", doc_id).eq("user_id", current_user.id))
         
-        if not response.data:
+        if not doc_response.data:
             raise HTTPException(status_code=404, detail="Generated document not found")
         
-        doc = response.data[0]
+        doc = doc_response.data[0]
+        source_chunks, report = await _get_refinement_chunks(doc, refinement_prompt, current_user)
+        response.headers.update(_compression_headers([report]))
         
         # Refine content
-        refined_content = await content_generator.refine_content(
-            doc["content"],
-            refinement_prompt
-        )
+        if sections:
+            try:
+                refined_content = await content_generator.refine_sections(
+                    doc["content"],
+                    refinement_prompt,
+                    sections,
+                    source_chunks
+                )
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+        else:
+            refined_content = await content_generator.refine_content(
+                doc["content"],
+                refinement_prompt,
+                source_chunks
+            )
         
         # Update document with refined content
-        update_data = {
-            "content": refined_content,
-            "version": doc["version"] + 1
-        }
+        return await _save_new_version(doc, {"content": refined_content}, current_user.id)
         
-        response = supabase_client.get_client().table("generated_docs").update(update_data).eq("id", doc_id).eq("user_id", current_user.id).execute()
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error refining content: {e}")
+        raise HTTPException(status_code=500, detail="Failed to refine content")
+
+@router.post("/{doc_id}/refine/stream")
+async def stream_refined_content(
+    doc_id: str,
+    refinement_prompt: str,
+    current_user: User = Depends(get_current_user)
+):
+    """Refine existing content, streaming tokens as server-sent events.
+    The refined version is only saved if the stream completes."""
+    try:
+        response = await supabase_client.execute(supabase_client.get_client().table("generated_docs").select("*").eq("id", doc_id).eq("user_id", current_user.id))
         
-        return GeneratedDoc(**response.data[0])
+        if not response.data:
+            raise HTTPException(status_code=404, detail="Generated document not found")
         
+        doc = response.data[0]
+        source_chunks, report = await _get_refinement_chunks(doc, refinement_prompt, current_user)
+        prompt = content_generator.build_refinement_prompt(doc["content"], refinement_prompt, source_chunks)
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Error refining content: {e}")
+        logger.error(f"Error preparing refinement stream: {e}")
         raise HTTPException(status_code=500, detail="Failed to refine content")
+    
+    return _sse_response(_stream_events(
+        prompt,
+        lambda content: _save_new_version(doc, {"content": content}, current_user.id),
+        "Failed to refine content"
+    ), _compression_headers([report]))
+
+async def _check_generated_doc(doc_id: str, current_user: User):
+    response = await supabase_client.execute(supabase_client.get_client().table("generated_docs").select("id").eq("id", doc_id).eq("user_id", current_user.id))
+    if not response.data:
+        raise HTTPException(status_code=404, detail="Generated document not found")
+
+@router.get("/{doc_id}/versions")
+async def get_generated_document_versions(
+    doc_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    """List the recorded versions of a generated document, newest first"""
+    try:
+        await _check_generated_doc(doc_id, current_user)
+        return {"versions": await version_store.list_versions(doc_id)}
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error fetching document versions: {e}")
+        raise HTTPException(status_code=500, detail="Failed to fetch document versions")
+
+@router.get("/{doc_id}/versions/{version_number}", response_model=DocVersion)
+async def get_generated_document_version(
+    doc_id: str,
+    version_number: int,
+    current_user: User = Depends(get_current_user)
+):
+    """Rebuild one recorded version of a generated document"""
+    try:
+        await _check_generated_doc(doc_id, current_user)
+        version = await version_store.reconstruct(doc_id, version_number)
+        
+        if version is None:
+            raise HTTPException(status_code=404, detail="Version not found")
+        
+        return DocVersion(**version)
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error reconstructing document version: {e}")
+        raise HTTPException(status_code=500, detail="Failed to fetch document version")
 
 @router.delete("/{doc_id}")
 async def delete_generated_document(
@@ -210,13 +613,13 @@ async def delete_generated_document(
     """Delete generated document"""
     try:
         # Check if document exists and belongs to user
-        existing = supabase_client.get_client().table("generated_docs").select("*").eq("id", doc_id).eq("user_id", current_user.id).execute()
+        existing = await supabase_client.execute(supabase_client.get_client().table("generated_docs").select("*").eq("id", doc_id).eq("user_id", current_user.id))
         
         if not existing.data:
             raise HTTPException(status_code=404, detail="Generated document not found")
         
         # Delete from database
-        supabase_client.get_client().table("generated_docs").delete().eq("id", doc_id).eq("user_id", current_user.id).execute()
+        await supabase_client.execute(supabase_client.get_client().table("generated_docs").delete().eq("id", doc_id).eq("user_id", current_user.id))
         
         return {"message": "Generated document deleted successfully"}
         
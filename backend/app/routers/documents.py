@@ -1,9 +1,20 @@
 from fastapi import APIRouter, HTTPException, Depends, UploadFile, File, Form, Query
-from typing import List, Optional
-from app.models.schemas import Document, DocumentCreate, DocumentUpdate, DocumentStatus
+from typing import Any, Dict, List, Optional
+from app.models.schemas import (
+    Document, DocumentCreate, DocumentUpdate, DocumentStatus, DocumentProcessingStatus,
+    DocumentSummary, DocumentPage
+)
 from app.services.supabase_client import supabase_client
-from app.services.pdf_processor import pdf_processor
+from app.services.upload_spool import upload_spooler, UploadTooLargeError
+from app.services.ingestion_queue import ingestion_queue
+from app.services.ann_index import ann_index_manager
+from app.services.response_cache import response_cache
+from app.services.content_generator import content_generator
+from app.services.search_index import search_index, query_terms, highlight_text, reciprocal_rank_fusion
+from app.services.pagination import MAX_PAGE_SIZE, decode_cursor, keyset_page, select_columns, split_page
+from app.config import settings
 from app.routers.auth import get_current_user, User
+import asyncio
 import logging
 import uuid
 import os
@@ -20,63 +31,125 @@ async def upload_document(
     tags: Optional[str] = Form(""),
     current_user: User = Depends(get_current_user)
 ):
-    """Upload and process a document"""
+    """Accept a document upload and queue it for background processing"""
     try:
         # Validate file type
         file_extension = file.filename.split('.')[-1].lower()
         if file_extension not in ["pdf", "txt", "md", "docx"]:
             raise HTTPException(status_code=400, detail="Unsupported file type")
         
-        # Read file data
-        file_data = await file.read()
-        
-        # Generate unique file path
-        file_id = str(uuid.uuid4())
-        file_path = f"documents/{current_user.id}/{file_id}.{file_extension}"
-        
-        # Upload to Supabase Storage
-        await supabase_client.upload_file("documents", file_path, file_data)
-        
-        # Process file based on type
-        extracted_text = ""
-        if file_extension == "pdf":
-            pdf_data = await pdf_processor.process_pdf(file_data)
-            extracted_text = pdf_data["text"]
-        
-        # Parse tags
-        tag_list = [tag.strip() for tag in tags.split(",") if tag.strip()] if tags else []
-        
-        # Create document record
-        document_data = {
-            "id": file_id,
-            "user_id": current_user.id,
-            "title": title,
-            "file_path": file_path,
-            "file_type": file_extension,
-            "folder_path": folder_path,
-            "tags": tag_list,
-            "extracted_text": extracted_text,
-            "status": DocumentStatus.COMPLETED.value if extracted_text else DocumentStatus.PROCESSING.value
-        }
-        
-        # Save to database
-        response = supabase_client.get_service_client().table("documents").insert(document_data).execute()
+        # Stream the upload to disk, enforcing the size limit and hashing as it goes
+        try:
+            spooled = await upload_spooler.spool(file, suffix=f".{file_extension}")
+        except UploadTooLargeError as e:
+            raise HTTPException(status_code=413, detail=str(e))
+        
+        try:
+            file_id = str(uuid.uuid4())
+            
+            # Parse tags
+            tag_list = [tag.strip() for tag in tags.split(",") if tag.strip()] if tags else []
+            
+            # An identical file that was already processed is reused as-is:
+            # same stored object, extracted text and chunk embeddings
+            duplicate = await supabase_client.execute(supabase_client.get_service_client().table("documents").select("id, file_path, extracted_text").eq("user_id", current_user.id).eq("content_hash", spooled.sha256).eq("status", DocumentStatus.COMPLETED.value).limit(1))
+            if duplicate.data:
+                source = duplicate.data[0]
+                spooled.cleanup()
+                response = await supabase_client.execute(supabase_client.get_service_client().table("documents").insert({
+                    "id": file_id,
+                    "user_id": current_user.id,
+                    "title": title,
+                    "file_path": source["file_path"],
+                    "file_type": file_extension,
+                    "folder_path": folder_path,
+                    "tags": tag_list,
+                    "extracted_text": source["extracted_text"],
+                    "content_hash": spooled.sha256,
+                    "status": DocumentStatus.COMPLETED.value
+                }))
+                await supabase_client.execute(supabase_client.get_service_client().rpc("clone_document_chunks", {
+                    "source_document_id": source["id"],
+                    "target_document_id": file_id
+                }))
+                if settings.retrieval_backend == "ann":
+                    await asyncio.to_thread(
+                        ann_index_manager.get(current_user.id).clone_document, source["id"], file_id
+                    )
+                await asyncio.to_thread(search_index.clone_document, source["id"], file_id)
+                return Document(**response.data[0])
+            
+            # Generate unique file path
+            file_path = f"documents/{current_user.id}/{file_id}.{file_extension}"
+            
+            # Create document record; storage upload and extraction happen in the ingestion queue
+            document_data = {
+                "id": file_id,
+                "user_id": current_user.id,
+                "title": title,
+                "file_path": file_path,
+                "file_type": file_extension,
+                "folder_path": folder_path,
+                "tags": tag_list,
+                "extracted_text": None,
+                "content_hash": spooled.sha256,
+                "status": DocumentStatus.UPLOADING.value
+            }
+            
+            # Save to database
+            response = await supabase_client.execute(supabase_client.get_service_client().table("documents").insert(document_data))
+
+            try:
+                await ingestion_queue.enqueue(
+                    document_id=file_id,
+                    user_id=current_user.id,
+                    source_path=spooled.path,
+                    storage_path=file_path,
+                    file_type=file_extension
+                )
+            except Exception:
+                # Nothing will ever process the row, so don't leave it stuck in "uploading"
+                try:
+                    await supabase_client.execute(supabase_client.get_service_client().table("documents").delete().eq("id", file_id))
+                except Exception as e:
+                    logger.error(f"Error removing document {file_id} after a failed enqueue: {e}")
+                raise
+        except Exception:
+            spooled.cleanup()
+            raise
         
         return Document(**response.data[0])
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error uploading document: {e}")
         raise HTTPException(status_code=500, detail="Failed to upload document")
 
-@router.get("/", response_model=List[Document])
+DOCUMENT_SUMMARY_COLUMNS = [
+    "id", "user_id", "title", "file_type", "folder_path", "tags", "file_path",
+    "content_hash", "status", "created_at", "updated_at"
+]
+DOCUMENT_BODY_COLUMNS = ["extracted_text"]
+
+@router.get("/", response_model=DocumentPage, response_model_exclude_unset=True)
 async def get_documents(
     folder_path: Optional[str] = Query(None),
     tags: Optional[str] = Query(None),
+    fields: Optional[str] = Query(None, description="Comma-separated body fields to include, e.g. extracted_text"),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    limit: int = Query(50, ge=1, le=MAX_PAGE_SIZE),
     current_user: User = Depends(get_current_user)
 ):
-    """Get user's documents with optional filtering"""
+    """Get a page of the user's documents, newest first, with optional filtering"""
     try:
-        query = supabase_client.get_client().table("documents").select("*").eq("user_id", current_user.id)
+        try:
+            columns = select_columns(DOCUMENT_SUMMARY_COLUMNS, DOCUMENT_BODY_COLUMNS, fields)
+            decode_cursor(cursor) if cursor else None
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        
+        query = supabase_client.get_client().table("documents").select(columns).eq("user_id", current_user.id)
         
         if folder_path:
             query = query.eq("folder_path", folder_path)
@@ -85,13 +158,78 @@ async def get_documents(
             tag_list = [tag.strip() for tag in tags.split(",")]
             query = query.contains("tags", tag_list)
         
-        response = query.order("created_at", desc=True).execute()
-        return [Document(**doc) for doc in response.data]
+        response = await supabase_client.execute(keyset_page(query, cursor, limit))
+        rows, next_cursor = split_page(response.data, limit)
+        return DocumentPage(items=[DocumentSummary(**doc) for doc in rows], next_cursor=next_cursor)
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error fetching documents: {e}")
         raise HTTPException(status_code=500, detail="Failed to fetch documents")
 
+@router.get("/search")
+async def search_documents(
+    q: str = Query(..., min_length=1, description="Search text"),
+    limit: int = Query(20, ge=1, le=100),
+    mode: str = Query("hybrid", pattern="^(hybrid|keyword|vector)$"),
+    current_user: User = Depends(get_current_user)
+):
+    """Search the user's documents at chunk level: BM25 keyword matches and
+    vector similarity, fused by reciprocal rank, with highlighted snippets"""
+    try:
+        candidates = max(limit, settings.search_candidates)
+        keyword_hits = []
+        vector_hits = []
+        
+        if mode != "vector":
+            await search_index.ensure_user(current_user.id)
+            keyword_hits = await asyncio.to_thread(search_index.search, current_user.id, q, candidates)
+        
+        if mode != "keyword":
+            try:
+                vector_hits = await content_generator.search_source_chunks(q, current_user.id, None, candidates)
+            except Exception as e:
+                if mode == "vector":
+                    raise
+                logger.warning(f"Vector search failed, returning keyword matches only: {e}")
+        
+        hits = reciprocal_rank_fusion({
+            "keyword": [(hit["document_id"], hit["chunk_index"]) for hit in keyword_hits],
+            "vector": [(hit["document_id"], hit["chunk_index"]) for hit in vector_hits]
+        }, settings.search_rrf_k)
+        
+        # Titles, and a guard against index entries of documents that are gone
+        document_ids = list({hit["document_id"] for hit in hits})
+        titles = {}
+        if document_ids:
+            response = await supabase_client.execute(supabase_client.get_client().table("documents").select("id, title").eq("user_id", current_user.id).in_("id", document_ids))
+            titles = {row["id"]: row["title"] for row in response.data}
+        
+        snippets = {(hit["document_id"], hit["chunk_index"]): hit["snippet"] for hit in keyword_hits}
+        texts = {(hit["document_id"], hit["chunk_index"]): hit["text"] for hit in vector_hits}
+        terms = query_terms(q)
+        
+        results = []
+        for hit in hits:
+            if hit["document_id"] not in titles:
+                continue
+            key = (hit["document_id"], hit["chunk_index"])
+            snippet = snippets.get(key)
+            if snippet is None:
+                snippet = highlight_text(texts[key], terms, search_index.snippet_words)
+            results.append({**hit, "title": titles[hit["document_id"]], "snippet": snippet})
+            if len(results) == limit:
+                break
+        
+        return {"query": q, "mode": mode, "results": results}
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error searching documents: {e}")
+        raise HTTPException(status_code=500, detail="Failed to search documents")
+
 @router.get("/{document_id}", response_model=Document)
 async def get_document(
     document_id: str,
@@ -99,7 +237,7 @@ async def get_document(
 ):
     """Get a specific document"""
     try:
-        response = supabase_client.get_client().table("documents").select("*").eq("id", document_id).eq("user_id", current_user.id).execute()
+        response = await supabase_client.execute(supabase_client.get_client().table("documents").select("*").eq("id", document_id).eq("user_id", current_user.id))
         
         if not response.data:
             raise HTTPException(status_code=404, detail="Document not found")
@@ -110,6 +248,43 @@ async def get_document(
         logger.error(f"Error fetching document: {e}")
         raise HTTPException(status_code=500, detail="Failed to fetch document")
 
+@router.get("/{document_id}/status", response_model=DocumentProcessingStatus)
+async def get_document_status(
+    document_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    """Get background processing progress for a document"""
+    try:
+        response = await supabase_client.execute(supabase_client.get_client().table("documents").select("id, status").eq("id", document_id).eq("user_id", current_user.id))
+        
+        if not response.data:
+            raise HTTPException(status_code=404, detail="Document not found")
+        
+        status = DocumentStatus(response.data[0]["status"])
+        job = await ingestion_queue.get_status(document_id)
+        if job is None:
+            return DocumentProcessingStatus(
+                document_id=document_id,
+                status=status,
+                progress=1.0 if status == DocumentStatus.COMPLETED else 0.0
+            )
+        
+        return DocumentProcessingStatus(
+            document_id=document_id,
+            status=status,
+            stage=job["stage"],
+            progress=job["progress"],
+            attempts=job["attempts"],
+            error=job["error"],
+            detail=job["detail"]
+        )
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error fetching document status: {e}")
+        raise HTTPException(status_code=500, detail="Failed to fetch document status")
+
 @router.put("/{document_id}", response_model=Document)
 async def update_document(
     document_id: str,
@@ -119,14 +294,15 @@ async def update_document(
     """Update document metadata"""
     try:
         # Check if document exists and belongs to user
-        existing = supabase_client.get_client().table("documents").select("*").eq("id", document_id).eq("user_id", current_user.id).execute()
+        existing = await supabase_client.execute(supabase_client.get_client().table("documents").select("*").eq("id", document_id).eq("user_id", current_user.id))
         
         if not existing.data:
             raise HTTPException(status_code=404, detail="Document not found")
         
         # Update document
         update_data = document_update.dict(exclude_unset=True)
-        response = supabase_client.get_client().table("documents").update(update_data).eq("id", document_id).eq("user_id", current_user.id).execute()
+        response = await supabase_client.execute(supabase_client.get_client().table("documents").update(update_data).eq("id", document_id).eq("user_id", current_user.id))
+        response_cache.invalidate_documents([document_id])
         
         return Document(**response.data[0])
         
@@ -142,18 +318,25 @@ async def delete_document(
     """Delete a document"""
     try:
         # Get document info
-        response = supabase_client.get_client().table("documents").select("file_path").eq("id", document_id).eq("user_id", current_user.id).execute()
+        response = await supabase_client.execute(supabase_client.get_client().table("documents").select("file_path").eq("id", document_id).eq("user_id", current_user.id))
         
         if not response.data:
             raise HTTPException(status_code=404, detail="Document not found")
         
         file_path = response.data[0]["file_path"]
         
-        # Delete from storage
-        await supabase_client.delete_file("documents", file_path)
+        # Delete from storage unless a deduplicated re-upload still points at the file
+        shared = await supabase_client.execute(supabase_client.get_client().table("documents").select("id").eq("file_path", file_path).neq("id", document_id).limit(1))
+        if not shared.data:
+            await supabase_client.delete_file("documents", file_path)
         
         # Delete from database
-        supabase_client.get_client().table("documents").delete().eq("id", document_id).eq("user_id", current_user.id).execute()
+        await supabase_client.execute(supabase_client.get_client().table("documents").delete().eq("id", document_id).eq("user_id", current_user.id))
+        
+        if settings.retrieval_backend == "ann":
+            await asyncio.to_thread(ann_index_manager.get(current_user.id).remove_document, document_id)
+        await asyncio.to_thread(search_index.remove_document, document_id)
+        response_cache.invalidate_documents([document_id])
         
         return {"message": "Document deleted successfully"}
         
@@ -161,18 +344,41 @@ async def delete_document(
         logger.error(f"Error deleting document: {e}")
         raise HTTPException(status_code=500, detail="Failed to delete document")
 
+def _folder_tree(counts: Dict[str, int]) -> List[Dict[str, Any]]:
+    """Nest "a/b/c" folder paths into a tree. document_count is the folder's own
+    documents; total_count also includes everything below it."""
+    roots: List[Dict[str, Any]] = []
+    nodes: Dict[str, Dict[str, Any]] = {}
+    for path in sorted(counts):
+        parts = [part for part in path.split("/") if part]
+        siblings = roots
+        for depth, name in enumerate(parts):
+            node_path = "/".join(parts[:depth + 1])
+            node = nodes.get(node_path)
+            if node is None:
+                node = {"name": name, "path": node_path, "document_count": 0, "total_count": 0, "children": []}
+                nodes[node_path] = node
+                siblings.append(node)
+            node["total_count"] += counts[path]
+            siblings = node["children"]
+        if parts:
+            nodes["/".join(parts)]["document_count"] += counts[path]
+    return roots
+
 @router.get("/folders/list")
 async def get_folders(current_user: User = Depends(get_current_user)):
-    """Get list of folders"""
+    """Get list of folders with document counts and their hierarchy"""
     try:
-        response = supabase_client.get_client().table("documents").select("folder_path").eq("user_id", current_user.id).execute()
+        response = await supabase_client.execute(supabase_client.get_client().table("document_folders").select("folder_path, document_count").eq("user_id", current_user.id))
         
-        folders = set()
-        for doc in response.data:
-            if doc["folder_path"]:
-                folders.add(doc["folder_path"])
+        # Older databases may still hold an aggregate row for empty folder_path values
+        counts = {row["folder_path"]: row["document_count"] for row in response.data if row["folder_path"]}
         
-        return {"folders": sorted(list(folders))}
+        return {
+            "folders": sorted(counts),
+            "counts": counts,
+            "tree": _folder_tree(counts)
+        }
         
     except Exception as e:
         logger.error(f"Error fetching folders: {e}")
@@ -180,16 +386,13 @@ async def get_folders(current_user: User = Depends(get_current_user)):
 
 @router.get("/tags/list")
 async def get_tags(current_user: User = Depends(get_current_user)):
-    """Get list of tags"""
+    """Get list of tags with document counts"""
     try:
-        response = supabase_client.get_client().table("documents").select("tags").eq("user_id", current_user.id).execute()
+        response = await supabase_client.execute(supabase_client.get_client().table("document_tags").select("tag, document_count").eq("user_id", current_user.id))
         
-        tags = set()
-        for doc in response.data:
-            if doc["tags"]:
-                tags.update(doc["tags"])
+        counts = {row["tag"]: row["document_count"] for row in response.data}
         
-        return {"tags": sorted(list(tags))}
+        return {"tags": sorted(counts), "counts": counts}
         
     except Exception as e:
         logger.error(f"Error fetching tags: {e}")
@@ -1,8 +1,13 @@
-from fastapi import APIRouter, HTTPException, Depends
-from typing import List
+from fastapi import APIRouter, HTTPException, Depends, Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from typing import List, Optional
 from app.models.schemas import Template, TemplateCreate, TemplateUpdate
 from app.services.supabase_client import supabase_client
+from app.services.template_cache import template_cache
+from app.services.usage_counter import usage_counter
 from app.routers.auth import get_current_user, User
+import asyncio
 import logging
 import uuid
 
@@ -23,30 +28,58 @@ async def create_template(
             **template.dict()
         }
         
-        response = supabase_client.get_client().table("templates").insert(template_data).execute()
+        response = await supabase_client.execute(supabase_client.get_client().table("templates").insert(template_data))
+        await asyncio.to_thread(template_cache.bump_user, current_user.id)
+        if template.is_public:
+            await asyncio.to_thread(template_cache.invalidate_public)
         return Template(**response.data[0])
         
     except Exception as e:
         logger.error(f"Error creating template: {e}")
         raise HTTPException(status_code=500, detail="Failed to create template")
 
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    return "*" in candidates or etag in [candidate.removeprefix("W/") for candidate in candidates]
+
 @router.get("/", response_model=List[Template])
 async def get_templates(
+    request: Request,
     current_user: User = Depends(get_current_user)
 ):
-    """Get user's templates and public templates"""
+    """Get user's templates and public templates.
+
+    Public templates come from a shared in-process cache; the response
+    carries an ETag built from the persisted template versions, and a
+    matching If-None-Match is answered with 304 before any database work."""
     try:
-        # Get user's templates
-        user_response = supabase_client.get_client().table("templates").select("*").eq("user_id", current_user.id).execute()
-        
-        # Get public templates
-        public_response = supabase_client.get_client().table("templates").select("*").eq("is_public", True).neq("user_id", current_user.id).execute()
-        
-        templates = []
-        templates.extend([Template(**t) for t in user_response.data])
-        templates.extend([Template(**t) for t in public_response.data])
-        
-        return templates
+        public_version, versions = await asyncio.to_thread(template_cache.versions, current_user.id)
+        etag = template_cache.make_etag(current_user.id, versions)
+        headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+        if _etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers=headers)
+        
+        public = template_cache.public(public_version)
+        if public is not None:
+            # Public library is cached; only the user's own templates are read
+            response = await supabase_client.execute(supabase_client.get_client().table("templates").select("*").eq("user_id", current_user.id))
+            own = [Template(**t) for t in response.data]
+        else:
+            # Own and public templates in one query, refreshing the public cache
+            # (a raw or= parameter: the pinned postgrest-py has no or_())
+            query = supabase_client.get_client().table("templates").select("*")
+            query.params = query.params.add("or", f'(user_id.eq."{current_user.id}",is_public.eq.true)')
+            response = await supabase_client.execute(query)
+            rows = [Template(**t) for t in response.data]
+            own = [t for t in rows if t.user_id == current_user.id]
+            public = [t for t in rows if t.is_public]
+            template_cache.set_public(public, public_version)
+        
+        templates = own + [t for t in public if t.user_id != current_user.id]
+        
+        return JSONResponse(content=jsonable_encoder(templates), headers=headers)
         
     except Exception as e:
         logger.error(f"Error fetching templates: {e}")
@@ -59,7 +92,7 @@ async def get_template(
 ):
     """Get a specific template"""
     try:
-        response = supabase_client.get_client().table("templates").select("*").eq("id", template_id).execute()
+        response = await supabase_client.execute(supabase_client.get_client().table("templates").select("*").eq("id", template_id))
         
         if not response.data:
             raise HTTPException(status_code=404, detail="Template not found")
@@ -85,14 +118,17 @@ async def update_template(
     """Update template (only owner can update)"""
     try:
         # Check if template exists and belongs to user
-        existing = supabase_client.get_client().table("templates").select("*").eq("id", template_id).eq("user_id", current_user.id).execute()
+        existing = await supabase_client.execute(supabase_client.get_client().table("templates").select("*").eq("id", template_id).eq("user_id", current_user.id))
         
         if not existing.data:
             raise HTTPException(status_code=404, detail="Template not found")
         
         # Update template
         update_data = template_update.dict(exclude_unset=True)
-        response = supabase_client.get_client().table("templates").update(update_data).eq("id", template_id).eq("user_id", current_user.id).execute()
+        response = await supabase_client.execute(supabase_client.get_client().table("templates").update(update_data).eq("id", template_id).eq("user_id", current_user.id))
+        await asyncio.to_thread(template_cache.bump_user, current_user.id)
+        if existing.data[0]["is_public"] or update_data.get("is_public"):
+            await asyncio.to_thread(template_cache.invalidate_public)
         
         return Template(**response.data[0])
         
@@ -108,13 +144,16 @@ async def delete_template(
     """Delete template (only owner can delete)"""
     try:
         # Check if template exists and belongs to user
-        existing = supabase_client.get_client().table("templates").select("*").eq("id", template_id).eq("user_id", current_user.id).execute()
+        existing = await supabase_client.execute(supabase_client.get_client().table("templates").select("*").eq("id", template_id).eq("user_id", current_user.id))
         
         if not existing.data:
             raise HTTPException(status_code=404, detail="Template not found")
         
         # Delete template
-        supabase_client.get_client().table("templates").delete().eq("id", template_id).eq("user_id", current_user.id).execute()
+        await supabase_client.execute(supabase_client.get_client().table("templates").delete().eq("id", template_id).eq("user_id", current_user.id))
+        await asyncio.to_thread(template_cache.bump_user, current_user.id)
+        if existing.data[0]["is_public"]:
+            await asyncio.to_thread(template_cache.invalidate_public)
         
         return {"message": "Template deleted successfully"}
         
@@ -127,25 +166,30 @@ async def use_template(
     template_id: str,
     current_user: User = Depends(get_current_user)
 ):
-    """Increment template usage count"""
+    """Record a template use; usage_count is incremented in batches"""
     try:
-        # Check if template exists and is accessible
-        response = supabase_client.get_client().table("templates").select("*").eq("id", template_id).execute()
-        
-        if not response.data:
-            raise HTTPException(status_code=404, detail="Template not found")
-        
-        template = response.data[0]
-        
-        # Check access (owner or public)
-        if template["user_id"] != current_user.id and not template["is_public"]:
-            raise HTTPException(status_code=403, detail="Access denied")
-        
-        # Increment usage count
-        supabase_client.get_client().table("templates").update({"usage_count": template["usage_count"] + 1}).eq("id", template_id).execute()
+        # Check if template exists and is accessible; cached public templates need no lookup
+        public_version, _ = await asyncio.to_thread(template_cache.versions, current_user.id)
+        public = template_cache.public(public_version) or []
+        if not any(t.id == template_id for t in public):
+            response = await supabase_client.execute(supabase_client.get_client().table("templates").select("user_id, is_public").eq("id", template_id))
+            
+            if not response.data:
+                raise HTTPException(status_code=404, detail="Template not found")
+            
+            template = response.data[0]
+            
+            # Check access (owner or public)
+            if template["user_id"] != current_user.id and not template["is_public"]:
+                raise HTTPException(status_code=403, detail="Access denied")
+        
+        # Buffered; listings show the new count after the next flush, once their versions next change
+        usage_counter.record(template_id)
         
         return {"message": "Template usage recorded"}
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error recording template usage: {e}")
         raise HTTPException(status_code=500, detail="Failed to record template usage")
@@ -0,0 +1,385 @@
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+import fcntl
+import json
+import logging
+import os
+import shutil
+import threading
+
+import numpy as np
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+_ID_DTYPE = "S64"
+
+# Files making up one index directory; rows are appended to all of them together
+_ROW_FILES = {
+    "vectors": ("vectors.f32", np.float32),
+    "documents": ("documents.bin", _ID_DTYPE),
+    "chunk_indexes": ("chunk_indexes.i32", np.int32),
+    "lists": ("lists.i32", np.int32)
+}
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def _spherical_kmeans(sample: np.ndarray, nlist: int, iterations: int = 10, seed: int = 0) -> np.ndarray:
+    """Cluster unit vectors by cosine similarity; returns normalized centroids"""
+    rng = np.random.default_rng(seed)
+    centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = np.argmax(sample @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, sample)
+        empty = np.bincount(assignment, minlength=nlist) == 0
+        # Re-seed empty clusters so every list stays in use
+        sums[empty] = sample[rng.choice(len(sample), int(empty.sum()), replace=False)]
+        centroids = _normalize_rows(sums)
+    return centroids.astype(np.float32)
+
+
+class IVFIndex:
+    """Inverted-file ANN index for one user, persisted as memory-mapped files.
+
+    Rows are identified by (document_id, chunk_index), matching
+    document_chunks. Until the index holds ``train_threshold`` vectors it
+    searches exhaustively; after that vectors are clustered into ``nlist``
+    lists and a query only scores the rows in its ``nprobe`` nearest lists.
+    nprobe is the recall/latency knob.
+
+    Rows are only ever appended, and readers map just the first ``count``
+    rows recorded in meta.json, so several uvicorn workers can share the
+    files (and their page cache) while one of them writes under a file
+    lock. Removing a document records a tombstone; dead rows are dropped
+    when the lists are retrained.
+
+    Retraining rewrites every file, so it builds a new generation in its
+    own directory and publishes it with the single rename that replaces
+    meta.json. A reader therefore sees either the old generation or the
+    new one, never a mix; the previous generation is kept until the next
+    retrain for readers still mapping it.
+    """
+
+    def __init__(self, path: str, dimensions: int, train_threshold: int):
+        self.path = path
+        self.dimensions = dimensions
+        self.train_threshold = train_threshold
+        self._meta: Dict[str, Any] = {}
+        self._meta_mtime: Optional[float] = None
+        self._maps: Dict[str, np.ndarray] = {}
+        self._centroids: Optional[np.ndarray] = None
+        self._live: Optional[Tuple[int, np.ndarray]] = None
+        self._lock = threading.Lock()
+
+    # -- persistence -------------------------------------------------------
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def _generation_dir(self, generation: int) -> str:
+        # Generation 0 is the flat layout of indexes built before generations
+        return self.path if generation == 0 else self._file(f"gen-{generation}")
+
+    def _data_file(self, name: str, generation: Optional[int] = None) -> str:
+        """Path of a row or centroid file in the given (default: current) generation"""
+        if generation is None:
+            generation = self._meta.get("generation", 0)
+        return os.path.join(self._generation_dir(generation), name)
+
+    @contextmanager
+    def _write_lock(self):
+        os.makedirs(self.path, exist_ok=True)
+        with self._lock, open(self._file("lock"), "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                self._refresh(force=True)
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _write_meta(self):
+        self._meta["version"] = self._meta.get("version", 0) + 1
+        tmp = self._file("meta.json.tmp")
+        with open(tmp, "w") as f:
+            json.dump(self._meta, f)
+        os.replace(tmp, self._file("meta.json"))
+
+    def _refresh(self, force: bool = False):
+        """Re-map the files if another process has changed the index"""
+        meta_path = self._file("meta.json")
+        try:
+            mtime = os.stat(meta_path).st_mtime_ns
+        except FileNotFoundError:
+            self._meta = {"count": 0, "nlist": 0, "trained_count": 0, "tombstones": {}, "version": 0, "generation": 1}
+            self._maps = {}
+            self._centroids = None
+            return
+        if not force and mtime == self._meta_mtime:
+            return
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if (
+            meta.get("version") != self._meta.get("version")
+            or meta["count"] != self._meta.get("count")
+            or meta.get("generation", 0) != self._meta.get("generation", 0)
+        ):
+            self._maps = {}
+            self._centroids = None
+        self._meta = meta
+        self._meta_mtime = mtime
+
+    def _rows(self, key: str) -> np.ndarray:
+        """Memory-map the first `count` rows of a row file"""
+        if key not in self._maps:
+            name, dtype = _ROW_FILES[key]
+            count = self._meta["count"]
+            shape = (count, self.dimensions) if key == "vectors" else (count,)
+            if count == 0:
+                self._maps[key] = np.empty(shape, dtype=dtype)
+            else:
+                self._maps[key] = np.memmap(self._data_file(name), dtype=dtype, mode="r", shape=shape)
+        return self._maps[key]
+
+    def _centroid_matrix(self) -> Optional[np.ndarray]:
+        if self._meta["nlist"] == 0:
+            return None
+        if self._centroids is None:
+            self._centroids = np.load(self._data_file("centroids.npy"), mmap_mode="r")
+        return self._centroids
+
+    # -- writes ------------------------------------------------------------
+
+    def add(self, document_ids: Sequence[str], chunk_indexes: Sequence[int], vectors: Sequence[Sequence[float]]):
+        """Append vectors, assigning them to their nearest list if the index is trained"""
+        if not len(document_ids):
+            return
+        block = _normalize_rows(np.asarray(vectors, dtype=np.float32).reshape(len(document_ids), self.dimensions))
+        with self._write_lock():
+            centroids = self._centroid_matrix()
+            if centroids is not None:
+                lists = np.argmax(block @ centroids.T, axis=1).astype(np.int32)
+            else:
+                lists = np.full(len(block), -1, dtype=np.int32)
+            columns = {
+                "vectors": block,
+                "documents": np.asarray(document_ids, dtype=_ID_DTYPE),
+                "chunk_indexes": np.asarray(chunk_indexes, dtype=np.int32),
+                "lists": lists
+            }
+            os.makedirs(self._generation_dir(self._meta.get("generation", 0)), exist_ok=True)
+            for key, (name, _) in _ROW_FILES.items():
+                with open(self._data_file(name), "ab") as f:
+                    # Truncate any tail left by a writer that died before updating meta.json
+                    f.truncate(self._meta["count"] * columns[key].itemsize * (self.dimensions if key == "vectors" else 1))
+                    f.write(np.ascontiguousarray(columns[key]).tobytes())
+            self._meta["count"] += len(block)
+            self._write_meta()
+            self._maps = {}
+
+            count = self._meta["count"]
+            trained = self._meta["trained_count"]
+            if (trained == 0 and count >= self.train_threshold) or (trained and count >= 4 * trained):
+                self._train()
+
+    def remove_document(self, document_id: str):
+        """Hide every row currently stored for a document"""
+        with self._write_lock():
+            if self._meta["count"] == 0:
+                return
+            self._meta["tombstones"][document_id] = self._meta["count"]
+            self._write_meta()
+
+    def clone_document(self, source_document_id: str, target_document_id: str):
+        """Copy a document's live rows under a new document id"""
+        snapshot = self._snapshot()
+        rows = np.nonzero(snapshot["live"] & (snapshot["documents"] == source_document_id.encode()))[0]
+        if len(rows):
+            self.add(
+                [target_document_id] * len(rows),
+                snapshot["chunk_indexes"][rows],
+                np.asarray(snapshot["vectors"][rows])
+            )
+
+    def _train(self):
+        """Cluster live rows into lists and rewrite the files without dead rows"""
+        live = np.nonzero(self._live_mask())[0]
+        vectors = np.asarray(self._rows("vectors")[live])
+        nlist = max(16, int(4 * np.sqrt(len(live))))
+        nlist = min(nlist, len(live))
+        rng = np.random.default_rng(0)
+        sample = vectors[rng.choice(len(vectors), min(len(vectors), nlist * 64), replace=False)]
+        centroids = _spherical_kmeans(sample, nlist)
+
+        lists = np.empty(len(vectors), dtype=np.int32)
+        for start in range(0, len(vectors), 8192):
+            lists[start:start + 8192] = np.argmax(vectors[start:start + 8192] @ centroids.T, axis=1)
+
+        # Store rows grouped by list so a probe reads contiguous pages
+        order = np.argsort(lists, kind="stable")
+        columns = {
+            "vectors": vectors[order],
+            "documents": np.asarray(self._rows("documents")[live])[order],
+            "chunk_indexes": np.asarray(self._rows("chunk_indexes")[live])[order],
+            "lists": lists[order]
+        }
+        # Write the next generation beside the live one, then switch to it
+        # with one atomic rename of meta.json
+        previous = self._meta.get("generation", 0)
+        generation = previous + 1
+        target = self._generation_dir(generation)
+        shutil.rmtree(target, ignore_errors=True)
+        os.makedirs(target)
+        for key, (name, _) in _ROW_FILES.items():
+            with open(self._data_file(name, generation), "wb") as f:
+                f.write(np.ascontiguousarray(columns[key]).tobytes())
+        np.save(self._data_file("centroids.npy", generation), centroids)
+
+        self._meta.update({
+            "count": len(live), "nlist": nlist, "trained_count": len(live), "tombstones": {}, "generation": generation
+        })
+        self._write_meta()
+        self._maps = {}
+        self._centroids = None
+        self._live = None
+        self._remove_generations_before(previous)
+        logger.info(f"Trained ANN index {self.path}: {len(live)} vectors in {nlist} lists")
+
+    def _remove_generations_before(self, generation: int):
+        """Delete generations older than the given one (the one before the live generation stays)"""
+        for name in os.listdir(self.path):
+            if name.startswith("gen-") and name[4:].isdigit() and int(name[4:]) < generation:
+                shutil.rmtree(self._file(name), ignore_errors=True)
+        if generation > 0:
+            for name, _ in _ROW_FILES.values():
+                if os.path.exists(self._file(name)):
+                    os.remove(self._file(name))
+            if os.path.exists(self._file("centroids.npy")):
+                os.remove(self._file("centroids.npy"))
+
+    # -- reads -------------------------------------------------------------
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._refresh()
+            return self._meta["count"]
+
+    def _snapshot(self) -> Dict[str, Any]:
+        """Row maps, centroids and live mask taken together under the lock.
+
+        Writers replace the maps and meta under the same lock, so reading
+        them piecemeal could pair a mask from one version with rows from
+        another. The maps stay valid after a write: appends only grow the
+        files and a retrain publishes new files rather than changing these.
+        """
+        with self._lock:
+            self._refresh()
+            snapshot = {key: self._rows(key) for key in _ROW_FILES}
+            snapshot["live"] = self._live_mask()
+            snapshot["centroids"] = self._centroid_matrix()
+            return snapshot
+
+    def _live_mask(self) -> np.ndarray:
+        """Boolean mask of rows not hidden by a tombstone (a fresh copy per call)"""
+        version = self._meta["version"]
+        if self._live is None or self._live[0] != version:
+            mask = np.ones(self._meta["count"], dtype=bool)
+            if self._meta["tombstones"]:
+                documents = self._rows("documents")
+                positions = np.arange(self._meta["count"])
+                for document_id, cutoff in self._meta["tombstones"].items():
+                    mask &= ~((documents == document_id.encode()) & (positions < cutoff))
+            self._live = (version, mask)
+        return self._live[1].copy()
+
+    def search(
+        self,
+        query: Sequence[float],
+        top_k: int = 10,
+        nprobe: int = 8,
+        document_ids: Optional[Iterable[str]] = None
+    ) -> List[Tuple[str, int, float]]:
+        """Return (document_id, chunk_index, cosine similarity) for the approximate top_k rows"""
+        snapshot = self._snapshot()
+        mask = snapshot["live"]
+        if len(mask) == 0:
+            return []
+        q = np.asarray(query, dtype=np.float32)
+        q = q / (np.linalg.norm(q) or 1.0)
+
+        if document_ids is not None:
+            allowed = np.asarray(list(document_ids), dtype=_ID_DTYPE)
+            mask &= np.isin(snapshot["documents"], allowed)
+        centroids = snapshot["centroids"]
+        # A filter that already leaves few rows is cheaper (and exact) to scan in full
+        if centroids is not None and mask.sum() > self.train_threshold:
+            nprobe = min(nprobe, len(centroids))
+            probes = np.argpartition(-(centroids @ q), nprobe - 1)[:nprobe]
+            mask &= np.isin(snapshot["lists"], probes)
+
+        candidates = np.nonzero(mask)[0]
+        if len(candidates) == 0:
+            return []
+        scores = snapshot["vectors"][candidates] @ q
+        if top_k < len(scores):
+            best = np.argpartition(-scores, top_k - 1)[:top_k]
+        else:
+            best = np.arange(len(scores))
+        best = best[np.argsort(-scores[best])]
+        rows = candidates[best]
+        documents = snapshot["documents"]
+        chunk_indexes = snapshot["chunk_indexes"]
+        return [
+            (documents[row].decode(), int(chunk_indexes[row]), float(scores[i]))
+            for row, i in zip(rows, best)
+        ]
+
+
+class AnnIndexManager:
+    """Keeps one IVFIndex per user open, bounded by an LRU"""
+
+    def __init__(self, root: str, dimensions: int, train_threshold: int, nprobe: int, max_open: int = 64):
+        self.root = root
+        self.dimensions = dimensions
+        self.train_threshold = train_threshold
+        self.nprobe = nprobe
+        self.max_open = max_open
+        self._indexes: "OrderedDict[str, IVFIndex]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id: str) -> IVFIndex:
+        with self._lock:
+            index = self._indexes.get(user_id)
+            if index is None:
+                safe_id = "".join(c for c in user_id if c.isalnum() or c in "-_")
+                index = IVFIndex(os.path.join(self.root, safe_id), self.dimensions, self.train_threshold)
+                self._indexes[user_id] = index
+                while len(self._indexes) > self.max_open:
+                    self._indexes.popitem(last=False)
+            self._indexes.move_to_end(user_id)
+            return index
+
+    def search(
+        self,
+        user_id: str,
+        query: Sequence[float],
+        top_k: int = 10,
+        nprobe: Optional[int] = None,
+        document_ids: Optional[Iterable[str]] = None
+    ) -> List[Tuple[str, int, float]]:
+        return self.get(user_id).search(query, top_k, nprobe or self.nprobe, document_ids)
+
+# Global instance
+ann_index_manager = AnnIndexManager(
+    root=settings.ann_index_dir,
+    dimensions=settings.embedding_dimensions,
+    train_threshold=settings.ann_train_threshold,
+    nprobe=settings.ann_nprobe
+)
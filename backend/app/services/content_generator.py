@@ -1,8 +1,14 @@
 import openai
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, AsyncIterator, Optional
+import asyncio
 import logging
 import tiktoken
 from app.config import settings
+from app.services.embedding_cache import embedding_cache
+from app.services.ann_index import ann_index_manager
+from app.services.supabase_client import supabase_client
+from app.services.context_assembler import context_assembler
+from app.services.document_sections import split_sections, section_text, section_outline, splice_sections
 
 logger = logging.getLogger(__name__)
 
@@ -16,50 +22,104 @@ class ContentGenerator:
         return len(self.encoding.encode(text))
     
     async def generate_embeddings(self, texts: List[str]) -> List[List[float]]:
-        """Generate embeddings for texts"""
+        """Generate embeddings for texts, serving repeats from the embedding cache"""
         try:
-            response = await openai.Embedding.acreate(
-                model=settings.embedding_model,
-                input=texts
-            )
-            return [item["embedding"] for item in response["data"]]
-        except Exception as e:
-            logger.error(f"Error generating embeddings: {e}")
-            raise
-    
-    async def retrieve_relevant_chunks(
-        self, 
-        query: str, 
-        chunks: List[Dict[str, Any]], 
-        top_k: int = 10
-    ) -> List[Dict[str, Any]]:
-        """Retrieve most relevant chunks using semantic search"""
-        try:
-            # Generate query embedding
-            query_embedding = await self.generate_embeddings([query])[0]
+            keys = [
+                embedding_cache.make_key(settings.embedding_model, settings.embedding_dimensions, text)
+                for text in texts
+            ]
+            cached = await asyncio.to_thread(embedding_cache.get_many, keys)
             
-            # Calculate similarities (simplified - in production, use vector DB)
-            similarities = []
-            for chunk in chunks:
-                if "embedding" in chunk:
-                    # Calculate cosine similarity
-                    similarity = self._cosine_similarity(query_embedding, chunk["embedding"])
-                    similarities.append((similarity, chunk))
+            # Only texts missing from the cache go to the API, each once
+            missing = {}
+            for key, text in zip(keys, texts):
+                if key not in cached:
+                    missing.setdefault(key, text)
             
-            # Sort by similarity and return top_k
-            similarities.sort(key=lambda x: x[0], reverse=True)
-            return [chunk for _, chunk in similarities[:top_k]]
+            if missing:
+                response = await openai.Embedding.acreate(
+                    model=settings.embedding_model,
+                    input=list(missing.values())
+                )
+                fresh = {
+                    key: item["embedding"]
+                    for key, item in zip(missing.keys(), response["data"])
+                }
+                await asyncio.to_thread(embedding_cache.put_many, fresh)
+                cached.update(fresh)
             
+            return [cached[key] for key in keys]
         except Exception as e:
-            logger.error(f"Error retrieving relevant chunks: {e}")
+            logger.error(f"Error generating embeddings: {e}")
             raise
     
-    def _cosine_similarity(self, a: List[float], b: List[float]) -> float:
-        """Calculate cosine similarity between two vectors"""
-        import numpy as np
-        a = np.array(a)
-        b = np.array(b)
-        return np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b))
+    async def search_source_chunks(
+        self,
+        query: str,
+        user_id: str,
+        source_doc_ids: List[str],
+        top_k: int = 10,
+        include_embeddings: bool = False
+    ) -> List[Dict[str, Any]]:
+        """Top-k chunks of the given documents for a query.
+
+        With RETRIEVAL_BACKEND=ann the user's local ANN index ranks them and
+        only the winning rows are read from document_chunks; otherwise (or
+        if the user's ANN index has nothing for these documents yet) they
+        are ranked in Postgres by the HNSW index.
+        """
+        query_embedding = (await self.generate_embeddings([query]))[0]
+        if settings.retrieval_backend == "ann":
+            try:
+                chunks = await self._search_ann(query_embedding, user_id, source_doc_ids, top_k, include_embeddings)
+            except Exception as e:
+                # The local index is an accelerator; pgvector below has every chunk
+                logger.error(f"ANN search failed for user {user_id}, falling back to pgvector: {e}")
+                chunks = []
+            if chunks:
+                return chunks
+        rows = await supabase_client.match_document_chunks(
+            query_embedding, user_id, source_doc_ids, top_k, include_embeddings
+        )
+        return [self._chunk_from_row(row, row["similarity"]) for row in rows]
+    
+    @staticmethod
+    def _chunk_from_row(row: Dict[str, Any], similarity: float) -> Dict[str, Any]:
+        return {
+            "text": row["chunk_text"],
+            "document_id": row["document_id"],
+            "chunk_index": row["chunk_index"],
+            "metadata": row.get("metadata") or {},
+            "embedding": row.get("embedding"),
+            "similarity": similarity
+        }
+    
+    async def _search_ann(
+        self,
+        query_embedding: List[float],
+        user_id: str,
+        source_doc_ids: List[str],
+        top_k: int,
+        include_embeddings: bool
+    ) -> List[Dict[str, Any]]:
+        hits = await asyncio.to_thread(
+            ann_index_manager.search, user_id, query_embedding, top_k, None, source_doc_ids
+        )
+        if not hits:
+            return []
+        columns = "document_id, chunk_index, chunk_text, metadata" + (", embedding" if include_embeddings else "")
+        response = await supabase_client.execute(
+            supabase_client.get_service_client().table("document_chunks").select(columns).in_(
+                "document_id", sorted({document_id for document_id, _, _ in hits})
+            ).in_("chunk_index", sorted({chunk_index for _, chunk_index, _ in hits}))
+        )
+        # The two IN filters can match a few extra (document, index) pairs; keep the hits
+        rows = {(row["document_id"], row["chunk_index"]): row for row in response.data}
+        return [
+            self._chunk_from_row(rows[(document_id, chunk_index)], score)
+            for document_id, chunk_index, score in hits
+            if (document_id, chunk_index) in rows
+        ]
     
     async def generate_content_preview(
         self,
@@ -70,15 +130,14 @@ class ContentGenerator:
     ) -> Dict[str, Any]:
         """Generate preview (ToC, style, example snippet)"""
         try:
-            # Combine source chunks
-            context = "\n\n".join([chunk["text"] for chunk in source_chunks])
+            context = context_assembler.assemble(source_chunks, settings.preview_context_tokens)
             
             # Create preview prompt
             preview_prompt = f"""
             Based on the following source material, create a content generation plan:
             
             Source Material:
-            {context[:4000]}  # Limit context for preview
+            {context["text"]}
             
             Please provide:
             1. A detailed table of contents with section descriptions
@@ -103,14 +162,103 @@ class ContentGenerator:
                 "toc": {"sections": ["Introduction", "Main Content", "Conclusion"]},
                 "style_guide": {"tone": "professional", "audience": "general"},
                 "example_snippet": content[:200] + "...",
-                "source_citations": [f"Document {i+1}" for i in range(len(source_chunks))],
-                "estimated_tokens": self.count_tokens(context)
+                "source_citations": [f"{source['marker']} {source['title']}" for source in context["sources"]],
+                "estimated_tokens": context["tokens"]
             }
             
         except Exception as e:
             logger.error(f"Error generating content preview: {e}")
             raise
     
+    def build_generation_prompt(
+        self,
+        source_chunks: List[Dict[str, Any]],
+        template_prompt: Optional[str] = None,
+        custom_prompt: Optional[str] = None
+    ) -> str:
+        """Pack the source context and wrap it in the generation instructions"""
+        packed = context_assembler.assemble(source_chunks, settings.generation_context_tokens)
+        context = packed["text"]
+        logger.info(
+            f"Packed {packed['chunks_used']} of {len(source_chunks)} chunks from "
+            f"{len(packed['sources'])} sources into {packed['tokens']} tokens"
+        )
+        
+        if custom_prompt:
+            return f"""
+            {custom_prompt}
+            
+            Source Material:
+            {context}
+            
+            Please generate the requested content based on the source material above.
+            Cite the source material with its bracketed markers, e.g. [1].
+            """
+        elif template_prompt:
+            return f"""
+            {template_prompt}
+            
+            Source Material:
+            {context}
+            
+            Please generate content following the template above.
+            Cite the source material with its bracketed markers, e.g. [1].
+            """
+        else:
+            return f"""
+            Based on the following source material, create comprehensive, well-structured content:
+            
+            Source Material:
+            {context}
+            
+            Please create engaging, informative content that synthesizes the key information.
+            Cite the source material with its bracketed markers, e.g. [1].
+            """
+    
+    @staticmethod
+    def _refinement_sources(source_chunks: Optional[List[Dict[str, Any]]]) -> str:
+        """Source material block for a refinement prompt, empty without sources"""
+        if not source_chunks:
+            return ""
+        packed = context_assembler.assemble(source_chunks, settings.refinement_context_tokens)
+        return f"""
+            Source Material (use it for facts the request asks for, citing its bracketed markers):
+            {packed["text"]}
+            """
+    
+    def build_refinement_prompt(
+        self,
+        content: str,
+        refinement_prompt: str,
+        source_chunks: Optional[List[Dict[str, Any]]] = None
+    ) -> str:
+        return f"""
+            Please refine the following content based on the user's request:
+            
+            User Request: {refinement_prompt}
+            {self._refinement_sources(source_chunks)}
+            Current Content:
+            {content}
+            
+            Please provide the refined version.
+            """
+    
+    def build_section_refinement_prompt(self, outline: str, section: str, refinement_prompt: str, sources: str = "") -> str:
+        return f"""
+            Please revise one section of a longer document based on the user's request.
+            
+            User Request: {refinement_prompt}
+            {sources}
+            Document Outline:
+            {outline}
+            
+            Section To Revise:
+            {section}
+            
+            Return only the revised section in Markdown, starting with its heading if it has one.
+            Do not include any other part of the document.
+            """
+    
     async def generate_full_content(
         self,
         source_chunks: List[Dict[str, Any]],
@@ -120,68 +268,120 @@ class ContentGenerator:
     ) -> str:
         """Generate full content based on source chunks and requirements"""
         try:
-            # Combine source chunks
-            context = "\n\n".join([chunk["text"] for chunk in source_chunks])
-            
-            # Create generation prompt
-            if custom_prompt:
-                generation_prompt = f"""
-                {custom_prompt}
-                
-                Source Material:
-                {context}
-                
-                Please generate the requested content based on the source material above.
-                """
-            elif template_prompt:
-                generation_prompt = f"""
-                {template_prompt}
-                
-                Source Material:
-                {context}
-                
-                Please generate content following the template above.
-                """
+            generation_prompt = self.build_generation_prompt(source_chunks, template_prompt, custom_prompt)
+            
+            return await self._complete(generation_prompt, 4000)
+            
+        except Exception as e:
+            logger.error(f"Error generating full content: {e}")
+            raise
+    
+    async def _complete(self, prompt: str, max_tokens: int) -> str:
+        """Complete a generation prompt. Answers are cached per request by the
+        content router, before retrieval, so nothing is cached here."""
+        response = await openai.ChatCompletion.acreate(
+            model="gpt-4",
+            messages=[{"role": "user", "content": prompt}],
+            temperature=0.7,
+            max_tokens=max_tokens
+        )
+        
+        return response.choices[0].message.content
+    
+    @staticmethod
+    def toc_sections(toc: Optional[Dict[str, Any]]) -> List[Dict[str, str]]:
+        """Normalize a ToC into [{"title", "description"}].
+
+        Sections may be plain titles (as the preview returns them) or
+        objects with a title (or name/heading) and an optional description.
+        """
+        sections = []
+        for section in (toc or {}).get("sections") or []:
+            if isinstance(section, str):
+                title, description = section, ""
             else:
-                generation_prompt = f"""
-                Based on the following source material, create comprehensive, well-structured content:
-                
-                Source Material:
-                {context}
-                
-                Please create engaging, informative content that synthesizes the key information.
-                """
+                title = section.get("title") or section.get("name") or section.get("heading") or ""
+                description = section.get("description") or ""
+            if title.strip():
+                sections.append({"title": title.strip(), "description": description.strip()})
+        return sections
+    
+    def build_section_prompt(
+        self,
+        sections: List[Dict[str, str]],
+        position: int,
+        source_chunks: List[Dict[str, Any]],
+        template_prompt: Optional[str] = None,
+        custom_prompt: Optional[str] = None
+    ) -> str:
+        """Prompt for one section: the whole outline for scope, plus context retrieved for this section"""
+        packed = context_assembler.assemble(source_chunks, settings.section_context_tokens)
+        section = sections[position]
+        outline = "\n".join(
+            f"{i + 1}. {item['title']}" + (" (this section)" if i == position else "")
+            for i, item in enumerate(sections)
+        )
+        
+        return f"""
+            {custom_prompt or template_prompt or "Create comprehensive, well-structured content from the source material."}
             
-            response = await openai.ChatCompletion.acreate(
-                model="gpt-4",
-                messages=[{"role": "user", "content": generation_prompt}],
-                temperature=0.7,
-                max_tokens=4000
-            )
+            The document has this outline:
+            {outline}
             
-            return response.choices[0].message.content
+            Write only section {position + 1}, "{section['title']}". {section['description']}
+            Do not repeat the section heading and do not cover the other sections.
+            
+            Source Material:
+            {packed["text"]}
+            
+            Cite the source material with its bracketed markers, e.g. [1].
+            """
+    
+    async def generate_sectioned_content(
+        self,
+        sections: List[Dict[str, str]],
+        section_chunks: List[List[Dict[str, Any]]],
+        template_prompt: Optional[str] = None,
+        custom_prompt: Optional[str] = None
+    ) -> str:
+        """Generate each ToC section concurrently from its own context and stitch them in order"""
+        try:
+            semaphore = asyncio.Semaphore(settings.section_concurrency)
+            
+            async def generate_section(position: int) -> str:
+                prompt = self.build_section_prompt(
+                    sections, position, section_chunks[position], template_prompt, custom_prompt
+                )
+                async with semaphore:
+                    return await self._complete(prompt, settings.section_max_tokens)
+            
+            tasks = [asyncio.create_task(generate_section(position)) for position in range(len(sections))]
+            try:
+                bodies = await asyncio.gather(*tasks)
+            except BaseException:
+                # One failed section fails the document; don't pay for the rest
+                for task in tasks:
+                    task.cancel()
+                raise
+            
+            return "\n\n".join(
+                f"## {section['title']}\n\n{body.strip()}"
+                for section, body in zip(sections, bodies)
+            )
             
         except Exception as e:
-            logger.error(f"Error generating full content: {e}")
+            logger.error(f"Error generating sectioned content: {e}")
             raise
     
     async def refine_content(
         self,
         content: str,
-        refinement_prompt: str
+        refinement_prompt: str,
+        source_chunks: Optional[List[Dict[str, Any]]] = None
     ) -> str:
         """Refine existing content based on user feedback"""
         try:
-            prompt = f"""
-            Please refine the following content based on the user's request:
-            
-            User Request: {refinement_prompt}
-            
-            Current Content:
-            {content}
-            
-            Please provide the refined version.
-            """
+            prompt = self.build_refinement_prompt(content, refinement_prompt, source_chunks)
             
             response = await openai.ChatCompletion.acreate(
                 model="gpt-4",
@@ -195,6 +395,80 @@ class ContentGenerator:
         except Exception as e:
             logger.error(f"Error refining content: {e}")
             raise
+    
+    async def refine_sections(
+        self,
+        content: str,
+        refinement_prompt: str,
+        targets: List[int],
+        source_chunks: Optional[List[Dict[str, Any]]] = None
+    ) -> str:
+        """Refine only the targeted sections, each with the document outline (and
+        the source material, if any) for context, and splice the results back
+        into the unchanged remainder.
+        Raises ValueError for a section index the content doesn't have."""
+        sections = split_sections(content)
+        targets = sorted(set(targets))
+        invalid = [index for index in targets if not 0 <= index < len(sections)]
+        if invalid:
+            raise ValueError(f"Unknown sections {invalid}; the document has {len(sections)}")
+        
+        try:
+            outline = section_outline(sections, targets)
+            sources = self._refinement_sources(source_chunks)
+            semaphore = asyncio.Semaphore(settings.section_concurrency)
+            
+            async def refine_section(index: int) -> str:
+                original = section_text(content, sections[index]).strip()
+                prompt = self.build_section_refinement_prompt(outline, original, refinement_prompt, sources)
+                # Room for the section to roughly double, not for a whole document
+                max_tokens = min(4000, 2 * self.count_tokens(original) + 256)
+                async with semaphore:
+                    response = await openai.ChatCompletion.acreate(
+                        model="gpt-4",
+                        messages=[{"role": "user", "content": prompt}],
+                        temperature=0.7,
+                        max_tokens=max_tokens
+                    )
+                revised = response.choices[0].message.content.strip()
+                if sections[index]["level"] and not revised.startswith("#"):
+                    revised = original.splitlines()[0] + "\n\n" + revised
+                return revised
+            
+            tasks = [asyncio.create_task(refine_section(index)) for index in targets]
+            try:
+                revised = await asyncio.gather(*tasks)
+            except BaseException:
+                for task in tasks:
+                    task.cancel()
+                raise
+            
+            return splice_sections(content, sections, dict(zip(targets, revised)))
+            
+        except Exception as e:
+            logger.error(f"Error refining sections: {e}")
+            raise
+    
+    async def stream_completion(self, prompt: str, max_tokens: int = 4000) -> AsyncIterator[str]:
+        """Yield completion text as the model produces it.
+
+        Closing or cancelling the iterator (e.g. when the client disconnects)
+        closes the upstream HTTP stream so the model stops generating.
+        """
+        response = await openai.ChatCompletion.acreate(
+            model="gpt-4",
+            messages=[{"role": "user", "content": prompt}],
+            temperature=0.7,
+            max_tokens=max_tokens,
+            stream=True
+        )
+        try:
+            async for chunk in response:
+                delta = chunk.choices[0].delta.get("content")
+                if delta:
+                    yield delta
+        finally:
+            await response.aclose()
 
 # Global instance
 content_generator = ContentGenerator()
@@ -0,0 +1,135 @@
+from typing import List, Dict, Any
+import logging
+
+import numpy as np
+import tiktoken
+
+from app.config import settings
+from app.services.supabase_client import parse_embedding
+
+logger = logging.getLogger(__name__)
+
+
+class ContextAssembler:
+    """Builds the source-material block of a generation prompt.
+
+    Candidate chunks are ordered by maximal marginal relevance (relevance
+    to the query minus redundancy with chunks already chosen), then packed
+    until the token budget is spent, counted with the same encoding the
+    model uses. Each source document gets a citation marker such as [1],
+    listed in a legend at the top of the context.
+    """
+
+    def __init__(self, mmr_lambda: float, min_fragment_tokens: int = 64, encoding_name: str = "cl100k_base"):
+        self.mmr_lambda = mmr_lambda
+        self.min_fragment_tokens = min_fragment_tokens
+        self.encoding = tiktoken.get_encoding(encoding_name)
+
+    def count_tokens(self, text: str) -> int:
+        return len(self.encoding.encode(text))
+
+    def mmr_order(self, chunks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Order chunks by MMR; chunks without embeddings are never penalized as redundant"""
+        if not chunks:
+            return []
+        relevance = np.array([chunk.get("similarity") or 0.0 for chunk in chunks], dtype=np.float32)
+        if not relevance.any():
+            return self._round_robin(chunks)
+
+        embedded = [i for i, chunk in enumerate(chunks) if chunk.get("embedding") is not None]
+        vectors = np.zeros((len(chunks), settings.embedding_dimensions), dtype=np.float32)
+        if embedded:
+            block = np.asarray([parse_embedding(chunks[i]["embedding"]) for i in embedded], dtype=np.float32)
+            norms = np.linalg.norm(block, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            vectors[embedded] = block / norms
+
+        redundancy = np.zeros(len(chunks), dtype=np.float32)
+        remaining = np.ones(len(chunks), dtype=bool)
+        order = []
+        for _ in range(len(chunks)):
+            scores = self.mmr_lambda * relevance - (1 - self.mmr_lambda) * redundancy
+            scores[~remaining] = -np.inf
+            best = int(np.argmax(scores))
+            order.append(chunks[best])
+            remaining[best] = False
+            redundancy = np.maximum(redundancy, vectors @ vectors[best])
+        return order
+
+    @staticmethod
+    def _round_robin(chunks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Interleave unscored chunks across documents so one large source can't take the whole budget"""
+        by_document: Dict[str, List[Dict[str, Any]]] = {}
+        for chunk in chunks:
+            by_document.setdefault(chunk["document_id"], []).append(chunk)
+        queues = list(by_document.values())
+        order = []
+        depth = 0
+        while len(order) < len(chunks):
+            for queue in queues:
+                if depth < len(queue):
+                    order.append(queue[depth])
+            depth += 1
+        return order
+
+    def assemble(self, chunks: List[Dict[str, Any]], token_budget: int) -> Dict[str, Any]:
+        """Pack the most useful chunks into token_budget tokens.
+
+        Returns the context text, the cited sources, its exact token count
+        and how many chunks made it in.
+        """
+        markers: Dict[str, int] = {}
+        for chunk in chunks:
+            markers.setdefault(chunk["document_id"], len(markers) + 1)
+        titles = {chunk["document_id"]: chunk.get("title") or chunk["document_id"] for chunk in chunks}
+
+        def legend(cited: List[str]) -> str:
+            lines = [f"[{markers[document_id]}] {titles[document_id]}" for document_id in cited]
+            return "Sources:\n" + "\n".join(lines) + "\n\n"
+
+        # Reserve room for a legend naming every source; the real one can only be shorter
+        remaining = token_budget - self.count_tokens(legend(list(markers)))
+        selected = []
+        skipped = None
+        for chunk in self.mmr_order(chunks):
+            if remaining < self.min_fragment_tokens:
+                break
+            block = f"[{markers[chunk['document_id']]}] {chunk['text'].strip()}\n\n"
+            tokens = self.encoding.encode(block)
+            if len(tokens) > remaining:
+                # Keep looking for smaller chunks that still fit
+                if skipped is None:
+                    skipped = (chunk, tokens)
+                continue
+            selected.append((chunk, block))
+            remaining -= len(tokens)
+
+        # Fill what's left with the head of the best chunk that didn't fit
+        if skipped is not None and remaining >= self.min_fragment_tokens:
+            chunk, tokens = skipped
+            fragment = self.encoding.decode(tokens[:remaining - self.count_tokens("\n\n")])
+            selected.append((chunk, fragment.rstrip() + "\n\n"))
+
+        # Present chosen passages in reading order within each source
+        selected.sort(key=lambda item: (markers[item[0]["document_id"]], item[0].get("chunk_index", 0)))
+        cited = sorted({chunk["document_id"] for chunk, _ in selected}, key=markers.get)
+        text = (legend(cited) + "".join(block for _, block in selected)).rstrip() if selected else ""
+
+        # BPE merges across block boundaries can shift the count slightly; trim to stay exact
+        tokens = self.encoding.encode(text)
+        if len(tokens) > token_budget:
+            text = self.encoding.decode(tokens[:token_budget])
+            tokens = tokens[:token_budget]
+
+        return {
+            "text": text,
+            "sources": [
+                {"marker": f"[{markers[document_id]}]", "document_id": document_id, "title": titles[document_id]}
+                for document_id in cited
+            ],
+            "tokens": len(tokens),
+            "chunks_used": len(selected)
+        }
+
+# Global instance
+context_assembler = ContextAssembler(mmr_lambda=settings.context_mmr_lambda)
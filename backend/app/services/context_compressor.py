@@ -0,0 +1,192 @@
+from typing import List, Dict, Any, Tuple
+import logging
+import re
+import threading
+
+import numpy as np
+import tiktoken
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+_SENTENCE_SPLIT = re.compile(r"(?<=[.!?])[\"')\]]*\s+|\n+")
+_WORD = re.compile(r"[a-z0-9]+")
+
+
+class ContextCompressor:
+    """Extractive compression of source chunks, on CPU and without a model call.
+
+    Chunks are split into sentences; page furniture (lines repeated across
+    chunks such as running headers) and near-duplicate sentences (Jaccard
+    similarity of word trigrams) are dropped, then sentences are scored with
+    TextRank over TF-IDF similarity and each chunk keeps its best sentences,
+    in their original order, up to target_ratio of its tokens.
+    """
+
+    def __init__(
+        self,
+        target_ratio: float,
+        duplicate_threshold: float,
+        min_chunk_tokens: int = 48,
+        encoding_name: str = "cl100k_base"
+    ):
+        self.target_ratio = target_ratio
+        self.duplicate_threshold = duplicate_threshold
+        self.min_chunk_tokens = min_chunk_tokens
+        self.encoding = tiktoken.get_encoding(encoding_name)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.tokens_in = 0
+        self.tokens_saved = 0
+
+    def split_sentences(self, text: str) -> List[str]:
+        return [sentence.strip() for sentence in _SENTENCE_SPLIT.split(text) if sentence.strip()]
+
+    @staticmethod
+    def _shingles(words: List[str]) -> set:
+        if len(words) < 3:
+            return {" ".join(words)}
+        return {" ".join(words[i:i + 3]) for i in range(len(words) - 2)}
+
+    def _drop_duplicates(self, sentences: List[Tuple[int, str, List[str]]]) -> Tuple[List[Tuple[int, str, List[str]]], int]:
+        """Drop repeated boilerplate lines and sentences that nearly repeat an earlier one"""
+        line_counts: Dict[str, int] = {}
+        for _, sentence, _ in sentences:
+            line_counts[sentence.lower()] = line_counts.get(sentence.lower(), 0) + 1
+
+        kept = []
+        kept_shingles: List[set] = []
+        index: Dict[str, List[int]] = {}  # shingle -> positions in kept
+        dropped = 0
+        for chunk_position, sentence, words in sentences:
+            # Lines without letters (page numbers) and short unpunctuated lines seen more
+            # than once (running headers and footers) are page furniture
+            if not any(char.isalpha() for char in sentence) or (
+                len(words) <= 6 and sentence[-1] not in ".!?" and line_counts[sentence.lower()] > 1
+            ):
+                dropped += 1
+                continue
+            shingles = self._shingles(words)
+            candidates = {position for shingle in shingles for position in index.get(shingle, ())}
+            if any(
+                len(shingles & kept_shingles[position]) / len(shingles | kept_shingles[position]) >= self.duplicate_threshold
+                for position in candidates
+            ):
+                dropped += 1
+                continue
+            for shingle in shingles:
+                index.setdefault(shingle, []).append(len(kept))
+            kept.append((chunk_position, sentence, words))
+            kept_shingles.append(shingles)
+        return kept, dropped
+
+    @staticmethod
+    def _textrank(sentences: List[List[str]], damping: float = 0.85, iterations: int = 30) -> np.ndarray:
+        """PageRank over the cosine similarity graph of TF-IDF sentence vectors.
+
+        The TF-IDF matrix V is kept sparse (one entry per distinct word of a
+        sentence) and the similarity graph V V^T is never formed: each power
+        iteration multiplies by V^T and then V, so time and memory grow with
+        the number of words rather than the square of the sentence count.
+        """
+        count = len(sentences)
+        vocabulary: Dict[str, int] = {}
+        rows: List[int] = []
+        columns: List[int] = []
+        for row, words in enumerate(sentences):
+            for word in words:
+                rows.append(row)
+                columns.append(vocabulary.setdefault(word, len(vocabulary)))
+        if not rows:
+            return np.full(count, 1.0 / count, dtype=np.float32)
+
+        # Merge repeated words of a sentence into term counts
+        width = len(vocabulary)
+        keys, term_counts = np.unique(np.asarray(rows, dtype=np.int64) * width + np.asarray(columns), return_counts=True)
+        rows_index, columns_index = keys // width, keys % width
+        idf = np.log((1 + count) / (1 + np.bincount(columns_index, minlength=width))) + 1
+        values = term_counts * idf[columns_index]
+        norms = np.sqrt(np.bincount(rows_index, weights=values ** 2, minlength=count))
+        values /= norms[rows_index]
+        self_similarity = (norms > 0).astype(np.float64)
+
+        def similarity_times(vector: np.ndarray) -> np.ndarray:
+            # (V V^T - diag) @ vector: sentence similarities without self-loops
+            projected = np.bincount(columns_index, weights=values * vector[rows_index], minlength=width)
+            return np.bincount(rows_index, weights=values * projected[columns_index], minlength=count) - self_similarity * vector
+
+        out_weight = similarity_times(np.ones(count))
+        out_weight[out_weight < 1e-9] = 1.0
+
+        # The graph is symmetric, so transition^T @ scores is similarity @ (scores / out_weight)
+        scores = np.full(count, 1.0 / count)
+        for _ in range(iterations):
+            scores = (1 - damping) / count + damping * similarity_times(scores / out_weight)
+        return scores.astype(np.float32)
+
+    def compress(self, chunks: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+        """Return compressed copies of the chunks and a report of the tokens saved"""
+        original_tokens = [len(self.encoding.encode(chunk["text"])) for chunk in chunks]
+        sentences = [
+            (position, sentence, _WORD.findall(sentence.lower()))
+            for position, chunk in enumerate(chunks)
+            for sentence in self.split_sentences(chunk["text"])
+        ]
+        kept, dropped = self._drop_duplicates(sentences)
+        scores = self._textrank([words for _, _, words in kept]) if kept else np.zeros(0)
+
+        by_chunk: Dict[int, List[Tuple[int, str, float]]] = {}
+        for order, ((position, sentence, _), score) in enumerate(zip(kept, scores)):
+            by_chunk.setdefault(position, []).append((order, sentence, float(score)))
+
+        compressed = []
+        compressed_tokens = 0
+        for position, chunk in enumerate(chunks):
+            candidates = by_chunk.get(position, [])
+            sized = [(order, sentence, score, len(self.encoding.encode(sentence))) for order, sentence, score in candidates]
+            total = sum(tokens for *_, tokens in sized)
+            if total <= max(self.min_chunk_tokens, self.target_ratio * original_tokens[position]):
+                selected = sized
+            else:
+                # Best-scoring sentences until the chunk reaches its share of the budget
+                budget = self.target_ratio * original_tokens[position]
+                selected, used = [], 0
+                for item in sorted(sized, key=lambda item: -item[2]):
+                    if used and used + item[3] > budget:
+                        continue
+                    selected.append(item)
+                    used += item[3]
+                selected.sort(key=lambda item: item[0])
+            if not selected:
+                continue
+            text = " ".join(sentence for _, sentence, _, _ in selected)
+            tokens = len(self.encoding.encode(text))
+            compressed_tokens += tokens
+            compressed.append({**chunk, "text": text, "metadata": {**chunk.get("metadata", {}), "token_count": tokens}})
+
+        report = {
+            "original_tokens": sum(original_tokens),
+            "compressed_tokens": compressed_tokens,
+            "tokens_saved": sum(original_tokens) - compressed_tokens,
+            "sentences_dropped": dropped,
+            "ratio": round(compressed_tokens / sum(original_tokens), 3) if sum(original_tokens) else None
+        }
+        with self._lock:
+            self.requests += 1
+            self.tokens_in += report["original_tokens"]
+            self.tokens_saved += report["tokens_saved"]
+        return compressed, report
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "tokens_in": self.tokens_in,
+            "tokens_saved": self.tokens_saved
+        }
+
+# Global instance
+context_compressor = ContextCompressor(
+    target_ratio=settings.context_compression_ratio,
+    duplicate_threshold=settings.compression_duplicate_threshold
+)
@@ -0,0 +1,72 @@
+from typing import Any, Dict, List, Sequence
+import re
+
+_HEADING = re.compile(r"^(#{1,6})[ \t]+(.+?)(?:[ \t]+#+)?[ \t]*$")
+_FENCE = re.compile(r"^[ \t]*(```|~~~)")
+
+
+def split_sections(content: str) -> List[Dict[str, Any]]:
+    """Split Markdown into addressable sections at its headings.
+
+    Each section runs from its heading to the next heading of any level;
+    text before the first heading is an untitled level-0 section.
+    Headings inside fenced code blocks are ignored. Sections carry their
+    character offsets, so they can be spliced back with splice_sections.
+    """
+    boundaries = []
+    in_fence = False
+    offset = 0
+    for line in content.splitlines(keepends=True):
+        if _FENCE.match(line):
+            in_fence = not in_fence
+        elif not in_fence:
+            match = _HEADING.match(line.rstrip("\r\n"))
+            if match:
+                boundaries.append((offset, len(match.group(1)), match.group(2).strip()))
+        offset += len(line)
+
+    sections = []
+    preamble_end = boundaries[0][0] if boundaries else len(content)
+    if content[:preamble_end].strip():
+        sections.append({"level": 0, "title": "", "start": 0, "end": preamble_end})
+    for i, (start, level, title) in enumerate(boundaries):
+        end = boundaries[i + 1][0] if i + 1 < len(boundaries) else len(content)
+        sections.append({"level": level, "title": title, "start": start, "end": end})
+
+    for index, section in enumerate(sections):
+        section["index"] = index
+    return sections
+
+
+def section_text(content: str, section: Dict[str, Any]) -> str:
+    return content[section["start"]:section["end"]]
+
+
+def section_outline(sections: Sequence[Dict[str, Any]], targets: Sequence[int] = ()) -> str:
+    """Compact indented outline of the headings, marking the target sections"""
+    lines = []
+    for section in sections:
+        title = section["title"] or "(introduction)"
+        indent = "  " * max(section["level"] - 1, 0)
+        marker = "  <- to be revised" if section["index"] in targets else ""
+        lines.append(f"{indent}- {title}{marker}")
+    return "\n".join(lines)
+
+
+def splice_sections(content: str, sections: Sequence[Dict[str, Any]], replacements: Dict[int, str]) -> str:
+    """Replace the given sections' text, keeping everything else byte for byte.
+    Each replacement keeps the whitespace that separated the original from what followed."""
+    parts = []
+    position = 0
+    for section in sections:
+        if section["index"] not in replacements:
+            continue
+        original = section_text(content, section)
+        trailing = original[len(original.rstrip()):]
+        if not trailing and section["end"] < len(content):
+            trailing = "\n\n"
+        parts.append(content[position:section["start"]])
+        parts.append(replacements[section["index"]].strip() + trailing)
+        position = section["end"]
+    parts.append(content[position:])
+    return "".join(parts)
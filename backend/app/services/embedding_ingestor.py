@@ -0,0 +1,259 @@
+from typing import List, Dict, Any, AsyncIterable, AsyncIterator, Awaitable, Callable, Iterable, Optional, Tuple, Union
+import asyncio
+import hashlib
+import logging
+import re
+import time
+import uuid
+
+from app.config import settings
+from app.services.supabase_client import supabase_client
+from app.services.content_generator import content_generator
+from app.services.supabase_client import parse_embedding
+from app.services.ann_index import ann_index_manager
+from app.services.search_index import search_index
+
+logger = logging.getLogger(__name__)
+
+ProgressCallback = Callable[[int, int], Awaitable[None]]
+Chunks = Union[Iterable[Dict[str, Any]], AsyncIterable[Dict[str, Any]]]
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def chunk_content_hash(text: str) -> str:
+    """SHA-256 of whitespace-normalized chunk text"""
+    return hashlib.sha256(_WHITESPACE.sub(" ", text).strip().encode("utf-8")).hexdigest()
+
+
+class EmbeddingIngestor:
+    """Embeds a document's chunks and stores them in document_chunks.
+
+    Chunks are packed into as few embedding requests as the per-request
+    token and input limits allow, a bounded number of requests run
+    concurrently, and rows are bulk-inserted in batches. Chunks whose
+    normalized text already has an embedding for the current model are
+    not sent to the API again.
+    """
+
+    def __init__(
+        self,
+        max_batch_tokens: int,
+        max_batch_items: int,
+        concurrency: int,
+        insert_batch_size: int
+    ):
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_items = max_batch_items
+        self.concurrency = concurrency
+        self.insert_batch_size = insert_batch_size
+        self.lookup_batch_size = 100
+        # Chunks held in memory at once while streaming a document through
+        self.window_size = max(max_batch_items, insert_batch_size)
+
+    async def find_existing_embeddings(self, hashes: List[str]) -> Dict[str, List[float]]:
+        """Look up stored embeddings for chunk hashes under the current embedding model"""
+        found: Dict[str, List[float]] = {}
+        chunk_table = supabase_client.get_service_client().table("document_chunks")
+        lookups = [
+            supabase_client.execute(chunk_table.select("content_hash, embedding").in_(
+                "content_hash", hashes[i:i + self.lookup_batch_size]
+            ).eq("embedding_model", settings.embedding_model).not_.is_("embedding", "null"))
+            for i in range(0, len(hashes), self.lookup_batch_size)
+        ]
+        for response in await asyncio.gather(*lookups):
+            for row in response.data:
+                found.setdefault(row["content_hash"], parse_embedding(row["embedding"]))
+        return found
+
+    def _index_window(
+        self,
+        user_id: str,
+        document_id: str,
+        chunks: List[Dict[str, Any]],
+        embeddings: Dict[str, List[float]]
+    ):
+        """Append a window of the document's chunks to the user's search indexes"""
+        if settings.retrieval_backend == "ann":
+            ann_index_manager.get(user_id).add(
+                [document_id] * len(chunks),
+                [chunk["index"] for chunk in chunks],
+                [embeddings[chunk["content_hash"]] for chunk in chunks]
+            )
+        search_index.add_chunks(user_id, document_id, [(chunk["index"], chunk["text"]) for chunk in chunks])
+
+    def _clear_indexes(self, user_id: str, document_id: str):
+        """Drop rows an earlier ingestion of the document left in the user's search indexes"""
+        if settings.retrieval_backend == "ann":
+            ann_index_manager.get(user_id).remove_document(document_id)
+        search_index.remove_document(document_id)
+
+    def pack_batches(self, chunks: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+        """Greedily group chunks into embedding requests within the token/item limits"""
+        batches = []
+        batch: List[Dict[str, Any]] = []
+        batch_tokens = 0
+        for chunk in chunks:
+            tokens = chunk["metadata"].get("token_count") or content_generator.count_tokens(chunk["text"])
+            if batch and (batch_tokens + tokens > self.max_batch_tokens or len(batch) >= self.max_batch_items):
+                batches.append(batch)
+                batch, batch_tokens = [], 0
+            batch.append(chunk)
+            batch_tokens += tokens
+        if batch:
+            batches.append(batch)
+        return batches
+
+    async def _windows(self, chunks: Chunks) -> AsyncIterator[List[Dict[str, Any]]]:
+        window: List[Dict[str, Any]] = []
+        if hasattr(chunks, "__aiter__"):
+            async for chunk in chunks:
+                window.append(chunk)
+                if len(window) >= self.window_size:
+                    yield window
+                    window = []
+        else:
+            for chunk in chunks:
+                window.append(chunk)
+                if len(window) >= self.window_size:
+                    yield window
+                    window = []
+        if window:
+            yield window
+
+    async def ingest(
+        self,
+        document_id: str,
+        chunks: Chunks,
+        on_progress: Optional[ProgressCallback] = None,
+        user_id: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """Embed and store all chunks for a document; returns throughput stats.
+
+        chunks may be an async iterator, e.g. straight from extraction: they
+        are consumed window_size at a time and each window is embedded and
+        written before the next is read, so memory stays bounded however
+        long the document is. Progress is reported as (stored, seen so far).
+        """
+        started = time.perf_counter()
+        if user_id is not None:
+            await asyncio.to_thread(self._clear_indexes, user_id, document_id)
+
+        totals = {"chunks": 0, "reused": 0, "requests": 0}
+        async for window in self._windows(chunks):
+            seen = totals["chunks"] + len(window)
+
+            async def window_progress(stored: int, _total: int):
+                if on_progress is not None:
+                    await on_progress(totals["chunks"] + stored, seen)
+
+            reused, requests = await self._ingest_window(document_id, window, window_progress, user_id)
+            totals["chunks"] = seen
+            totals["reused"] += reused
+            totals["requests"] += requests
+
+        elapsed = time.perf_counter() - started
+        stats = {
+            **totals,
+            "seconds": round(elapsed, 3),
+            "chunks_per_second": round(totals["chunks"] / elapsed, 1) if elapsed > 0 else None
+        }
+        logger.info(
+            f"Embedded {stats['chunks']} chunks ({stats['reused']} reused) for document {document_id} in "
+            f"{stats['requests']} requests, {stats['seconds']}s ({stats['chunks_per_second']} chunks/s)"
+        )
+        return stats
+
+    async def _ingest_window(
+        self,
+        document_id: str,
+        chunks: List[Dict[str, Any]],
+        on_progress: ProgressCallback,
+        user_id: Optional[str]
+    ) -> Tuple[int, int]:
+        """Embed and store one window of chunks; returns (reused, embedding requests).
+
+        Earlier windows are already in document_chunks, so passages repeated
+        across windows are found by the hash lookup like any stored embedding.
+        """
+        chunk_table = supabase_client.get_service_client().table("document_chunks")
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        for chunk in chunks:
+            chunk["content_hash"] = chunk_content_hash(chunk["text"])
+        known = await self.find_existing_embeddings(sorted({chunk["content_hash"] for chunk in chunks}))
+
+        # Repeated passages within the window are embedded once
+        to_embed: Dict[str, Dict[str, Any]] = {}
+        for chunk in chunks:
+            if chunk["content_hash"] not in known:
+                to_embed.setdefault(chunk["content_hash"], chunk)
+        batches = self.pack_batches(list(to_embed.values()))
+
+        def to_row(chunk: Dict[str, Any], embedding: List[float]) -> Dict[str, Any]:
+            return {
+                "id": str(uuid.uuid4()),
+                "document_id": document_id,
+                "chunk_text": chunk["text"],
+                "chunk_index": chunk["index"],
+                "embedding": embedding,
+                "embedding_model": settings.embedding_model,
+                "content_hash": chunk["content_hash"],
+                "metadata": chunk["metadata"]
+            }
+
+        async def embed(batch: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+            async with semaphore:
+                embeddings = await content_generator.generate_embeddings([chunk["text"] for chunk in batch])
+            for chunk, embedding in zip(batch, embeddings):
+                known[chunk["content_hash"]] = embedding
+            return batch
+
+        pending_rows: List[Dict[str, Any]] = []
+        embedded = 0
+
+        async def flush(force: bool = False):
+            nonlocal pending_rows
+            while len(pending_rows) >= self.insert_batch_size or (force and pending_rows):
+                batch, pending_rows = pending_rows[:self.insert_batch_size], pending_rows[self.insert_batch_size:]
+                await supabase_client.execute(chunk_table.insert(batch))
+
+        # Chunks whose embedding is already known are written without an API call
+        waiting: Dict[str, List[Dict[str, Any]]] = {}
+        for chunk in chunks:
+            if chunk["content_hash"] in known:
+                pending_rows.append(to_row(chunk, known[chunk["content_hash"]]))
+            else:
+                waiting.setdefault(chunk["content_hash"], []).append(chunk)
+        reused = len(pending_rows)
+        await flush()
+
+        tasks = [asyncio.create_task(embed(batch)) for batch in batches]
+        try:
+            for finished in asyncio.as_completed(tasks):
+                batch = await finished
+                for embedded_chunk in batch:
+                    for chunk in waiting.pop(embedded_chunk["content_hash"]):
+                        pending_rows.append(to_row(chunk, known[chunk["content_hash"]]))
+                        embedded += 1
+                await flush()
+                await on_progress(reused + embedded, len(chunks))
+            await flush(force=True)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+        if not batches:
+            await on_progress(reused, len(chunks))
+
+        if user_id is not None:
+            await asyncio.to_thread(self._index_window, user_id, document_id, chunks, known)
+        return reused, len(batches)
+
+# Global instance
+embedding_ingestor = EmbeddingIngestor(
+    max_batch_tokens=settings.embedding_batch_max_tokens,
+    max_batch_items=settings.embedding_batch_max_items,
+    concurrency=settings.embedding_concurrency,
+    insert_batch_size=settings.chunk_insert_batch_size
+)
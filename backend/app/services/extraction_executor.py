@@ -0,0 +1,276 @@
+from typing import AsyncIterator, List, Optional, Set, Tuple, Union
+import asyncio
+import logging
+import multiprocessing
+import os
+import tempfile
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class ExtractionError(Exception):
+    """Raised when a document could not be extracted in the worker pool"""
+
+
+class ExtractionTimeoutError(ExtractionError):
+    """Raised when an extraction job exceeds the configured timeout"""
+
+
+class UnreadablePdfError(ExtractionError):
+    """Raised when no parser can open a PDF; retrying will not help"""
+
+
+def count_pdf_pages(path: str) -> int:
+    """Count pages in a PDF (runs inside a worker process).
+
+    Raises UnreadablePdfError if neither parser can open the file, so a
+    corrupt upload fails rather than passing as an empty document.
+    """
+    import PyPDF2
+
+    try:
+        return len(PyPDF2.PdfReader(path).pages)
+    except Exception as e:
+        logger.warning(f"PyPDF2 page count failed: {e}")
+        pypdf2_error = e
+
+    import pdfplumber
+
+    try:
+        with pdfplumber.open(path) as pdf:
+            return len(pdf.pages)
+    except Exception as e:
+        logger.warning(f"pdfplumber page count failed: {e}")
+        raise UnreadablePdfError(f"Could not read PDF: {pypdf2_error}; {e}") from None
+
+
+def extract_pdf_pages(path: str, start: int, end: int) -> List[str]:
+    """Extract text for pages [start, end) using multiple methods for better accuracy.
+
+    pdfplumber is tried first (better for complex layouts); pages it returns
+    no text for fall back to PyPDF2. Runs inside a worker process.
+    """
+    import pdfplumber
+    import PyPDF2
+
+    pages = [""] * (end - start)
+    try:
+        with pdfplumber.open(path, pages=list(range(start + 1, end + 1))) as pdf:
+            for i, page in enumerate(pdf.pages):
+                pages[i] = page.extract_text() or ""
+    except Exception as e:
+        logger.warning(f"pdfplumber extraction failed: {e}")
+
+    if not all(page.strip() for page in pages):
+        try:
+            pdf_reader = PyPDF2.PdfReader(path)
+            for i in range(len(pages)):
+                if not pages[i].strip():
+                    pages[i] = pdf_reader.pages[start + i].extract_text() or ""
+        except Exception as e:
+            logger.warning(f"PyPDF2 extraction failed: {e}")
+    return pages
+
+
+def _worker_main(conn):
+    """Worker process loop: run one (func, args) job at a time until told to stop"""
+    conn.send("ready")
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            return
+        if job is None:
+            return
+        func, args = job
+        try:
+            conn.send((True, func(*args)))
+        except Exception as e:
+            try:
+                conn.send((False, e))
+            except Exception:
+                conn.send((False, ExtractionError(repr(e))))
+
+
+class _Worker:
+    """One extraction process and the parent's end of its pipe"""
+
+    def __init__(self, context):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_worker_main, args=(child_conn,), daemon=True)
+        self.process.start()
+        child_conn.close()
+
+    def alive(self) -> bool:
+        return self.process.is_alive()
+
+    def kill(self):
+        self.process.terminate()
+        self.process.join(1)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+        self.process.join(5)
+        if self.process.is_alive():
+            self.kill()
+        else:
+            self.conn.close()
+
+
+class ExtractionExecutor:
+    """Runs CPU-bound document extraction in worker processes.
+
+    Parsing happens outside the event loop so a large upload does not stall
+    other requests on the same uvicorn worker. Each job has a worker process
+    to itself while it runs, and at most max_workers jobs run at once (the
+    rest wait for a free worker). The timeout starts when the job starts
+    running, not while it waits, and a job that exceeds it or crashes its
+    worker (e.g. a malformed PDF segfaulting the parser) only fails itself:
+    that one process is killed and replaced, and jobs running in the other
+    workers carry on. Idle workers are reused between jobs.
+    """
+
+    def __init__(self, max_workers: int, timeout: float):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        # "spawn" avoids inheriting the parent's event loop and client sockets
+        self._context = multiprocessing.get_context("spawn")
+        self._idle: List[_Worker] = []
+        self._busy: Set[_Worker] = set()
+        self._slots: Optional[asyncio.Semaphore] = None
+
+    def _start_worker(self) -> _Worker:
+        """Start a worker and wait for it to boot, so start-up isn't charged to a job's timeout"""
+        worker = _Worker(self._context)
+        try:
+            if worker.conn.poll(60) and worker.conn.recv() == "ready":
+                return worker
+        except (EOFError, OSError):
+            pass
+        worker.kill()
+        raise ExtractionError("Extraction worker failed to start")
+
+    async def _acquire_worker(self) -> _Worker:
+        while self._idle:
+            worker = self._idle.pop()
+            if worker.alive():
+                return worker
+            worker.kill()
+        return await asyncio.to_thread(self._start_worker)
+
+    def _wait_for_result(self, worker: _Worker):
+        """Block until the worker answers (or dies), up to the timeout"""
+        if not worker.conn.poll(self.timeout):
+            raise ExtractionTimeoutError(f"Extraction timed out after {self.timeout}s")
+        try:
+            return worker.conn.recv()
+        except (EOFError, OSError):
+            raise ExtractionError("Extraction worker crashed while processing document")
+
+    async def run(self, func, *args):
+        """Run a picklable function in a worker process with the configured timeout"""
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_workers)
+        async with self._slots:
+            worker = await self._acquire_worker()
+            self._busy.add(worker)
+            healthy = False
+            try:
+                worker.conn.send((func, args))
+                ok, result = await asyncio.to_thread(self._wait_for_result, worker)
+                healthy = True
+            except ExtractionTimeoutError:
+                logger.error(f"Extraction job timed out after {self.timeout}s")
+                raise
+            except ExtractionError as e:
+                logger.error(f"Extraction worker crashed: {e}")
+                raise
+            except (BrokenPipeError, OSError) as e:
+                logger.error(f"Extraction worker crashed: {e}")
+                raise ExtractionError("Extraction worker crashed while processing document")
+            finally:
+                self._busy.discard(worker)
+                if healthy:
+                    self._idle.append(worker)
+                else:
+                    # Only this job's process is killed; other workers keep running
+                    await asyncio.to_thread(worker.kill)
+        if not ok:
+            raise result
+        return result
+
+    async def iter_pdf_pages(
+        self,
+        source: Union[bytes, str],
+        batch_size: int
+    ) -> AsyncIterator[Tuple[int, str]]:
+        """Yield (page_number, text) pairs, extracting a batch of pages per job.
+
+        The next batch is extracted while the caller consumes the current one,
+        so at most two batches of page text are held in memory at a time.
+        Page numbers are 1-based.
+        """
+        spooled = None
+        if isinstance(source, bytes):
+            # Workers are handed a path: bytes would be pickled into every job
+            spooled = await asyncio.to_thread(self._spool, source)
+            source = spooled
+        pending = None
+        try:
+            page_count = await self.run(count_pdf_pages, source)
+            if page_count == 0:
+                return
+
+            def submit(start: int) -> asyncio.Task:
+                end = min(start + batch_size, page_count)
+                return asyncio.ensure_future(self.run(extract_pdf_pages, source, start, end))
+
+            pending = submit(0)
+            for start in range(0, page_count, batch_size):
+                batch = await pending
+                next_start = start + batch_size
+                pending = submit(next_start) if next_start < page_count else None
+                for offset, page_text in enumerate(batch):
+                    yield start + offset + 1, page_text
+        finally:
+            if pending is not None and not pending.done():
+                pending.cancel()
+                try:
+                    await pending
+                except BaseException:
+                    pass
+            if spooled is not None:
+                try:
+                    os.remove(spooled)
+                except OSError as e:
+                    logger.warning(f"Failed to remove spooled PDF {spooled}: {e}")
+
+    def _spool(self, data: bytes) -> str:
+        os.makedirs(settings.upload_spool_dir, exist_ok=True)
+        fd, path = tempfile.mkstemp(dir=settings.upload_spool_dir, suffix=".pdf")
+        with os.fdopen(fd, "wb") as out:
+            out.write(data)
+        return path
+
+    def shutdown(self):
+        """Stop worker processes (called on application shutdown)"""
+        idle, self._idle = self._idle, []
+        for worker in idle:
+            worker.stop()
+        for worker in list(self._busy):
+            worker.kill()
+
+# Global instance
+extraction_executor = ExtractionExecutor(
+    max_workers=settings.extraction_workers,
+    timeout=settings.extraction_timeout_seconds
+)
@@ -0,0 +1,399 @@
+from typing import Any, Dict, List, Optional, Tuple
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import time
+import uuid
+
+from app.config import settings
+from app.models.schemas import DocumentStatus
+from app.services.supabase_client import supabase_client
+from app.services.pdf_processor import pdf_processor
+from app.services.extraction_executor import UnreadablePdfError
+from app.services.embedding_ingestor import embedding_ingestor
+from app.services.response_cache import response_cache
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS ingestion_jobs (
+    id TEXT PRIMARY KEY,
+    document_id TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    source_path TEXT NOT NULL,
+    storage_path TEXT NOT NULL,
+    file_type TEXT NOT NULL,
+    state TEXT NOT NULL,
+    stage TEXT,
+    progress REAL NOT NULL DEFAULT 0,
+    detail TEXT NOT NULL DEFAULT '{}',
+    uploaded INTEGER NOT NULL DEFAULT 0,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    available_at REAL NOT NULL,
+    lease_expires_at REAL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_ingestion_jobs_claim ON ingestion_jobs(state, available_at);
+CREATE INDEX IF NOT EXISTS idx_ingestion_jobs_document ON ingestion_jobs(document_id);
+"""
+
+# Job states
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+
+
+class UnsupportedFileTypeError(Exception):
+    """Raised for uploads the pipeline has no extractor for"""
+
+
+# Failures that retrying cannot fix: the job fails on the first attempt
+_PERMANENT_ERRORS = (UnsupportedFileTypeError, UnreadablePdfError)
+
+_LEASE_EXPIRED = "Lease expired on the last attempt (the worker stopped mid-run)"
+
+# Progress range covered by each pipeline stage
+_STAGE_PROGRESS = {
+    "uploading": (0.0, 0.1),
+    "extracting": (0.1, 0.15),
+    "embedding": (0.15, 0.95),
+    "saving": (0.95, 1.0)
+}
+
+
+def _read_text(path: str) -> str:
+    with open(path, encoding="utf-8", errors="replace") as f:
+        return f.read()
+
+
+class IngestionQueue:
+    """SQLite-backed job queue that takes uploaded documents through
+    storage upload -> extraction -> chunking -> embedding in the background.
+
+    Jobs survive restarts: a job whose worker died mid-run is re-queued once
+    its lease expires, or failed if it has used up its attempts. Several
+    uvicorn workers can share one queue file; claims are serialized with an
+    immediate transaction.
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        concurrency: int,
+        max_attempts: int,
+        lease_seconds: float,
+        poll_interval: float = 1.0
+    ):
+        self.db_path = db_path
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self._workers: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._running: set = set()
+        self._initialized = False
+
+    # -- storage -----------------------------------------------------------
+
+    def _connect(self) -> sqlite3.Connection:
+        if not self._initialized:
+            os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        if not self._initialized:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+            self._initialized = True
+        return conn
+
+    def _execute(self, sql: str, params: tuple = ()) -> None:
+        conn = self._connect()
+        try:
+            conn.execute(sql, params)
+        finally:
+            conn.close()
+
+    def _fetchone(self, sql: str, params: tuple = ()) -> Optional[Dict[str, Any]]:
+        conn = self._connect()
+        try:
+            row = conn.execute(sql, params).fetchone()
+            return dict(row) if row else None
+        finally:
+            conn.close()
+
+    def _claim(self) -> Tuple[Optional[Dict[str, Any]], List[Dict[str, Any]]]:
+        """Atomically move the oldest runnable job to RUNNING and return it,
+        along with any expired jobs that were failed for using up their attempts"""
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            # Jobs whose worker died mid-run become runnable again after their
+            # lease, unless every attempt has been used (e.g. a job that crashes
+            # its worker each time)
+            exhausted = [dict(row) for row in conn.execute(
+                "SELECT * FROM ingestion_jobs WHERE state = ? AND lease_expires_at < ? AND attempts >= ?",
+                (RUNNING, now, self.max_attempts)
+            )]
+            conn.executemany(
+                "UPDATE ingestion_jobs SET state = ?, error = ?, updated_at = ? WHERE id = ?",
+                [(FAILED, _LEASE_EXPIRED, now, job["id"]) for job in exhausted]
+            )
+            conn.execute(
+                "UPDATE ingestion_jobs SET state = ?, updated_at = ? WHERE state = ? AND lease_expires_at < ?",
+                (QUEUED, now, RUNNING, now)
+            )
+            row = conn.execute(
+                "SELECT * FROM ingestion_jobs WHERE state = ? AND available_at <= ? ORDER BY available_at LIMIT 1",
+                (QUEUED, now)
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None, exhausted
+            conn.execute(
+                "UPDATE ingestion_jobs SET state = ?, attempts = attempts + 1, lease_expires_at = ?, updated_at = ? WHERE id = ?",
+                (RUNNING, now + self.lease_seconds, now, row["id"])
+            )
+            conn.execute("COMMIT")
+            job = dict(row)
+            job["attempts"] += 1
+            return job, exhausted
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    # -- public API --------------------------------------------------------
+
+    async def enqueue(
+        self,
+        document_id: str,
+        user_id: str,
+        source_path: str,
+        storage_path: str,
+        file_type: str
+    ) -> str:
+        """Persist a new job and wake a worker"""
+        job_id = str(uuid.uuid4())
+        now = time.time()
+        await asyncio.to_thread(
+            self._execute,
+            """INSERT INTO ingestion_jobs
+               (id, document_id, user_id, source_path, storage_path, file_type, state, available_at, created_at, updated_at)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+            (job_id, document_id, user_id, source_path, storage_path, file_type, QUEUED, now, now, now)
+        )
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return job_id
+
+    async def get_status(self, document_id: str) -> Optional[Dict[str, Any]]:
+        """Return the latest job for a document"""
+        job = await asyncio.to_thread(
+            self._fetchone,
+            "SELECT * FROM ingestion_jobs WHERE document_id = ? ORDER BY created_at DESC LIMIT 1",
+            (document_id,)
+        )
+        if job is not None:
+            job["detail"] = json.loads(job["detail"])
+        return job
+
+    async def start(self):
+        """Start worker tasks (called on application startup)"""
+        if self._workers:
+            return
+        self._wakeup = asyncio.Event()
+        self._workers = [
+            asyncio.create_task(self._worker(i)) for i in range(self.concurrency)
+        ]
+
+    async def stop(self):
+        """Cancel worker tasks and hand their in-flight jobs back to the queue"""
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        for job_id in list(self._running):
+            await asyncio.to_thread(
+                self._execute,
+                "UPDATE ingestion_jobs SET state = ?, attempts = attempts - 1, lease_expires_at = NULL, updated_at = ? WHERE id = ? AND state = ?",
+                (QUEUED, time.time(), job_id, RUNNING)
+            )
+        self._running.clear()
+
+    # -- workers -----------------------------------------------------------
+
+    async def _worker(self, worker_id: int):
+        while True:
+            try:
+                job, exhausted = await asyncio.to_thread(self._claim)
+            except Exception as e:
+                logger.error(f"Ingestion worker {worker_id} failed to claim a job: {e}")
+                job, exhausted = None, []
+
+            for expired in exhausted:
+                try:
+                    await self._fail(expired, _LEASE_EXPIRED)
+                except Exception as e:
+                    logger.error(f"Ingestion worker {worker_id} could not mark expired job {expired['id']} failed: {e}")
+
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            try:
+                await self._run(job)
+            except Exception as e:
+                # Recording the outcome failed; the lease brings the job back
+                logger.error(f"Ingestion worker {worker_id} failed to finish job {job['id']}: {e}")
+
+    async def _run(self, job: Dict[str, Any]):
+        self._running.add(job["id"])
+        try:
+            await self.process_job(job)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self._running.discard(job["id"])
+            await self._handle_failure(job, e)
+            return
+        self._running.discard(job["id"])
+
+        await asyncio.to_thread(
+            self._execute,
+            "UPDATE ingestion_jobs SET state = ?, progress = 1, error = NULL, updated_at = ? WHERE id = ?",
+            (COMPLETED, time.time(), job["id"])
+        )
+        self._remove_source(job)
+
+    async def _handle_failure(self, job: Dict[str, Any], error: Exception):
+        now = time.time()
+        if job["attempts"] < self.max_attempts and not isinstance(error, _PERMANENT_ERRORS):
+            delay = 2 ** job["attempts"]
+            logger.warning(
+                f"Ingestion of document {job['document_id']} failed "
+                f"(attempt {job['attempts']}/{self.max_attempts}), retrying in {delay}s: {error}"
+            )
+            await asyncio.to_thread(
+                self._execute,
+                "UPDATE ingestion_jobs SET state = ?, error = ?, available_at = ?, updated_at = ? WHERE id = ?",
+                (QUEUED, str(error), now + delay, now, job["id"])
+            )
+            return
+
+        await self._fail(job, str(error))
+
+    async def _fail(self, job: Dict[str, Any], error: str):
+        """Mark a job and its document as failed for good"""
+        logger.error(f"Ingestion of document {job['document_id']} failed permanently: {error}")
+        await asyncio.to_thread(
+            self._execute,
+            "UPDATE ingestion_jobs SET state = ?, error = ?, updated_at = ? WHERE id = ?",
+            (FAILED, error, time.time(), job["id"])
+        )
+        try:
+            await supabase_client.execute(supabase_client.get_service_client().table("documents").update(
+                {"status": DocumentStatus.FAILED.value}
+            ).eq("id", job["document_id"]))
+        except Exception as e:
+            logger.error(f"Error marking document {job['document_id']} as failed: {e}")
+        self._remove_source(job)
+
+    def _text_path(self, job: Dict[str, Any]) -> str:
+        return job["source_path"] + ".txt"
+
+    def _remove_source(self, job: Dict[str, Any]):
+        for path in (job["source_path"], self._text_path(job)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    async def _set_progress(self, job: Dict[str, Any], stage: str, fraction: float = 0.0, **detail):
+        """Record stage progress and extend the job's lease"""
+        low, high = _STAGE_PROGRESS[stage]
+        now = time.time()
+        await asyncio.to_thread(
+            self._execute,
+            "UPDATE ingestion_jobs SET stage = ?, progress = ?, detail = ?, lease_expires_at = ?, updated_at = ? WHERE id = ?",
+            (stage, low + (high - low) * min(fraction, 1.0), json.dumps(detail),
+             now + self.lease_seconds, now, job["id"])
+        )
+
+    # -- pipeline ----------------------------------------------------------
+
+    async def process_job(self, job: Dict[str, Any]):
+        """Run one document through the ingestion pipeline"""
+        documents = supabase_client.get_service_client().table("documents")
+
+        if not job["uploaded"]:
+            await self._set_progress(job, "uploading")
+            await supabase_client.upload_file("documents", job["storage_path"], job["source_path"])
+            await asyncio.to_thread(
+                self._execute, "UPDATE ingestion_jobs SET uploaded = 1 WHERE id = ?", (job["id"],)
+            )
+
+        await supabase_client.execute(documents.update({"status": DocumentStatus.PROCESSING.value}).eq("id", job["document_id"]))
+
+        # A retried job replaces whatever a previous attempt managed to write
+        await supabase_client.execute(supabase_client.get_service_client().table("document_chunks").delete().eq("document_id", job["document_id"]))
+
+        # Extraction, chunking and embedding stream together: chunks go to the
+        # embedder as pages are parsed, and page text is spooled to disk
+        await self._set_progress(job, "extracting")
+        if job["file_type"] == "pdf":
+            text_path = self._text_path(job)
+            pages = 0
+            with open(text_path, "w", encoding="utf-8") as text_file:
+                def on_page(page_number: int, text: str):
+                    nonlocal pages
+                    if pages:
+                        text_file.write("\n\n")
+                    text_file.write(text)
+                    pages += 1
+
+                async def on_progress(embedded: int, seen: int):
+                    await self._set_progress(job, "embedding", embedded / seen, pages=pages, chunks=seen, embedded=embedded)
+
+                chunks = pdf_processor.iter_chunks(job["source_path"], on_page=on_page)
+                stats = await embedding_ingestor.ingest(job["document_id"], chunks, on_progress, user_id=job["user_id"])
+        elif job["file_type"] in ("txt", "md"):
+            text_path = job["source_path"]
+            # Reading and tokenizing a large upload would stall the event loop
+            chunks = await asyncio.to_thread(lambda: pdf_processor.chunk_text(_read_text(text_path)))
+
+            async def on_progress(embedded: int, seen: int):
+                await self._set_progress(job, "embedding", embedded / seen, chunks=seen, embedded=embedded)
+
+            stats = await embedding_ingestor.ingest(job["document_id"], chunks, on_progress, user_id=job["user_id"])
+            del chunks
+        else:
+            raise UnsupportedFileTypeError(f"No text extraction for .{job['file_type']} files")
+        await self._set_progress(job, "embedding", 1.0, **stats)
+
+        # The full text is only read back once the chunks are stored
+        extracted_text = await asyncio.to_thread(_read_text, text_path)
+        await self._set_progress(job, "saving", chunks=stats["chunks"])
+        await supabase_client.execute(documents.update({"extracted_text": extracted_text}).eq("id", job["document_id"]))
+
+        await supabase_client.execute(documents.update({"status": DocumentStatus.COMPLETED.value}).eq("id", job["document_id"]))
+        response_cache.invalidate_documents([job["document_id"]])
+
+# Global instance
+ingestion_queue = IngestionQueue(
+    db_path=settings.ingestion_queue_path,
+    concurrency=settings.ingestion_concurrency,
+    max_attempts=settings.ingestion_max_attempts,
+    lease_seconds=settings.ingestion_lease_seconds
+)
@@ -0,0 +1,64 @@
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import base64
+import json
+import uuid
+
+# Largest page a list endpoint will return
+MAX_PAGE_SIZE = 200
+
+
+def encode_cursor(row: Dict[str, Any]) -> str:
+    """Opaque cursor pointing just past a row, by its (created_at, id) sort key"""
+    raw = json.dumps([row["created_at"], row["id"]], default=str)
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[str, str]:
+    """Inverse of encode_cursor; raises ValueError for a malformed cursor.
+
+    Both values end up inside a PostgREST filter string, so the timestamp
+    must parse as ISO 8601 and the id as a UUID; anything else (quotes,
+    commas, parentheses) is rejected rather than interpolated.
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        timestamp = datetime.fromisoformat(created_at)
+        row_uuid = uuid.UUID(row_id)
+    except Exception as e:
+        raise ValueError("Invalid cursor") from e
+    return timestamp.isoformat(), str(row_uuid)
+
+
+def select_columns(summary_columns: Sequence[str], optional_columns: Sequence[str], fields: Optional[str]) -> str:
+    """Summary columns plus whichever optional (body) columns were asked for in `fields`.
+    Raises ValueError for an unknown field."""
+    requested = [field.strip() for field in (fields or "").split(",") if field.strip()]
+    unknown = [field for field in requested if field not in optional_columns]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}; allowed: {', '.join(optional_columns)}")
+    return ", ".join(list(summary_columns) + [field for field in optional_columns if field in requested])
+
+
+def keyset_page(query: Any, cursor: Optional[str], limit: int) -> Any:
+    """Newest-first page after the cursor, ordered on (created_at, id).
+    One extra row is fetched so split_page can tell whether more follow."""
+    if cursor:
+        created_at, row_id = decode_cursor(cursor)
+        # Added as a raw parameter: the pinned postgrest-py has no or_()
+        query.params = query.params.add(
+            "or", f'(created_at.lt."{created_at}",and(created_at.eq."{created_at}",id.lt.{row_id}))'
+        )
+    # One order parameter: chained .order() calls send separate order=
+    # parameters, and the id tiebreak could be dropped
+    query.params = query.params.add("order", "created_at.desc,id.desc")
+    return query.limit(limit + 1)
+
+
+def split_page(rows: List[Dict[str, Any]], limit: int) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """Trim the look-ahead row and return (page rows, next cursor or None)"""
+    if len(rows) <= limit:
+        return rows, None
+    page = rows[:limit]
+    return page, encode_cursor(page[-1])
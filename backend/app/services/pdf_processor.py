@@ -1,96 +1,110 @@
-import PyPDF2
-import pdfplumber
-from typing import List, Dict, Any
+from typing import List, Dict, Any, AsyncIterator, Callable, Optional, Tuple, Union
 import logging
-import io
+import re
+
+from app.config import settings
+from app.services.extraction_executor import extraction_executor
+from app.services.text_chunker import TokenChunker
 
 logger = logging.getLogger(__name__)
 
+Page = Tuple[int, str]
+
+_HYPHENATED_LINE_BREAK = re.compile(r"(\w)-\n(\w)")
+_INLINE_WHITESPACE = re.compile(r"[ \t\r\f\v]+")
+_BLANK_LINES = re.compile(r"\n\s*\n+")
+
+
 class PDFProcessor:
     def __init__(self):
-        self.chunk_size = 1000
-        self.chunk_overlap = 200
-    
-    async def extract_text_from_pdf(self, pdf_data: bytes) -> str:
-        """Extract text from PDF using multiple methods for better accuracy"""
+        # Sizes are in cl100k_base tokens; a chunk must fit in one embedding input
+        self.chunk_size = min(settings.chunk_size, settings.embedding_max_tokens)
+        self.chunk_overlap = min(settings.chunk_overlap, self.chunk_size - 1)
+        self.page_batch_size = 8
+
+    async def iter_pages(self, pdf_data: Union[bytes, str]) -> AsyncIterator[Page]:
+        """Yield (page_number, text) for each page, extracted in the process pool"""
+        async for page in extraction_executor.iter_pdf_pages(pdf_data, self.page_batch_size):
+            yield page
+
+    def normalize_text(self, text: str) -> str:
+        """Clean up extraction artifacts: hyphenated line breaks and stray whitespace"""
+        text = _HYPHENATED_LINE_BREAK.sub(r"\1\2", text)
+        text = _INLINE_WHITESPACE.sub(" ", text)
+        text = _BLANK_LINES.sub("\n\n", text)
+        return "\n".join(line.strip() for line in text.split("\n")).strip()
+
+    async def normalize_pages(self, pages: AsyncIterator[Page]) -> AsyncIterator[Page]:
+        """Normalize each page's text as it streams through"""
+        async for page_number, text in pages:
+            yield page_number, self.normalize_text(text)
+
+    async def chunk_pages(self, pages: AsyncIterator[Page]) -> AsyncIterator[Dict[str, Any]]:
+        """Split streamed pages into overlapping chunks, tagging each with its page span"""
+        chunker = TokenChunker(self.chunk_size, self.chunk_overlap)
+        async for page_number, text in pages:
+            for chunk in chunker.feed(page_number, text):
+                yield chunk
+        for chunk in chunker.flush():
+            yield chunk
+
+    async def iter_chunks(
+        self,
+        pdf_data: Union[bytes, str],
+        on_page: Optional[Callable[[int, str], None]] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """Stream a PDF through page -> normalizer -> chunker.
+
+        Memory stays bounded by a few pages regardless of document length.
+        If ``on_page`` is given, it is called with each non-empty normalized
+        page as it passes through, for callers that also need the full text.
+        """
+        normalized = self.normalize_pages(self.iter_pages(pdf_data))
+        if on_page is not None:
+            normalized = self._tee_pages(normalized, on_page)
+        async for chunk in self.chunk_pages(normalized):
+            yield chunk
+
+    async def _tee_pages(self, pages: AsyncIterator[Page], on_page: Callable[[int, str], None]) -> AsyncIterator[Page]:
+        async for page_number, text in pages:
+            if text:
+                on_page(page_number, text)
+            yield page_number, text
+
+    async def extract_text_from_pdf(self, pdf_data: Union[bytes, str]) -> str:
+        """Extract text from PDF using multiple methods for better accuracy.
+
+        Parsing is CPU-bound, so it is dispatched to the extraction process
+        pool rather than run on the event loop.
+        """
         try:
-            # Try pdfplumber first (better for complex layouts)
-            text = await self._extract_with_pdfplumber(pdf_data)
-            if text.strip():
-                return text
-            
-            # Fallback to PyPDF2
-            text = await self._extract_with_pypdf2(pdf_data)
-            return text
-            
+            pages = [text async for _, text in self.normalize_pages(self.iter_pages(pdf_data)) if text]
+            return "\n\n".join(pages)
         except Exception as e:
             logger.error(f"Error extracting text from PDF: {e}")
             raise
-    
-    async def _extract_with_pdfplumber(self, pdf_data: bytes) -> str:
-        """Extract text using pdfplumber"""
-        text = ""
-        try:
-            with pdfplumber.open(io.BytesIO(pdf_data)) as pdf:
-                for page in pdf.pages:
-                    page_text = page.extract_text()
-                    if page_text:
-                        text += page_text + "\n"
-        except Exception as e:
-            logger.warning(f"pdfplumber extraction failed: {e}")
-        return text
-    
-    async def _extract_with_pypdf2(self, pdf_data: bytes) -> str:
-        """Extract text using PyPDF2"""
-        text = ""
-        try:
-            pdf_reader = PyPDF2.PdfReader(io.BytesIO(pdf_data))
-            for page in pdf_reader.pages:
-                page_text = page.extract_text()
-                if page_text:
-                    text += page_text + "\n"
-        except Exception as e:
-            logger.warning(f"PyPDF2 extraction failed: {e}")
-        return text
-    
+
     def chunk_text(self, text: str) -> List[Dict[str, Any]]:
         """Split text into overlapping chunks for embedding"""
-        chunks = []
-        words = text.split()
-        
-        for i in range(0, len(words), self.chunk_size - self.chunk_overlap):
-            chunk_words = words[i:i + self.chunk_size]
-            chunk_text = " ".join(chunk_words)
-            
-            chunks.append({
-                "text": chunk_text,
-                "index": len(chunks),
-                "start_word": i,
-                "end_word": min(i + self.chunk_size, len(words)),
-                "metadata": {
-                    "chunk_size": len(chunk_words),
-                    "total_words": len(words)
-                }
-            })
-        
-        return chunks
-    
-    async def process_pdf(self, pdf_data: bytes) -> Dict[str, Any]:
+        chunker = TokenChunker(self.chunk_size, self.chunk_overlap)
+        return chunker.feed(1, text) + chunker.flush()
+
+    async def process_pdf(self, pdf_data: Union[bytes, str]) -> Dict[str, Any]:
         """Complete PDF processing pipeline"""
         try:
-            # Extract text
-            text = await self.extract_text_from_pdf(pdf_data)
-            
-            # Chunk text
-            chunks = self.chunk_text(text)
-            
+            pages: List[str] = []
+            chunks = [chunk async for chunk in self.iter_chunks(pdf_data, on_page=lambda _, text: pages.append(text))]
+
+            # Join once at the end rather than growing a string page by page
+            text = "\n\n".join(pages)
+
             return {
                 "text": text,
                 "chunks": chunks,
-                "word_count": len(text.split()),
+                "word_count": sum(len(page.split()) for page in pages),
                 "chunk_count": len(chunks)
             }
-            
+
         except Exception as e:
             logger.error(f"Error processing PDF: {e}")
             raise
@@ -0,0 +1,101 @@
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional, Set, Tuple
+import copy
+import hashlib
+import json
+import logging
+import threading
+import time
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class ResponseCache:
+    """Exact-match cache of LLM responses.
+
+    Keys hash the model, sampling parameters, rendered prompt and the
+    version (updated_at and content hash) of every source document, so an
+    edited source never serves a stale answer. Entries expire after a TTL,
+    the least recently used are evicted beyond max_entries, and entries can
+    be dropped eagerly by source document.
+    """
+
+    def __init__(self, ttl_seconds: float, max_entries: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[float, Any, Set[str]]]" = OrderedDict()
+        self._by_document: Dict[str, Set[str]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(model: str, params: Dict[str, Any], prompt: str, sources: Dict[str, str]) -> str:
+        payload = json.dumps(
+            {"model": model, "params": params, "prompt": prompt, "sources": sources},
+            sort_keys=True,
+            default=str
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _forget(self, key: str):
+        _, _, document_ids = self._entries.pop(key)
+        for document_id in document_ids:
+            keys = self._by_document.get(document_id)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_document[document_id]
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                self._forget(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return copy.deepcopy(entry[1])
+
+    def put(self, key: str, value: Any, document_ids: Iterable[str]):
+        document_ids = set(document_ids)
+        with self._lock:
+            if key in self._entries:
+                self._forget(key)
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, copy.deepcopy(value), document_ids)
+            for document_id in document_ids:
+                self._by_document.setdefault(document_id, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._forget(next(iter(self._entries)))
+
+    def invalidate_documents(self, document_ids: Iterable[str]) -> int:
+        """Drop every cached response built from any of these documents"""
+        with self._lock:
+            keys = set()
+            for document_id in document_ids:
+                keys |= self._by_document.get(document_id, set())
+            for key in keys:
+                self._forget(key)
+        if keys:
+            logger.info(f"Invalidated {len(keys)} cached responses")
+        return len(keys)
+
+    def stats(self) -> Dict[str, Optional[float]]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None
+        }
+
+# Global instance
+response_cache = ResponseCache(
+    ttl_seconds=settings.response_cache_ttl_seconds,
+    max_entries=settings.response_cache_max_entries
+)
@@ -0,0 +1,349 @@
+from typing import Any, Dict, Iterable, List, Sequence, Tuple
+import asyncio
+import hashlib
+import html
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from app.config import settings
+from app.services.supabase_client import supabase_client
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS chunk_rows (
+    rowid INTEGER PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    document_id TEXT NOT NULL,
+    chunk_index INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_chunk_rows_document ON chunk_rows(document_id);
+CREATE INDEX IF NOT EXISTS idx_chunk_rows_user ON chunk_rows(user_id);
+CREATE TABLE IF NOT EXISTS indexed_users (
+    user_id TEXT PRIMARY KEY,
+    indexed_at REAL NOT NULL
+);
+"""
+
+# Private-use characters mark matches inside snippets until the text is escaped
+_OPEN = "\ue000"
+_CLOSE = "\ue001"
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+
+def query_terms(query: str) -> List[str]:
+    seen = []
+    for term in _WORD.findall(query.lower()):
+        if term not in seen:
+            seen.append(term)
+    return seen
+
+
+def _fts_table(user_id: str) -> str:
+    """Name of the user's own FTS5 table"""
+    return "fts_" + hashlib.sha256(user_id.encode("utf-8")).hexdigest()[:24]
+
+
+def _quote(value: str) -> str:
+    return '"' + value.replace('"', '""') + '"'
+
+
+def render_snippet(marked: str) -> str:
+    """HTML-escape a snippet and turn the match markers into <mark> tags"""
+    return html.escape(marked).replace(_OPEN, "<mark>").replace(_CLOSE, "</mark>")
+
+
+def _matches(token: str, terms: Sequence[str]) -> bool:
+    # Close enough to the index's stemming for highlighting: "tomato" ~ "tomatoes"
+    word = "".join(_WORD.findall(token.lower()))
+    return any(
+        word.startswith(term) or (len(word) >= 4 and term.startswith(word))
+        for term in terms
+    )
+
+
+def highlight_text(text: str, terms: Sequence[str], words: int) -> str:
+    """Snippet of about `words` words around the first query term, if any, with matches marked"""
+    tokens = text.split()
+    first = next((i for i, token in enumerate(tokens) if _matches(token, terms)), 0)
+    start = max(0, min(first - words // 4, len(tokens) - words))
+    window = tokens[start:start + words]
+    marked = [f"{_OPEN}{token}{_CLOSE}" if _matches(token, terms) else token for token in window]
+    snippet = " ".join(marked)
+    if start > 0:
+        snippet = "…" + snippet
+    if start + words < len(tokens):
+        snippet += "…"
+    return render_snippet(snippet)
+
+
+def reciprocal_rank_fusion(rankings: Dict[str, Sequence[Tuple[str, int]]], k: int) -> List[Dict[str, Any]]:
+    """Fuse ranked lists of (document_id, chunk_index) by summing 1 / (k + rank).
+    Returns hits best first, with each source's 1-based rank (or None)."""
+    fused: Dict[Tuple[str, int], Dict[str, Any]] = {}
+    for source, ranking in rankings.items():
+        for rank, key in enumerate(ranking, start=1):
+            hit = fused.setdefault(key, {"document_id": key[0], "chunk_index": key[1], "score": 0.0})
+            hit["score"] += 1.0 / (k + rank)
+            hit[f"{source}_rank"] = rank
+    hits = sorted(fused.values(), key=lambda hit: hit["score"], reverse=True)
+    for hit in hits:
+        for source in rankings:
+            hit.setdefault(f"{source}_rank", None)
+    return hits
+
+
+class SearchIndex:
+    """BM25 keyword index over chunk text, in a SQLite FTS5 file on the host.
+
+    Every user has their own FTS5 table, so bm25()'s term statistics and the
+    cost of a query depend only on that user's chunks, never on other
+    tenants'. chunk_rows maps each row to its user and document. The index
+    is maintained incrementally: a document's chunks are (re)indexed when
+    ingestion stores them, copied when an upload is deduplicated and removed
+    with the document. A user's existing chunks are loaded from
+    document_chunks the first time they search. Queries match any term and
+    are ranked by bm25().
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        snippet_words: int = 24,
+        common_fraction: float = 0.05,
+        common_scan_limit: int = 2000,
+        max_terms: int = 16
+    ):
+        self.db_path = db_path
+        self.snippet_words = snippet_words
+        self.common_fraction = common_fraction
+        self.common_scan_limit = common_scan_limit
+        self.max_terms = max_terms
+        self._initialized = False
+        self._tables = set()
+        self._write_lock = threading.Lock()
+        self._local = threading.local()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            return conn
+        if not self._initialized:
+            os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        if not self._initialized:
+            conn.execute("PRAGMA journal_mode=WAL")
+            with conn:
+                if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'chunk_fts'").fetchone():
+                    # Index files from before per-user tables: drop them and let
+                    # ensure_user reload each user's chunks on their next search
+                    conn.execute("DROP TABLE IF EXISTS chunk_fts")
+                    conn.execute("DELETE FROM chunk_rows")
+                    conn.execute("DELETE FROM indexed_users")
+            conn.executescript(_SCHEMA)
+            self._initialized = True
+        self._local.conn = conn
+        return conn
+
+    def _has_table(self, conn: sqlite3.Connection, user_id: str) -> bool:
+        table = _fts_table(user_id)
+        if table not in self._tables and conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = ?", (table,)
+        ).fetchone():
+            self._tables.add(table)
+        return table in self._tables
+
+    # -- maintenance -------------------------------------------------------
+
+    def _delete_documents(self, conn: sqlite3.Connection, document_ids: Iterable[str]):
+        for document_id in document_ids:
+            rows = conn.execute("SELECT rowid, user_id FROM chunk_rows WHERE document_id = ?", (document_id,)).fetchall()
+            for user_id in {user_id for _, user_id in rows}:
+                if self._has_table(conn, user_id):
+                    conn.executemany(
+                        f"DELETE FROM {_fts_table(user_id)} WHERE rowid = ?",
+                        [(rowid,) for rowid, owner in rows if owner == user_id]
+                    )
+            conn.executemany("DELETE FROM chunk_rows WHERE rowid = ?", [(rowid,) for rowid, _ in rows])
+
+    def _insert(self, conn: sqlite3.Connection, user_id: str, document_id: str, chunks: Iterable[Tuple[int, str]]):
+        table = _fts_table(user_id)
+        if not self._has_table(conn, user_id):
+            conn.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS {table} USING fts5(chunk_text, tokenize = 'porter unicode61')")
+        for chunk_index, text in chunks:
+            cursor = conn.execute(
+                "INSERT INTO chunk_rows (user_id, document_id, chunk_index) VALUES (?, ?, ?)",
+                (user_id, document_id, chunk_index)
+            )
+            conn.execute(
+                f"INSERT INTO {table} (rowid, chunk_text) VALUES (?, ?)",
+                (cursor.lastrowid, text)
+            )
+
+    def index_document(self, user_id: str, document_id: str, chunks: Iterable[Tuple[int, str]]):
+        """Replace a document's indexed chunks with (chunk_index, text) pairs"""
+        with self._write_lock:
+            conn = self._connect()
+            with conn:
+                self._delete_documents(conn, [document_id])
+                self._insert(conn, user_id, document_id, chunks)
+
+    def add_chunks(self, user_id: str, document_id: str, chunks: Iterable[Tuple[int, str]]):
+        """Append (chunk_index, text) pairs to a document, e.g. as ingestion streams them"""
+        with self._write_lock:
+            conn = self._connect()
+            with conn:
+                self._insert(conn, user_id, document_id, chunks)
+
+    def clone_document(self, source_document_id: str, target_document_id: str):
+        with self._write_lock:
+            conn = self._connect()
+            with conn:
+                owner = conn.execute(
+                    "SELECT user_id FROM chunk_rows WHERE document_id = ? LIMIT 1", (source_document_id,)
+                ).fetchone()
+                if owner is None:
+                    return
+                rows = conn.execute(
+                    f"SELECT r.chunk_index, f.chunk_text FROM chunk_rows r "
+                    f"JOIN {_fts_table(owner[0])} f ON f.rowid = r.rowid WHERE r.document_id = ?",
+                    (source_document_id,)
+                ).fetchall()
+                if rows:
+                    self._delete_documents(conn, [target_document_id])
+                    self._insert(conn, owner[0], target_document_id, rows)
+
+    def remove_document(self, document_id: str):
+        with self._write_lock:
+            conn = self._connect()
+            with conn:
+                self._delete_documents(conn, [document_id])
+
+    def is_indexed(self, user_id: str) -> bool:
+        return self._connect().execute(
+            "SELECT 1 FROM indexed_users WHERE user_id = ?", (user_id,)
+        ).fetchone() is not None
+
+    def mark_indexed(self, user_id: str):
+        with self._write_lock:
+            conn = self._connect()
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO indexed_users (user_id, indexed_at) VALUES (?, ?)",
+                    (user_id, time.time())
+                )
+
+    async def ensure_user(self, user_id: str, page_size: int = 1000):
+        """Load the user's stored chunks once, so vaults that predate the index are searchable"""
+        if await asyncio.to_thread(self.is_indexed, user_id):
+            return
+        started = time.perf_counter()
+        client = supabase_client.get_service_client()
+        documents = await supabase_client.execute(client.table("documents").select("id").eq("user_id", user_id))
+        document_ids = [row["id"] for row in documents.data]
+        total = 0
+        for i in range(0, len(document_ids), 50):
+            batch = document_ids[i:i + 50]
+            by_document: Dict[str, List[Tuple[int, str]]] = {document_id: [] for document_id in batch}
+            offset = 0
+            while True:
+                response = await supabase_client.execute(
+                    client.table("document_chunks").select("document_id, chunk_index, chunk_text").in_("document_id", batch).order("id").range(offset, offset + page_size - 1)
+                )
+                for row in response.data:
+                    by_document[row["document_id"]].append((row["chunk_index"], row["chunk_text"]))
+                if len(response.data) < page_size:
+                    break
+                offset += page_size
+            for document_id, chunks in by_document.items():
+                await asyncio.to_thread(self.index_document, user_id, document_id, chunks)
+                total += len(chunks)
+        await asyncio.to_thread(self.mark_indexed, user_id)
+        logger.info(f"Indexed {total} existing chunks for search in {time.perf_counter() - started:.2f}s")
+
+    # -- queries ---------------------------------------------------------
+
+    def _document_frequencies(self, conn: sqlite3.Connection, table: str, terms: Sequence[str]) -> Dict[str, int]:
+        return {
+            term: conn.execute(
+                f"SELECT count(*) FROM {table} WHERE {table} MATCH ?", (_quote(term),)
+            ).fetchone()[0]
+            for term in terms
+        }
+
+    def search(self, user_id: str, query: str, limit: int) -> List[Dict[str, Any]]:
+        """The user's chunks matching the query, best BM25 score first, with snippets.
+
+        Every term takes part in matching and scoring, with statistics from
+        the user's own chunks. bm25() costs time per matching row, so when a
+        term is very common in the user's vault (in more than common_fraction
+        of their chunks and more than common_scan_limit of them) the scored
+        rows are narrowed to those matching any of the other terms plus the
+        common_scan_limit most recent ones matching the common terms.
+        """
+        terms = query_terms(query)[:self.max_terms]
+        if not terms:
+            return []
+        conn = self._connect()
+        if not self._has_table(conn, user_id):
+            return []
+        table = _fts_table(user_id)
+        total = conn.execute("SELECT count(*) FROM chunk_rows WHERE user_id = ?", (user_id,)).fetchone()[0]
+        frequencies = self._document_frequencies(conn, table, terms)
+        present = [term for term in terms if frequencies[term]]
+        if not present:
+            return []
+        # Posting lists up to common_scan_limit rows are cheap to score whatever their share
+        threshold = max(self.common_fraction * total, self.common_scan_limit)
+        selective = [term for term in present if frequencies[term] <= threshold]
+        common = [term for term in present if frequencies[term] > threshold]
+
+        def match(terms: Sequence[str]) -> str:
+            return " OR ".join(_quote(term) for term in terms)
+
+        ranked = f"SELECT f.rowid, bm25({table}) AS score FROM {table} f WHERE {table} MATCH ? "
+        if not common:
+            rows = conn.execute(ranked + "ORDER BY score LIMIT ?", (match(present), limit)).fetchall()
+        else:
+            candidates = f"SELECT rowid FROM (SELECT rowid FROM {table} WHERE {table} MATCH ? ORDER BY rowid DESC LIMIT ?)"
+            parameters = [match(present), match(common), self.common_scan_limit]
+            if selective:
+                candidates += f" UNION SELECT rowid FROM {table} WHERE {table} MATCH ?"
+                parameters.append(match(selective))
+            # "+f.rowid" keeps SQLite from looking candidates up one rowid at a
+            # time, which re-runs the whole match per row; filtering a single
+            # pass over the postings only scores the candidates
+            rows = conn.execute(
+                ranked + f"AND +f.rowid IN ({candidates}) ORDER BY score LIMIT ?",
+                parameters + [limit]
+            ).fetchall()
+        if not rows:
+            return []
+
+        placeholders = ",".join("?" * len(rows))
+        rowids = [row[0] for row in rows]
+        texts = dict(conn.execute(f"SELECT rowid, chunk_text FROM {table} WHERE rowid IN ({placeholders})", rowids).fetchall())
+        keys = {
+            rowid: (document_id, chunk_index)
+            for rowid, document_id, chunk_index in conn.execute(
+                f"SELECT rowid, document_id, chunk_index FROM chunk_rows WHERE rowid IN ({placeholders})", rowids
+            )
+        }
+        return [
+            {
+                "document_id": keys[rowid][0],
+                "chunk_index": keys[rowid][1],
+                # bm25() is lower-is-better; flip it so higher is better like similarity
+                "bm25": -score,
+                "snippet": highlight_text(texts[rowid], terms, self.snippet_words)
+            }
+            for rowid, score in rows
+            if rowid in keys
+        ]
+
+# Global instance
+search_index = SearchIndex(db_path=settings.search_index_path)
@@ -1,18 +1,52 @@
 from supabase import create_client, Client
+from supabase.lib.client_options import ClientOptions
 from app.config import settings
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Union
+import asyncio
+import functools
+import json
 import logging
 
 logger = logging.getLogger(__name__)
 
+def parse_embedding(value: Any) -> List[float]:
+    """Accept an embedding as a list or as pgvector's text form, e.g. "[0.1,0.2]"
+    (which is how PostgREST returns vector columns)"""
+    return json.loads(value) if isinstance(value, str) else value
+
 class SupabaseClient:
+    """Supabase clients plus an async data-access layer.
+
+    supabase-py is synchronous, so queries run on a bounded thread pool
+    rather than on the event loop. Each client keeps one HTTP connection
+    pool (keep-alive) shared by all threads, and every call has a timeout.
+    """
+    
     def __init__(self):
+        # Each client gets its own options: the client writes its auth headers
+        # into options.headers, so a shared instance would give the anon
+        # client the service role's key
         self.client: Client = create_client(
             settings.supabase_url,
-            settings.supabase_key
+            settings.supabase_key,
+            options=self._options()
         )
         self.service_client: Client = create_client(
             settings.supabase_url,
-            settings.supabase_service_role_key
+            settings.supabase_service_role_key,
+            options=self._options()
+        )
+        self._executor = ThreadPoolExecutor(
+            max_workers=settings.supabase_max_concurrency,
+            thread_name_prefix="supabase"
+        )
+    
+    @staticmethod
+    def _options() -> ClientOptions:
+        return ClientOptions(
+            postgrest_client_timeout=settings.supabase_timeout_seconds,
+            storage_client_timeout=int(settings.supabase_upload_timeout_seconds)
         )
     
     def get_client(self) -> Client:
@@ -21,11 +55,50 @@ class SupabaseClient:
     def get_service_client(self) -> Client:
         return self.service_client
     
-    async def upload_file(self, bucket: str, file_path: str, file_data: bytes) -> str:
-        """Upload file to Supabase Storage"""
+    async def run(self, func: Callable[..., Any], *args: Any, timeout: Optional[float] = None, **kwargs: Any) -> Any:
+        """Run a blocking Supabase call on the client thread pool"""
+        loop = asyncio.get_running_loop()
+        call = loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+        return await asyncio.wait_for(call, timeout or settings.supabase_timeout_seconds)
+    
+    async def execute(self, query: Any, timeout: Optional[float] = None) -> Any:
+        """Execute a built query, e.g. `await supabase_client.execute(client.table("documents").select("*"))`"""
+        return await self.run(query.execute, timeout=timeout)
+    
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+    
+    async def match_document_chunks(
+        self,
+        query_embedding: List[float],
+        user_id: str,
+        source_doc_ids: Optional[List[str]] = None,
+        match_count: int = 10,
+        include_embeddings: bool = False
+    ) -> List[Dict[str, Any]]:
+        """Top-k chunk search server-side via the match_document_chunks SQL function"""
+        try:
+            response = await self.execute(self.service_client.rpc("match_document_chunks", {
+                "query_embedding": query_embedding,
+                "match_user_id": user_id,
+                "source_doc_ids": source_doc_ids,
+                "match_count": match_count,
+                "ef_search": max(settings.hnsw_ef_search, match_count),
+                "include_embeddings": include_embeddings,
+                "exact_scan_rows": settings.hnsw_exact_scan_rows,
+                "max_scan_tuples": settings.hnsw_max_scan_tuples
+            }))
+            return response.data
+        except Exception as e:
+            logger.error(f"Error matching document chunks: {e}")
+            raise
+    
+    async def upload_file(self, bucket: str, file_path: str, file_data: Union[bytes, str]) -> str:
+        """Upload file to Supabase Storage (file_data may be bytes or a local file path)"""
         try:
-            response = self.service_client.storage.from_(bucket).upload(
-                file_path, file_data
+            response = await self.run(
+                self.service_client.storage.from_(bucket).upload, file_path, file_data,
+                timeout=settings.supabase_upload_timeout_seconds
             )
             return response
         except Exception as e:
@@ -35,7 +108,7 @@ class SupabaseClient:
     async def download_file(self, bucket: str, file_path: str) -> bytes:
         """Download file from Supabase Storage"""
         try:
-            response = self.service_client.storage.from_(bucket).download(file_path)
+            response = await self.run(self.service_client.storage.from_(bucket).download, file_path)
             return response
         except Exception as e:
             logger.error(f"Error downloading file: {e}")
@@ -44,7 +117,7 @@ class SupabaseClient:
     async def delete_file(self, bucket: str, file_path: str) -> bool:
         """Delete file from Supabase Storage"""
         try:
-            self.service_client.storage.from_(bucket).remove([file_path])
+            await self.run(self.service_client.storage.from_(bucket).remove, [file_path])
             return True
         except Exception as e:
             logger.error(f"Error deleting file: {e}")
@@ -0,0 +1,123 @@
+from typing import List, Optional, Tuple
+import hashlib
+import os
+import secrets
+import sqlite3
+import threading
+import time
+
+from app.config import settings
+from app.models.schemas import Template
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS template_versions (
+    scope TEXT PRIMARY KEY,
+    version INTEGER NOT NULL
+);
+"""
+
+_PUBLIC = "public"
+# Random per version file, so a recreated file can't reissue an old ETag
+_EPOCH = "epoch"
+
+
+class TemplateCache:
+    """Process-wide cache of the public template library, plus the versions
+    behind template listing ETags.
+
+    Versions live in a SQLite file shared by all workers on the host: one
+    for the public library and one per user, each bumped by any write to
+    those templates. An ETag is a hash of the public and user versions and
+    a random epoch of the file, so it survives restarts, is the same in
+    every worker and can be checked without a database round trip. Public
+    templates are cached as validated models and reloaded after ttl_seconds
+    or as soon as the persisted public version moves past the one they were
+    loaded at, whichever worker wrote.
+    """
+
+    def __init__(self, db_path: str, ttl_seconds: float):
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds
+        self._public: Optional[List[Template]] = None
+        self._public_loaded_version = -1
+        self._public_expires_at = 0.0
+        self._lock = threading.Lock()
+        self._initialized = False
+
+    def _connect(self) -> sqlite3.Connection:
+        if not self._initialized:
+            os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        if not self._initialized:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+            with conn:
+                conn.execute(
+                    "INSERT OR IGNORE INTO template_versions (scope, version) VALUES (?, ?)",
+                    (_EPOCH, secrets.randbits(62))
+                )
+            self._initialized = True
+        return conn
+
+    def _bump(self, scope: str):
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute(
+                    "INSERT INTO template_versions (scope, version) VALUES (?, 1) "
+                    "ON CONFLICT (scope) DO UPDATE SET version = version + 1",
+                    (scope,)
+                )
+        finally:
+            conn.close()
+
+    def versions(self, user_id: str) -> Tuple[int, str]:
+        """The public version, and a tag of everything an ETag for the user
+        depends on (epoch, public and user versions)"""
+        conn = self._connect()
+        try:
+            rows = dict(conn.execute(
+                "SELECT scope, version FROM template_versions WHERE scope IN (?, ?, ?)",
+                (_EPOCH, _PUBLIC, f"user:{user_id}")
+            ).fetchall())
+        finally:
+            conn.close()
+        public_version = rows.get(_PUBLIC, 0)
+        return public_version, f"{rows.get(_EPOCH, 0)}:{public_version}:{rows.get(f'user:{user_id}', 0)}"
+
+    def public(self, public_version: int) -> Optional[List[Template]]:
+        """The cached public templates if they are fresh and at public_version, else None"""
+        with self._lock:
+            if (
+                self._public is None
+                or self._public_loaded_version != public_version
+                or self._public_expires_at <= time.monotonic()
+            ):
+                return None
+            return list(self._public)
+
+    def set_public(self, templates: List[Template], public_version: int):
+        """Store a public listing loaded at public_version"""
+        with self._lock:
+            self._public = list(templates)
+            self._public_loaded_version = public_version
+            self._public_expires_at = time.monotonic() + self.ttl_seconds
+
+    def invalidate_public(self):
+        self._bump(_PUBLIC)
+        with self._lock:
+            self._public = None
+
+    def bump_user(self, user_id: str):
+        self._bump(f"user:{user_id}")
+
+    @staticmethod
+    def make_etag(user_id: str, versions: str) -> str:
+        key = f"{user_id}:{versions}"
+        return '"' + hashlib.sha256(key.encode("utf-8")).hexdigest()[:32] + '"'
+
+# Global instance
+template_cache = TemplateCache(
+    db_path=settings.template_versions_path,
+    ttl_seconds=settings.template_cache_ttl_seconds
+)
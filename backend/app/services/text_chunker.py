@@ -0,0 +1,144 @@
+from typing import List, Dict, Any, Tuple
+from bisect import bisect_left, bisect_right
+import logging
+import re
+
+import tiktoken
+
+logger = logging.getLogger(__name__)
+
+_SENTENCE_END = re.compile(r"[.!?][\"')\]]*\s+")
+_PARAGRAPH_END = re.compile(r"\n\s*\n\s*")
+
+# Boundary strengths, strongest first
+_PARAGRAPH = 2
+_SENTENCE = 1
+
+
+class TokenChunker:
+    """Incremental token-window chunker using the cl100k_base encoding.
+
+    Each page is encoded exactly once and pages are joined with a blank
+    line; chunks are slices of the token buffer, so windows and their
+    overlap are only re-encoded when stripping edge whitespace changed the
+    text. Cuts prefer paragraph breaks, then sentence ends, in the back
+    half of a window, and only fall back to a hard token cut when a single
+    sentence is longer than the window. Every chunk records the token
+    count of its stored text and the pages it spans.
+    """
+
+    def __init__(self, chunk_size: int, chunk_overlap: int, encoding_name: str = "cl100k_base"):
+        if chunk_overlap >= chunk_size:
+            raise ValueError("chunk_overlap must be smaller than chunk_size")
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.encoding = tiktoken.get_encoding(encoding_name)
+        self._separator = self.encoding.encode_ordinary("\n\n")
+        self._tokens: List[int] = []
+        self._boundaries: List[Tuple[int, int]] = []  # (token offset, strength), sorted
+        self._pages: List[Tuple[int, int]] = []  # (token offset, page number), sorted
+        self._base = 0  # global offset of self._tokens[0]
+        self._emitted = 0  # tokens at the head of the buffer already emitted as overlap
+        self._index = 0
+
+    def feed(self, page_number: int, text: str) -> List[Dict[str, Any]]:
+        """Add a page of text and return any chunks that are now complete"""
+        if not text.strip():
+            return []
+        tokens = self.encoding.encode_ordinary(text)
+        _, offsets = self.encoding.decode_with_offsets(tokens)
+
+        if self._tokens:
+            # Keep pages apart so a chunk spanning a page break doesn't glue
+            # the last word of one page to the first word of the next
+            self._tokens.extend(self._separator)
+        start = len(self._tokens)
+        if start:
+            self._add_boundary(start, _PARAGRAPH)
+        self._pages.append((start, page_number))
+        for pattern, strength in ((_SENTENCE_END, _SENTENCE), (_PARAGRAPH_END, _PARAGRAPH)):
+            for match in pattern.finditer(text):
+                # The boundary is the token holding the first character after the break
+                position = bisect_right(offsets, match.end()) - 1
+                if 0 < position < len(tokens):
+                    self._add_boundary(start + position, strength)
+        self._tokens.extend(tokens)
+
+        chunks = []
+        while len(self._tokens) >= self.chunk_size:
+            chunks.append(self._emit(self._choose_end()))
+        return chunks
+
+    def flush(self) -> List[Dict[str, Any]]:
+        """Emit the remaining tokens, unless they were all part of the previous overlap"""
+        if len(self._tokens) <= self._emitted:
+            return []
+        chunk = self._emit(len(self._tokens))
+        self._tokens = []
+        self._boundaries = []
+        self._pages = []
+        return [chunk]
+
+    def _add_boundary(self, offset: int, strength: int):
+        i = bisect_left(self._boundaries, (offset, 0))
+        if i < len(self._boundaries) and self._boundaries[i][0] == offset:
+            if strength > self._boundaries[i][1]:
+                self._boundaries[i] = (offset, strength)
+        else:
+            self._boundaries.insert(i, (offset, strength))
+
+    def _choose_end(self) -> int:
+        """Pick where the next chunk ends: the strongest boundary in the back half of the window"""
+        low = self.chunk_size // 2
+        best = {}
+        for offset, strength in self._boundaries:
+            if offset > self.chunk_size:
+                break
+            if offset >= low:
+                best[strength] = offset
+        for strength in (_PARAGRAPH, _SENTENCE):
+            if strength in best:
+                return best[strength]
+        return self.chunk_size
+
+    def _emit(self, end: int) -> Dict[str, Any]:
+        window = self._tokens[:end]
+        decoded = self.encoding.decode(window)
+        text = decoded.strip()
+        # token_count describes the stored text, which may have lost edge whitespace
+        token_count = len(window) if text == decoded else len(self.encoding.encode_ordinary(text))
+        chunk = {
+            "text": text,
+            "index": self._index,
+            "start_token": self._base,
+            "end_token": self._base + end,
+            "metadata": {
+                "token_count": token_count,
+                "page_start": self._page_at(0),
+                "page_end": self._page_at(end - 1)
+            }
+        }
+        self._index += 1
+
+        # Carry the trailing sentences (at most chunk_overlap tokens) into the next chunk
+        start = end - self.chunk_overlap
+        for offset, _ in self._boundaries:
+            if offset >= start:
+                if offset < end:
+                    start = offset
+                break
+        start = max(start, 1)
+        self._drop(start)
+        self._emitted = end - start
+        return chunk
+
+    def _page_at(self, position: int) -> int:
+        return self._pages[bisect_right(self._pages, (position, float("inf"))) - 1][1]
+
+    def _drop(self, count: int):
+        """Discard the first count tokens, rebasing boundary and page offsets"""
+        page = self._page_at(count)
+        self._tokens = self._tokens[count:]
+        self._base += count
+        self._boundaries = [(offset - count, strength) for offset, strength in self._boundaries if offset > count]
+        self._pages = [(0, page)] + [(offset - count, number) for offset, number in self._pages if offset > count]
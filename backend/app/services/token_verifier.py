@@ -0,0 +1,133 @@
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+import logging
+import threading
+import time
+
+import jwt
+
+from app.config import settings
+from app.models.schemas import User
+from app.services.supabase_client import supabase_client
+
+logger = logging.getLogger(__name__)
+
+
+class TokenVerifier:
+    """Verifies Supabase access tokens, mostly without a network call.
+
+    With SUPABASE_JWT_SECRET set, HS256 tokens are checked locally
+    (signature, expiry, audience) and the user is built from the claims;
+    validly signed but expired or mis-addressed tokens are rejected here.
+    created_at is not a claim, so it comes from one remote lookup per user,
+    cached by user id. Tokens that can't be checked locally go to
+    auth.get_user. Verified tokens are cached until they expire or for
+    ttl_seconds, whichever is sooner.
+    """
+
+    def __init__(self, jwt_secret: str, audience: str, ttl_seconds: float, max_entries: int):
+        self.jwt_secret = jwt_secret
+        self.audience = audience
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._tokens: "OrderedDict[str, Tuple[float, User]]" = OrderedDict()
+        self._created_at: "OrderedDict[str, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _cache_get(self, token: str) -> Optional[User]:
+        with self._lock:
+            entry = self._tokens.get(token)
+            if entry is None:
+                return None
+            if entry[0] < time.time():
+                del self._tokens[token]
+                return None
+            self._tokens.move_to_end(token)
+            return entry[1]
+
+    def _cache_put(self, token: str, user: User, expires_at: Optional[float]):
+        deadline = time.time() + self.ttl_seconds
+        if expires_at is not None:
+            deadline = min(deadline, expires_at)
+        with self._lock:
+            self._tokens[token] = (deadline, user)
+            self._tokens.move_to_end(token)
+            while len(self._tokens) > self.max_entries:
+                self._tokens.popitem(last=False)
+            self._created_at[user.id] = user.created_at
+            self._created_at.move_to_end(user.id)
+            while len(self._created_at) > self.max_entries:
+                self._created_at.popitem(last=False)
+
+    def _decode_locally(self, token: str) -> Optional[Dict[str, Any]]:
+        """Verified claims, or None if the token isn't one we can check locally.
+        Raises jwt.InvalidTokenError for a token that is checkable but invalid."""
+        if not self.jwt_secret:
+            return None
+        if jwt.get_unverified_header(token).get("alg") != "HS256":
+            return None
+        return jwt.decode(token, self.jwt_secret, algorithms=["HS256"], audience=self.audience)
+
+    async def _fetch_user(self, token: str) -> Optional[User]:
+        response = await supabase_client.run(supabase_client.get_client().auth.get_user, token)
+        if not response.user:
+            return None
+        return User(
+            id=response.user.id,
+            email=response.user.email,
+            name=response.user.user_metadata.get("name"),
+            created_at=response.user.created_at
+        )
+
+    async def verify(self, token: str) -> Optional[User]:
+        """Return the token's user, or None if the token is not valid"""
+        user = self._cache_get(token)
+        if user is not None:
+            return user
+
+        try:
+            claims = self._decode_locally(token)
+        except jwt.InvalidSignatureError:
+            # Forged, or signed with a key we don't have (e.g. a misconfigured secret);
+            # Supabase has the final say
+            logger.warning("Access token signature did not verify locally; checking with Supabase")
+            claims = None
+        except jwt.InvalidTokenError as e:
+            logger.info(f"Rejected access token: {e}")
+            return None
+
+        if claims is not None:
+            with self._lock:
+                created_at = self._created_at.get(claims["sub"])
+            if created_at is not None:
+                user = User(
+                    id=claims["sub"],
+                    email=claims.get("email") or "",
+                    name=(claims.get("user_metadata") or {}).get("name"),
+                    created_at=created_at
+                )
+                self._cache_put(token, user, claims.get("exp"))
+                return user
+
+        # First sight of this user, or a token we can't verify ourselves
+        user = await self._fetch_user(token)
+        if user is not None:
+            expires_at = claims.get("exp") if claims is not None else self._unverified_expiry(token)
+            self._cache_put(token, user, expires_at)
+        return user
+
+    @staticmethod
+    def _unverified_expiry(token: str) -> Optional[float]:
+        # Only used to bound the cache lifetime of a token Supabase has just accepted
+        try:
+            return jwt.decode(token, options={"verify_signature": False}).get("exp")
+        except jwt.InvalidTokenError:
+            return None
+
+# Global instance
+token_verifier = TokenVerifier(
+    jwt_secret=settings.supabase_jwt_secret,
+    audience=settings.jwt_audience,
+    ttl_seconds=settings.auth_cache_ttl_seconds,
+    max_entries=settings.auth_cache_max_entries
+)
@@ -0,0 +1,128 @@
+from fastapi import HTTPException, UploadFile
+import asyncio
+import hashlib
+import logging
+import os
+import tempfile
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class UploadTooLargeError(Exception):
+    """Raised when an upload exceeds the configured size limit"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        super().__init__(f"File exceeds the maximum size of {max_bytes // (1024 * 1024)} MB")
+
+
+class SpooledUpload:
+    """An upload that has been streamed to a file in the spool directory"""
+
+    def __init__(self, path: str, size: int, sha256: str):
+        self.path = path
+        self.size = size
+        self.sha256 = sha256
+
+    def cleanup(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning(f"Failed to remove spooled upload {self.path}: {e}")
+
+
+class UploadSpooler:
+    """Streams uploads to disk chunk by chunk, enforcing the size limit and hashing as it goes.
+
+    Nothing holds the whole file in memory: storage upload and extraction
+    both read from the spooled path.
+    """
+
+    def __init__(self, spool_dir: str, max_bytes: int, chunk_size: int):
+        self.spool_dir = spool_dir
+        self.max_bytes = max_bytes
+        self.chunk_size = chunk_size
+
+    async def spool(self, upload: UploadFile, suffix: str = "") -> SpooledUpload:
+        """Copy an UploadFile to the spool directory"""
+        os.makedirs(self.spool_dir, exist_ok=True)
+        fd, path = tempfile.mkstemp(dir=self.spool_dir, suffix=suffix)
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            with os.fdopen(fd, "wb") as out:
+                while True:
+                    chunk = await upload.read(self.chunk_size)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if size > self.max_bytes:
+                        raise UploadTooLargeError(self.max_bytes)
+                    digest.update(chunk)
+                    await asyncio.to_thread(out.write, chunk)
+        except BaseException:
+            SpooledUpload(path, size, "").cleanup()
+            raise
+        return SpooledUpload(path, size, digest.hexdigest())
+
+
+class UploadSizeLimitMiddleware:
+    """ASGI middleware that rejects oversized upload bodies while they stream in.
+
+    Starlette parses multipart bodies into its own spool before the endpoint
+    runs, so the limit has to be applied to the raw body to fail fast: a
+    declared Content-Length over the limit is rejected before any bytes are
+    read, and chunked bodies are cut off as soon as the running total
+    crosses it.
+    """
+
+    def __init__(self, app, max_bytes: int, path_suffix: str = "/upload"):
+        self.app = app
+        self.max_bytes = max_bytes
+        self.path_suffix = path_suffix
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or not scope["path"].endswith(self.path_suffix):
+            await self.app(scope, receive, send)
+            return
+
+        content_length = dict(scope["headers"]).get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > self.max_bytes:
+            await self._reject(send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    raise HTTPException(status_code=413, detail=str(UploadTooLargeError(self.max_bytes)))
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+    async def _reject(self, send):
+        body = f'{{"detail": "{UploadTooLargeError(self.max_bytes)}"}}'.encode()
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode())
+            ]
+        })
+        await send({"type": "http.response.body", "body": body})
+
+# Global instance
+upload_spooler = UploadSpooler(
+    spool_dir=settings.upload_spool_dir,
+    max_bytes=settings.max_file_size_mb * 1024 * 1024,
+    chunk_size=settings.upload_chunk_size_kb * 1024
+)
@@ -0,0 +1,70 @@
+from typing import Dict, Optional
+import asyncio
+import logging
+
+from app.config import settings
+from app.services.supabase_client import supabase_client
+
+logger = logging.getLogger(__name__)
+
+
+class UsageCounter:
+    """Coalesces template usage_count increments in memory.
+
+    record() only bumps a per-template counter; a background task flushes
+    the pending counts every flush_interval seconds in one atomic
+    increment_template_usage call, and stop() flushes whatever is left.
+    A failed flush puts its counts back so they go out with the next one.
+    """
+
+    def __init__(self, flush_interval: float):
+        self.flush_interval = flush_interval
+        self._pending: Dict[str, int] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+
+    def record(self, template_id: str, count: int = 1):
+        self._pending[template_id] = self._pending.get(template_id, 0) + count
+
+    def pending(self) -> int:
+        return sum(self._pending.values())
+
+    async def flush(self) -> int:
+        """Write out pending increments; returns how many uses were flushed"""
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        async with self._flush_lock:
+            if not self._pending:
+                return 0
+            batch, self._pending = self._pending, {}
+            try:
+                await supabase_client.execute(
+                    supabase_client.get_service_client().rpc("increment_template_usage", {"increments": batch})
+                )
+            except Exception as e:
+                logger.error(f"Failed to flush usage counts for {len(batch)} templates: {e}")
+                for template_id, count in batch.items():
+                    self.record(template_id, count)
+                return 0
+            return sum(batch.values())
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def start(self):
+        """Start the periodic flush (called on application startup)"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        """Stop the periodic flush and write out what is still pending"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+# Global instance
+usage_counter = UsageCounter(flush_interval=settings.template_usage_flush_seconds)
@@ -0,0 +1,176 @@
+from typing import Any, Dict, List, Optional, Tuple
+import base64
+import difflib
+import hashlib
+import json
+import logging
+import uuid
+import zlib
+
+from app.config import settings
+from app.services.supabase_client import supabase_client
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT = "snapshot"
+DELTA = "delta"
+
+
+def _pack(data: bytes) -> str:
+    return base64.b64encode(zlib.compress(data, 9)).decode("ascii")
+
+
+def _unpack(payload: str) -> bytes:
+    return zlib.decompress(base64.b64decode(payload))
+
+
+def _content_hash(content: str) -> str:
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def make_delta(base: str, target: str) -> List[Any]:
+    """Line-level edit script turning base into target: ["c", i1, i2] copies
+    base lines i1:i2, a string inserts new text; anything else is deleted"""
+    base_lines = base.splitlines(keepends=True)
+    target_lines = target.splitlines(keepends=True)
+    ops: List[Any] = []
+    matcher = difflib.SequenceMatcher(None, base_lines, target_lines, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            ops.append(["c", i1, i2])
+        elif tag in ("replace", "insert"):
+            ops.append("".join(target_lines[j1:j2]))
+    return ops
+
+
+def apply_delta(base: str, ops: List[Any]) -> str:
+    base_lines = base.splitlines(keepends=True)
+    parts = []
+    for op in ops:
+        if isinstance(op, str):
+            parts.append(op)
+        else:
+            parts.extend(base_lines[op[1]:op[2]])
+    return "".join(parts)
+
+
+class VersionStore:
+    """Version history for generated documents in doc_versions.
+
+    Every content change is recorded under the document's version number,
+    either as a zlib-compressed full snapshot or as a compressed line diff
+    against the previous version. A snapshot is taken for the first
+    version, after snapshot_interval consecutive deltas, and whenever the
+    diff would be nearly as large as the snapshot (e.g. a full rewrite), so
+    any version is rebuilt from one snapshot plus a bounded chain of diffs.
+    """
+
+    def __init__(self, snapshot_interval: int):
+        self.snapshot_interval = snapshot_interval
+
+    def _table(self):
+        return supabase_client.get_client().table("doc_versions")
+
+    async def _latest(self, doc_id: str) -> Optional[Dict[str, Any]]:
+        response = await supabase_client.execute(
+            self._table().select("version_number, depth").eq("generated_doc_id", doc_id).order("version_number", desc=True).limit(1)
+        )
+        return response.data[0] if response.data else None
+
+    def _row(self, doc_id: str, version_number: int, content: str, user_id: str, kind: str, payload: str, depth: int) -> Dict[str, Any]:
+        return {
+            "id": str(uuid.uuid4()),
+            "generated_doc_id": doc_id,
+            "version_number": version_number,
+            "kind": kind,
+            "payload": payload,
+            "depth": depth,
+            "content_hash": _content_hash(content),
+            "content_length": len(content),
+            "stored_bytes": len(payload),
+            "created_by": user_id
+        }
+
+    async def record(
+        self,
+        doc_id: str,
+        version_number: int,
+        content: str,
+        user_id: str,
+        previous: Optional[Tuple[int, str]] = None
+    ):
+        """Store content as version_number of the document.
+
+        previous is the (version, content) it replaced. It is the base for the
+        diff, and is stored first as a snapshot if the document has no history
+        yet (documents created before versioning).
+        """
+        latest = await self._latest(doc_id)
+        if latest is None and previous is not None:
+            await supabase_client.execute(self._table().insert(
+                self._row(doc_id, previous[0], previous[1], user_id, SNAPSHOT, _pack(previous[1].encode("utf-8")), 0)
+            ))
+            latest = {"version_number": previous[0], "depth": 0}
+
+        snapshot = _pack(content.encode("utf-8"))
+        row = self._row(doc_id, version_number, content, user_id, SNAPSHOT, snapshot, 0)
+        if (
+            latest is not None
+            and previous is not None
+            and latest["version_number"] == previous[0]
+            and latest["depth"] + 1 < self.snapshot_interval
+        ):
+            delta = _pack(json.dumps(make_delta(previous[1], content), separators=(",", ":")).encode("utf-8"))
+            if len(delta) < 0.8 * len(snapshot):
+                row = self._row(doc_id, version_number, content, user_id, DELTA, delta, latest["depth"] + 1)
+
+        await supabase_client.execute(self._table().insert(row))
+
+    async def list_versions(self, doc_id: str) -> List[Dict[str, Any]]:
+        response = await supabase_client.execute(
+            self._table().select(
+                "id, version_number, kind, content_length, stored_bytes, created_by, created_at"
+            ).eq("generated_doc_id", doc_id).order("version_number", desc=True)
+        )
+        return response.data
+
+    async def reconstruct(self, doc_id: str, version_number: int) -> Optional[Dict[str, Any]]:
+        """The stored row for a version with its rebuilt content, or None if it wasn't recorded"""
+        snapshots = await supabase_client.execute(
+            self._table().select("version_number").eq("generated_doc_id", doc_id).eq("kind", SNAPSHOT).lte("version_number", version_number).order("version_number", desc=True).limit(1)
+        )
+        if not snapshots.data:
+            return None
+        base_version = snapshots.data[0]["version_number"]
+
+        response = await supabase_client.execute(
+            self._table().select(
+                "id, version_number, kind, payload, content_hash, created_by, created_at"
+            ).eq("generated_doc_id", doc_id).gte("version_number", base_version).lte("version_number", version_number).order("version_number")
+        )
+        rows = response.data
+        if not rows or rows[-1]["version_number"] != version_number:
+            return None
+
+        content = ""
+        for row in rows:
+            data = _unpack(row["payload"])
+            if row["kind"] == SNAPSHOT:
+                content = data.decode("utf-8")
+            else:
+                content = apply_delta(content, json.loads(data))
+
+        target = rows[-1]
+        if _content_hash(content) != target["content_hash"]:
+            raise ValueError(f"Version {version_number} of {doc_id} failed its integrity check")
+        return {
+            "id": target["id"],
+            "generated_doc_id": doc_id,
+            "content": content,
+            "version_number": version_number,
+            "created_at": target["created_at"],
+            "created_by": target["created_by"]
+        }
+
+# Global instance
+version_store = VersionStore(snapshot_interval=settings.version_snapshot_interval)
@@ -0,0 +1,144 @@
+"""Time hybrid search queries against a large keyword index.
+
+Fills a fresh SearchIndex with synthetic chunks (Zipf-distributed words,
+so common terms match a large share of the vault, like real text) and
+times keyword queries, then the same queries with reciprocal rank fusion
+against a vector ranking of the same size. The vector ranking itself
+comes from pgvector (see benchmarks.pgvector_retrieval) and is not timed
+here.
+
+Other tenants share the index file. Their chunks repeat a probe term that
+the benchmark user has in only a few chunks; a query for it must still
+find every one of those, and nothing outside the user's vault.
+
+    cd backend
+    python -m benchmarks.search_latency --chunks 100000
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from app.services.search_index import SearchIndex, reciprocal_rank_fusion
+
+USER_ID = "benchmark-user"
+PROBE = "tenantprobe"
+PROBE_CHUNKS = 5
+
+
+def make_vocabulary(size: int, rng: random.Random) -> list:
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(letters) for _ in range(rng.randint(3, 10))))
+    return sorted(words)
+
+
+def load(index: SearchIndex, chunks: int, chunk_words: int, documents: int, vocabulary: list, rng: random.Random):
+    weights = [1.0 / (rank + 1) for rank in range(len(vocabulary))]
+    per_document = chunks // documents
+    for document in range(documents):
+        texts = [
+            " ".join(rng.choices(vocabulary, weights=weights, k=chunk_words))
+            for _ in range(per_document)
+        ]
+        index.index_document(USER_ID, f"doc-{document}", list(enumerate(texts)))
+    index.index_document(USER_ID, "probe-doc", [
+        (i, f"{PROBE} " + " ".join(rng.choices(vocabulary, weights=weights, k=chunk_words)))
+        for i in range(PROBE_CHUNKS)
+    ])
+
+
+def load_other_users(index: SearchIndex, users: int, chunks: int, chunk_words: int, vocabulary: list, rng: random.Random):
+    """Tenants whose every chunk contains the probe term and the most common words"""
+    for user in range(users):
+        texts = [
+            " ".join([PROBE] * 5 + rng.choices(vocabulary[:50], k=chunk_words))
+            for _ in range(chunks)
+        ]
+        index.index_document(f"other-user-{user}", f"other-doc-{user}", list(enumerate(texts)))
+
+
+def check_isolation(index: SearchIndex, vocabulary: list, candidates: int) -> bool:
+    """The probe query finds all of the user's probe chunks and only the user's chunks"""
+    ok = True
+    for query in (PROBE, f"{PROBE} {vocabulary[0]}"):
+        started = time.perf_counter()
+        hits = index.search(USER_ID, query, candidates)
+        elapsed = (time.perf_counter() - started) * 1000
+        found = sum(hit["document_id"] == "probe-doc" for hit in hits)
+        foreign = sum(hit["document_id"].startswith("other-") for hit in hits)
+        print(f"tenant check {query!r}: {found}/{PROBE_CHUNKS} probe chunks, {foreign} foreign hits, {elapsed:.2f} ms")
+        ok = ok and found == PROBE_CHUNKS and foreign == 0
+    return ok
+
+
+def percentile(values: list, fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, default=100000)
+    parser.add_argument("--chunk-words", type=int, default=150)
+    parser.add_argument("--documents", type=int, default=500)
+    parser.add_argument("--vocabulary", type=int, default=30000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--candidates", type=int, default=50)
+    parser.add_argument("--other-users", type=int, default=5)
+    parser.add_argument("--other-chunks", type=int, default=20000, help="Chunks per other user")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--index", help="Reuse (or keep) the index at this path instead of a temporary one")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    vocabulary = make_vocabulary(args.vocabulary, rng)
+    path = args.index or os.path.join(tempfile.mkdtemp(), "search_index.db")
+    reuse = os.path.exists(path)
+    index = SearchIndex(db_path=path)
+
+    if not reuse:
+        started = time.perf_counter()
+        load(index, args.chunks, args.chunk_words, args.documents, vocabulary, rng)
+        load_other_users(index, args.other_users, args.other_chunks, args.chunk_words, vocabulary, rng)
+        print(f"indexed {args.chunks} chunks plus {args.other_users} x {args.other_chunks} for other users in {time.perf_counter() - started:.1f}s "
+              f"({os.path.getsize(path) / 2 ** 20:.0f} MiB)")
+
+    # Two to four terms each, drawn across the frequency range: some very common, most not
+    queries = [
+        " ".join(vocabulary[int(len(vocabulary) * rng.random() ** 3)] for _ in range(rng.randint(2, 4)))
+        for _ in range(args.queries)
+    ]
+    index.search(USER_ID, queries[0], args.candidates)
+
+    keyword_ms = []
+    hybrid_ms = []
+    matched = 0
+    for query in queries:
+        started = time.perf_counter()
+        hits = index.search(USER_ID, query, args.candidates)
+        keyword_ms.append((time.perf_counter() - started) * 1000)
+        matched += bool(hits)
+
+        vector = [(f"doc-{rng.randrange(args.documents)}", rng.randrange(args.chunks // args.documents)) for _ in range(args.candidates)]
+        started = time.perf_counter()
+        hits = index.search(USER_ID, query, args.candidates)
+        reciprocal_rank_fusion({
+            "keyword": [(hit["document_id"], hit["chunk_index"]) for hit in hits],
+            "vector": vector
+        }, 60)
+        hybrid_ms.append((time.perf_counter() - started) * 1000)
+
+    for name, timings in (("keyword", keyword_ms), ("keyword + RRF", hybrid_ms)):
+        print(f"{name:>14}: p50 {statistics.median(timings):6.2f} ms  p95 {percentile(timings, 0.95):6.2f} ms  "
+              f"p99 {percentile(timings, 0.99):6.2f} ms  max {max(timings):6.2f} ms")
+    print(f"{matched}/{len(queries)} queries had matches")
+    if not check_isolation(index, vocabulary, args.candidates):
+        raise SystemExit("other tenants' chunks changed the benchmark user's results")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,6 +5,9 @@ ALTER TABLE documents ENABLE ROW LEVEL SECURITY;
 ALTER TABLE document_chunks ENABLE ROW LEVEL SECURITY;
 ALTER TABLE generated_docs ENABLE ROW LEVEL SECURITY;
 ALTER TABLE templates ENABLE ROW LEVEL SECURITY;
+ALTER TABLE document_folders ENABLE ROW LEVEL SECURITY;
+ALTER TABLE document_tags ENABLE ROW LEVEL SECURITY;
+ALTER TABLE doc_versions ENABLE ROW LEVEL SECURITY;
 
 -- Documents policies
 -- Users can only see their own documents
@@ -93,3 +96,35 @@ CREATE POLICY "Users can update own templates"
 CREATE POLICY "Users can delete own templates"
     ON templates FOR DELETE
     USING (auth.uid()::text = user_id);
+
+-- Folder and tag aggregate policies
+-- Maintained by a trigger on documents; users can only read their own
+CREATE POLICY "Users can view own document folders"
+    ON document_folders FOR SELECT
+    USING (auth.uid()::text = user_id);
+
+CREATE POLICY "Users can view own document tags"
+    ON document_tags FOR SELECT
+    USING (auth.uid()::text = user_id);
+
+-- Version history policies
+-- Users can see and add versions of their own generated documents
+CREATE POLICY "Users can view own doc versions"
+    ON doc_versions FOR SELECT
+    USING (
+        EXISTS (
+            SELECT 1 FROM generated_docs
+            WHERE generated_docs.id = doc_versions.generated_doc_id
+            AND generated_docs.user_id = auth.uid()::text
+        )
+    );
+
+CREATE POLICY "Users can insert own doc versions"
+    ON doc_versions FOR INSERT
+    WITH CHECK (
+        EXISTS (
+            SELECT 1 FROM generated_docs
+            WHERE generated_docs.id = doc_versions.generated_doc_id
+            AND generated_docs.user_id = auth.uid()::text
+        )
+    );
@@ -11,6 +11,7 @@ CREATE TABLE documents (
     folder_path TEXT,
     tags TEXT[],
     extracted_text TEXT,
+    content_hash TEXT,
     status TEXT NOT NULL,
     created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
     updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
@@ -23,6 +24,8 @@ CREATE TABLE document_chunks (
     chunk_text TEXT NOT NULL,
     chunk_index INTEGER NOT NULL,
     embedding vector(1536),
+    embedding_model TEXT,
+    content_hash TEXT,
     metadata JSONB,
     created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
 );
@@ -62,6 +65,251 @@ CREATE INDEX idx_documents_folder_path ON documents(folder_path);
 CREATE INDEX idx_documents_tags ON documents USING GIN(tags);
 CREATE INDEX idx_generated_docs_user_id ON generated_docs(user_id);
 CREATE INDEX idx_templates_user_id ON templates(user_id);
+CREATE INDEX idx_document_chunks_document_id ON document_chunks(document_id);
+CREATE INDEX idx_documents_content_hash ON documents(user_id, content_hash);
+-- Keyset pagination for the list endpoints: newest first, ties broken by id
+CREATE INDEX idx_documents_user_created ON documents(user_id, created_at DESC, id DESC);
+CREATE INDEX idx_generated_docs_user_created ON generated_docs(user_id, created_at DESC, id DESC);
+CREATE INDEX idx_document_chunks_content_hash ON document_chunks(content_hash, embedding_model);
 
 -- Create indexes for vector search
-CREATE INDEX idx_document_chunks_embedding ON document_chunks USING ivfflat (embedding vector_cosine_ops);
+-- HNSW needs no training data or lists tuning and keeps recall as the table grows
+CREATE INDEX idx_document_chunks_embedding ON document_chunks USING hnsw (embedding vector_cosine_ops) WITH (m = 16, ef_construction = 64);
+
+-- Copy the chunks (and embeddings) of an already-processed document to a
+-- re-upload of the same file, so it is not extracted or embedded again
+CREATE OR REPLACE FUNCTION clone_document_chunks(source_document_id TEXT, target_document_id TEXT)
+RETURNS INTEGER
+LANGUAGE sql
+AS $$
+    WITH inserted AS (
+        INSERT INTO document_chunks (id, document_id, chunk_text, chunk_index, embedding, embedding_model, content_hash, metadata)
+        SELECT gen_random_uuid()::text, target_document_id, chunk_text, chunk_index, embedding, embedding_model, content_hash, metadata
+        FROM document_chunks
+        WHERE document_id = source_document_id
+        RETURNING 1
+    )
+    SELECT COUNT(*)::integer FROM inserted;
+$$;
+
+-- Top-k chunks of a user's documents by cosine similarity, optionally limited
+-- to specific source documents. Embeddings are only returned when asked for
+-- (e.g. for MMR re-ranking).
+--
+-- The HNSW index covers every user's chunks, and a plain index scan returns
+-- its ef_search nearest rows before the user/document filter is applied, so
+-- anyone holding a small share of the table would get few or no rows. When
+-- the filter leaves at most exact_scan_rows chunks they are ranked exactly
+-- instead (ordering by similarity rather than by the distance operator keeps
+-- the planner off the index). Larger candidate sets use pgvector 0.8's
+-- iterative index scan, which keeps walking the graph until match_count rows
+-- pass the filter or max_scan_tuples rows have been visited; ef_search trades
+-- recall for latency there.
+DROP FUNCTION IF EXISTS match_document_chunks(vector, TEXT, TEXT[], INTEGER, INTEGER, BOOLEAN);
+CREATE OR REPLACE FUNCTION match_document_chunks(
+    query_embedding vector(1536),
+    match_user_id TEXT,
+    source_doc_ids TEXT[] DEFAULT NULL,
+    match_count INTEGER DEFAULT 10,
+    ef_search INTEGER DEFAULT 40,
+    include_embeddings BOOLEAN DEFAULT FALSE,
+    exact_scan_rows INTEGER DEFAULT 10000,
+    max_scan_tuples INTEGER DEFAULT 20000
+)
+RETURNS TABLE (
+    id TEXT,
+    document_id TEXT,
+    chunk_text TEXT,
+    chunk_index INTEGER,
+    metadata JSONB,
+    embedding vector(1536),
+    similarity FLOAT
+)
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    candidate_rows INTEGER;
+BEGIN
+    SELECT COUNT(*) INTO candidate_rows FROM (
+        SELECT 1
+        FROM document_chunks c
+        JOIN documents d ON d.id = c.document_id
+        WHERE d.user_id = match_user_id
+          AND (source_doc_ids IS NULL OR c.document_id = ANY(source_doc_ids))
+          AND c.embedding IS NOT NULL
+        LIMIT exact_scan_rows + 1
+    ) AS capped;
+
+    IF candidate_rows <= exact_scan_rows THEN
+        RETURN QUERY
+        SELECT c.id, c.document_id, c.chunk_text, c.chunk_index, c.metadata,
+               CASE WHEN include_embeddings THEN c.embedding END,
+               1 - (c.embedding <=> query_embedding) AS similarity
+        FROM document_chunks c
+        JOIN documents d ON d.id = c.document_id
+        WHERE d.user_id = match_user_id
+          AND (source_doc_ids IS NULL OR c.document_id = ANY(source_doc_ids))
+          AND c.embedding IS NOT NULL
+        ORDER BY 7 DESC  -- similarity (the name would resolve to the output column)
+        LIMIT match_count;
+        RETURN;
+    END IF;
+
+    PERFORM set_config('hnsw.ef_search', ef_search::text, true);
+    PERFORM set_config('hnsw.iterative_scan', 'relaxed_order', true);
+    PERFORM set_config('hnsw.max_scan_tuples', max_scan_tuples::text, true);
+    -- relaxed_order can return rows slightly out of order; re-sort the top k
+    RETURN QUERY
+    WITH nearest AS MATERIALIZED (
+        SELECT c.id, c.document_id, c.chunk_text, c.chunk_index, c.metadata,
+               CASE WHEN include_embeddings THEN c.embedding END AS embedding,
+               c.embedding <=> query_embedding AS distance
+        FROM document_chunks c
+        JOIN documents d ON d.id = c.document_id
+        WHERE d.user_id = match_user_id
+          AND (source_doc_ids IS NULL OR c.document_id = ANY(source_doc_ids))
+          AND c.embedding IS NOT NULL
+        ORDER BY c.embedding <=> query_embedding
+        LIMIT match_count
+    )
+    SELECT n.id, n.document_id, n.chunk_text, n.chunk_index, n.metadata, n.embedding,
+           1 - n.distance AS similarity
+    FROM nearest n
+    ORDER BY n.distance;
+END;
+$$;
+
+-- Keep updated_at current so it can version a row (e.g. for response caching)
+CREATE OR REPLACE FUNCTION set_updated_at()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    NEW.updated_at = NOW();
+    RETURN NEW;
+END;
+$$;
+
+CREATE TRIGGER documents_set_updated_at BEFORE UPDATE ON documents
+    FOR EACH ROW EXECUTE FUNCTION set_updated_at();
+CREATE TRIGGER generated_docs_set_updated_at BEFORE UPDATE ON generated_docs
+    FOR EACH ROW EXECUTE FUNCTION set_updated_at();
+CREATE TRIGGER templates_set_updated_at BEFORE UPDATE ON templates
+    FOR EACH ROW EXECUTE FUNCTION set_updated_at();
+
+-- Per-user folder and tag aggregates, kept current by a trigger on documents so
+-- the sidebar listings read O(distinct values) rows instead of every document
+CREATE TABLE document_folders (
+    user_id TEXT NOT NULL,
+    folder_path TEXT NOT NULL,
+    document_count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, folder_path)
+);
+
+CREATE TABLE document_tags (
+    user_id TEXT NOT NULL,
+    tag TEXT NOT NULL,
+    document_count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, tag)
+);
+
+CREATE OR REPLACE FUNCTION adjust_document_aggregates(
+    target_user_id TEXT,
+    target_folder_path TEXT,
+    target_tags TEXT[],
+    delta INTEGER
+)
+RETURNS VOID
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    -- An empty folder_path means "no folder", the same as NULL
+    IF NULLIF(target_folder_path, '') IS NOT NULL THEN
+        INSERT INTO document_folders (user_id, folder_path, document_count)
+        VALUES (target_user_id, target_folder_path, delta)
+        ON CONFLICT (user_id, folder_path)
+        DO UPDATE SET document_count = document_folders.document_count + delta;
+        DELETE FROM document_folders
+        WHERE user_id = target_user_id AND folder_path = target_folder_path AND document_count <= 0;
+    END IF;
+
+    IF target_tags IS NOT NULL THEN
+        INSERT INTO document_tags (user_id, tag, document_count)
+        SELECT target_user_id, t, delta FROM (SELECT DISTINCT unnest(target_tags) AS t) distinct_tags
+        ON CONFLICT (user_id, tag)
+        DO UPDATE SET document_count = document_tags.document_count + delta;
+        DELETE FROM document_tags
+        WHERE user_id = target_user_id AND tag = ANY(target_tags) AND document_count <= 0;
+    END IF;
+END;
+$$;
+
+-- Runs as the table owner: the aggregate tables are read-only to users
+CREATE OR REPLACE FUNCTION maintain_document_aggregates()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM adjust_document_aggregates(OLD.user_id, OLD.folder_path, OLD.tags, -1);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM adjust_document_aggregates(NEW.user_id, NEW.folder_path, NEW.tags, 1);
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+CREATE TRIGGER documents_maintain_aggregates
+    AFTER INSERT OR DELETE OR UPDATE OF user_id, folder_path, tags ON documents
+    FOR EACH ROW EXECUTE FUNCTION maintain_document_aggregates();
+
+-- Backfill for databases that already have documents
+DELETE FROM document_folders WHERE folder_path = '';
+
+INSERT INTO document_folders (user_id, folder_path, document_count)
+SELECT user_id, folder_path, COUNT(*) FROM documents
+WHERE NULLIF(folder_path, '') IS NOT NULL
+GROUP BY user_id, folder_path
+ON CONFLICT DO NOTHING;
+
+INSERT INTO document_tags (user_id, tag, document_count)
+SELECT d.user_id, t.tag, COUNT(DISTINCT d.id)
+FROM documents d CROSS JOIN LATERAL unnest(d.tags) AS t(tag)
+GROUP BY d.user_id, t.tag
+ON CONFLICT DO NOTHING;
+
+-- Apply buffered template usage increments ({"template_id": n, ...}) in one statement
+CREATE OR REPLACE FUNCTION increment_template_usage(increments JSONB)
+RETURNS INTEGER
+LANGUAGE sql
+AS $$
+    WITH updated AS (
+        UPDATE templates t
+        SET usage_count = t.usage_count + i.value::integer
+        FROM jsonb_each_text(increments) AS i(key, value)
+        WHERE t.id = i.key
+        RETURNING 1
+    )
+    SELECT COUNT(*)::integer FROM updated;
+$$;
+
+-- Version history of generated documents: each version is a zlib-compressed
+-- snapshot or a compressed line diff against the previous version
+-- (payload is base64), with a snapshot at least every VERSION_SNAPSHOT_INTERVAL
+CREATE TABLE doc_versions (
+    id TEXT PRIMARY KEY,
+    generated_doc_id TEXT NOT NULL REFERENCES generated_docs(id) ON DELETE CASCADE,
+    version_number INTEGER NOT NULL,
+    kind TEXT NOT NULL CHECK (kind IN ('snapshot', 'delta')),
+    payload TEXT NOT NULL,
+    depth INTEGER NOT NULL DEFAULT 0,
+    content_hash TEXT NOT NULL,
+    content_length INTEGER NOT NULL,
+    stored_bytes INTEGER NOT NULL,
+    created_by TEXT NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    UNIQUE (generated_doc_id, version_number)
+);